@@ -0,0 +1,95 @@
+"""
+Benchmark of the per-hop cost of the sliding-window Burg spectrum
+
+Compares BufferNode + BurgSpectrumNode (every window is estimated from scratch) with IncrementalBurgSpectrumNode
+(lag products are updated with the samples entering and leaving the window) for different sliding window lengths.
+Both paths are fed with the same synthetic signal in chunks of hops_per_chunk shifts with catch_up=True, so every call
+outputs hops_per_chunk windows. The reported times are per window.
+
+Run from the root directory of the repository:
+    python -m benchmarks.burg_sliding_window
+"""
+
+import time
+
+import numpy as np
+
+from misc.PreprocessingFramework.BufferNode import BufferNode
+from misc.PreprocessingFramework.BurgSpectrumNode import BurgSpectrumNode
+from misc.PreprocessingFramework.IncrementalBurgSpectrumNode import IncrementalBurgSpectrumNode
+
+
+def time_per_hop(process, data: np.ndarray, timestamps: np.ndarray, chunk_size: int, warmup_samples: int) -> np.ndarray:
+    """Feeds data to process() in chunks of chunk_size samples and returns the duration of every call producing output"""
+    durations = []
+    for start in range(0, data.shape[-1] - chunk_size + 1, chunk_size):
+        t1 = time.perf_counter()
+        output = process(data[..., start:start + chunk_size], timestamps[start:start + chunk_size])
+        t2 = time.perf_counter()
+        if output is not None and start >= warmup_samples:
+            durations.append(t2 - t1)
+    return np.array(durations)
+
+
+def run(fs: float = 512.0, fs_out: float = 25.0, n_channels: int = 3, duration_seconds: float = 30.0,
+        sliding_window_seconds=(0.25, 0.4, 0.8, 1.0, 2.0), hops_per_chunk: int = 1):
+
+    channel_labels = [f"Ch{i}" for i in range(n_channels)]
+    shift = round(fs / fs_out)
+    chunk_size = shift * hops_per_chunk
+
+    rng = np.random.default_rng(1)
+    n_times = int(fs * duration_seconds)
+    timestamps = np.arange(n_times) / fs
+    data = rng.normal(size=(1, n_channels, n_times)) + np.sin(2 * np.pi * 11.0 * timestamps)
+
+    print(f"fs={fs}Hz, shift={shift} samples, {hops_per_chunk} shift(s) per chunk, {n_channels} channels, "
+          f"model order={int(fs/10)}")
+    print(f"{'window [s]':>10} {'samples':>8} {'scratch [ms]':>13} {'incremental [ms]':>17} {'speedup':>8} {'max rel. diff':>14}")
+
+    for window_seconds in sliding_window_seconds:
+        buffer_length = int(fs * window_seconds)
+
+        buffer_node = BufferNode(channel_labels, buffer_length=buffer_length, shift=shift, catch_up=True)
+        burg_node = BurgSpectrumNode(channel_labels, sfreq=fs)
+        incremental_node = IncrementalBurgSpectrumNode(channel_labels, sfreq=fs, buffer_length=buffer_length, shift=shift,
+                                                       catch_up=True)
+
+        scratch_outputs = []
+        incremental_outputs = []
+
+        def scratch(chunk, chunk_timestamps):
+            window, window_timestamps = buffer_node.process(chunk, chunk_timestamps)
+            if window is None:
+                return None
+            output, _ = burg_node.process(window, window_timestamps)
+            scratch_outputs.append(output)
+            return output
+
+        def incremental(chunk, chunk_timestamps):
+            output, _ = incremental_node.process(chunk, chunk_timestamps)
+            if output is not None:
+                incremental_outputs.append(output)
+            return output
+
+        warmup_samples = buffer_length + shift
+        t_scratch = time_per_hop(scratch, data, timestamps, chunk_size, warmup_samples) / hops_per_chunk
+        t_incremental = time_per_hop(incremental, data, timestamps, chunk_size, warmup_samples) / hops_per_chunk
+
+        scratch_outputs = np.concatenate(scratch_outputs, axis=-1)
+        incremental_outputs = np.concatenate(incremental_outputs, axis=-1)
+        difference = np.abs(scratch_outputs - incremental_outputs).max() / np.abs(scratch_outputs).max()
+
+        print(f"{window_seconds:>10.2f} {buffer_length:>8d} {np.median(t_scratch)*1000:>13.3f} "
+              f"{np.median(t_incremental)*1000:>17.3f} {np.median(t_scratch)/np.median(t_incremental):>8.2f} "
+              f"{difference:>14.2e}")
+
+
+if __name__ == '__main__':
+    from misc import kernels
+    kernels.warm_up()
+
+    for hops_per_chunk in (1, 8):
+        for n_channels in (3, 16, 64):
+            run(n_channels=n_channels, hops_per_chunk=hops_per_chunk)
+            print()
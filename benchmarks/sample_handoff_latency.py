@@ -0,0 +1,164 @@
+"""
+Latency of handing samples from one module process to another on the same host, via shared memory
+(misc.SharedMemoryTransport) and via LSL
+
+A producer process pushes chunks of a float32 stream at the given rate, the way the modules do (SharedMemoryOutlet,
+which also pushes to LSL, or StreamOutlet), and a consumer process receives them (SharedMemoryInlet.pull_chunk or
+StreamInlet.pull_chunk with a timeout). Every chunk carries the time it was pushed as timestamp (time.perf_counter,
+which is monotonic across processes), the consumer records the time from pushing to receiving. Reported are the
+percentiles of the hand-off latency per transport. Both transports need pylsl.
+
+Like LSL, the outlets back-date the earlier samples of a chunk by the sampling interval, so with --chunk > 1 the
+latencies include up to (chunk - 1) / fs of back-dating. The default of 1 sample per chunk measures the hand-off only.
+
+Run from the root directory of the repository:
+    python -m benchmarks.sample_handoff_latency
+    python -m benchmarks.sample_handoff_latency --fs 1000 --channels 64 --chunk 10 --duration 20
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+from queue import Empty
+from typing import List, Optional
+
+import numpy as np
+
+import globals
+
+
+STREAM_NAME = 'HandoffBenchmark'
+SOURCE_ID = 'uid_handoff_benchmark'
+
+# time the consumer is given to connect before the producer starts pushing
+CONNECT_SECONDS = 1.0
+# the consumer gives up if it receives nothing for this long, e.g. because samples were lost
+IDLE_SECONDS = 2.0
+
+
+def _produce(push, fs: float, n_channels: int, chunk_length: int, duration: float):
+    """Pushes chunks in real time, push(chunk, timestamps) gets the push time as timestamp of every sample"""
+    chunk = np.random.default_rng(0).normal(size=(chunk_length, n_channels)).astype(np.float32)
+    n_chunks = int(duration * fs / chunk_length)
+    t_next = time.perf_counter()
+    for _ in range(n_chunks):
+        t_next += chunk_length / fs
+        while time.perf_counter() < t_next:
+            time.sleep(max(0.0, min(1e-3, t_next - time.perf_counter())))
+        push(chunk, np.full(chunk_length, time.perf_counter()))
+
+
+def _stream_info(fs: float, n_channels: int):
+    import pylsl
+    return pylsl.StreamInfo(STREAM_NAME, 'benchmark', n_channels, fs, pylsl.cf_float32, SOURCE_ID)
+
+
+def _receive(inlet, n_samples: int, max_samples: int, n_channels: int, closed=lambda: False) -> list:
+    """Pulls until n_samples were received, the stream is closed or nothing arrived for IDLE_SECONDS"""
+    dest = np.empty((max_samples, n_channels), dtype=np.float32)
+    latencies = []
+    t_last = time.perf_counter()
+    while len(latencies) < n_samples:
+        _, timestamps = inlet.pull_chunk(timeout=0.2, max_samples=max_samples, dest_obj=dest)
+        received = time.perf_counter()
+        if timestamps:
+            latencies.extend(received - np.asarray(timestamps))
+            t_last = received
+        elif closed() or received - t_last > IDLE_SECONDS:
+            break
+    return latencies
+
+
+def _consume_shared_memory(queue: multiprocessing.Queue, fs: float, n_channels: int, n_samples: int,
+                           max_samples: int):
+    from misc.SharedMemoryTransport import SharedMemoryInlet
+    inlet = None
+    while inlet is None:
+        try:
+            inlet = SharedMemoryInlet(_stream_info(fs, n_channels))
+        except (FileNotFoundError, ValueError):
+            time.sleep(0.01)
+
+    latencies = _receive(inlet, n_samples, max_samples, n_channels, closed=lambda: inlet.ring.closed)
+    inlet.close_stream()
+    queue.put(latencies)
+
+
+def _consume_lsl(queue: multiprocessing.Queue, fs: float, n_channels: int, n_samples: int, max_samples: int):
+    import pylsl
+    streams = pylsl.resolve_byprop('name', STREAM_NAME, minimum=1, timeout=10)
+    inlet = pylsl.StreamInlet(streams[0], max_buflen=360, max_chunklen=1, recover=True)
+
+    latencies = _receive(inlet, n_samples, max_samples, n_channels)
+    inlet.close_stream()
+    queue.put(latencies)
+
+
+def run_transport(transport: str, fs: float, n_channels: int, chunk_length: int, duration: float) -> np.ndarray:
+    """:return: hand-off latencies in seconds of all received samples"""
+    import pylsl
+    from misc.SharedMemoryTransport import SharedMemoryOutlet
+
+    n_samples = int(duration * fs / chunk_length) * chunk_length
+    max_samples = max(1, int(fs * 0.2))
+
+    queue = multiprocessing.Queue()
+    if transport == 'shm':
+        outlet = SharedMemoryOutlet(_stream_info(fs, n_channels), chunk_size=1)
+        consumer = multiprocessing.Process(target=_consume_shared_memory,
+                                           args=(queue, fs, n_channels, n_samples, max_samples))
+        connect_seconds = CONNECT_SECONDS
+    else:
+        outlet = pylsl.StreamOutlet(_stream_info(fs, n_channels), chunk_size=1)
+        consumer = multiprocessing.Process(target=_consume_lsl, args=(queue, fs, n_channels, n_samples, max_samples))
+        connect_seconds = CONNECT_SECONDS + 1.0
+
+    consumer.start()
+    time.sleep(connect_seconds)
+    _produce(lambda chunk, timestamps: outlet.push_chunk(chunk, timestamps[-1]), fs, n_channels, chunk_length,
+             duration)
+    if transport == 'shm':
+        # the consumer reads the remaining samples and stops once the ring is closed
+        outlet.close()
+
+    try:
+        latencies = queue.get(timeout=IDLE_SECONDS + 10.0)
+    except Empty:
+        consumer.terminate()
+        raise RuntimeError(f"The {transport} consumer did not report its latencies")
+    consumer.join()
+    return np.asarray(latencies)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Hand-off latency between processes via shared memory and LSL")
+    parser.add_argument('--fs', type=float, default=500.0, help="sampling rate in Hz")
+    parser.add_argument('--channels', type=int, default=16, help="channel count")
+    parser.add_argument('--chunk', type=int, default=1, help="chunk length in samples")
+    parser.add_argument('--duration', type=float, default=10.0, help="duration per transport in s")
+    parser.add_argument('--transports', nargs='+', choices=('shm', 'lsl'), default=['shm', 'lsl'])
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    multiprocessing.set_start_method('spawn')
+
+    print(f"\n{args.channels} channels, {args.fs}Hz, chunks of {args.chunk} samples, {args.duration:.1f}s\n")
+    print(f"{'transport':<10} {'samples':>8} {'median [ms]':>12} {'p99 [ms]':>10} {'max [ms]':>10}")
+
+    for transport in args.transports:
+        if not globals.LSLAvailable:
+            print(f"{transport:<10} skipped, pylsl is not installed")
+            continue
+        latencies = run_transport(transport, args.fs, args.channels, args.chunk, args.duration) * 1000
+        print(f"{transport:<10} {len(latencies):>8d} {np.median(latencies):>12.3f} "
+              f"{np.percentile(latencies, 99):>10.3f} {np.max(latencies):>10.3f}")
+
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Headless throughput benchmark of the SMR ERD pipeline
+
+Builds the pipeline of create_smr_erd_pipeline() like the preprocessing module does (common pipeline followed by the
+EOG and EEG branches, compiled) and feeds it with a synthetic EEG signal at maximum speed, without LSL. Every
+combination of sampling rate, channel count, chunk size and sliding window length is benchmarked and the throughput in
+samples per second, the percentiles of the processing time per chunk and the real-time factor (duration of the signal
+divided by the processing time) are reported.
+
+Results are written to a JSON file with --output. With --compare the results are compared with a stored baseline and
+configurations which got slower by more than --threshold are flagged as regressions (exit code 1).
+
+Run from the root directory of the repository:
+    python -m benchmarks.smr_erd_throughput --output results.json
+    python -m benchmarks.smr_erd_throughput --quick --compare baseline.json
+    python -m benchmarks.smr_erd_throughput --results results.json --compare baseline.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+import scipy
+
+from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline, combine_smr_erd_pipelines
+
+
+SAMPLE_RATES = (250, 500, 1000, 2000)
+CHANNEL_COUNTS = (8, 16, 32, 64)
+CHUNK_SIZES = (1, 16, 64)
+WINDOW_SECONDS = (0.4, 1.0)
+
+QUICK_SAMPLE_RATES = (250, 1000)
+QUICK_CHANNEL_COUNTS = (8, 32)
+QUICK_CHUNK_SIZES = (16,)
+QUICK_WINDOW_SECONDS = (0.4,)
+
+SPATIAL_FILTER_OUTPUT_LABELS = ['bipolar EOG', 'C3', 'C4', 'CZ']
+
+# metrics compared with the baseline and whether larger values are better
+COMPARED_METRICS = {'samples_per_second': True, 'p95_ms': False}
+
+
+def synthetic_eeg(fs: float, n_channels: int, duration_seconds: float, seed: int = 1) -> (np.ndarray, np.ndarray):
+    """
+    Brown noise with an 11Hz rhythm which is modulated like an ERD and 50Hz line noise
+    :return: data of shape (n_channels, n_times) and timestamps
+    """
+    rng = np.random.default_rng(seed)
+    n_times = int(fs * duration_seconds)
+    timestamps = np.arange(n_times) / fs
+
+    noise = np.cumsum(rng.normal(size=(n_channels, n_times)), axis=-1) * 0.1
+    noise -= noise.mean(axis=-1, keepdims=True)
+    modulation = 1 + 0.5 * np.sin(2 * np.pi * 0.2 * timestamps)
+    rhythm = modulation * np.sin(2 * np.pi * 11.0 * timestamps + rng.uniform(0, 2 * np.pi, size=(n_channels, 1)))
+    line_noise = 2 * np.sin(2 * np.pi * 50.0 * timestamps)
+
+    return noise + rhythm + line_noise, timestamps
+
+
+def spatial_filter_weights(n_channels: int) -> np.ndarray:
+    """Bipolar EOG of the first two channels and three EEG channels re-referenced to the common average"""
+    weights = np.zeros((len(SPATIAL_FILTER_OUTPUT_LABELS), n_channels))
+    weights[0, 0] = 1
+    weights[0, 1] = -1
+    for i_out in range(1, len(SPATIAL_FILTER_OUTPUT_LABELS)):
+        weights[i_out] = -1 / n_channels
+        weights[i_out, 1 + i_out] += 1
+    return weights
+
+
+def run_config(fs: float, n_channels: int, chunk_size: int, window_seconds: float, duration_seconds: float,
+               compiled: bool = True, dtype: str = 'float64', warmup_seconds: float = 1.0) -> dict:
+    """
+    Benchmarks a single configuration
+    :return: dict of the configuration and the metrics, times in milliseconds
+    """
+    channel_labels = [f"Ch{i}" for i in range(n_channels)]
+    common_pipeline, eeg_pipeline, eog_pipeline, fs_out = create_smr_erd_pipeline(
+        channel_labels, fs=fs, spatial_filter_weight_matrix=spatial_filter_weights(n_channels),
+        spatial_filter_output_labels=SPATIAL_FILTER_OUTPUT_LABELS, channels_eeg_processing=['C3', 'C4', 'CZ'],
+        sliding_window_seconds=window_seconds, buffer_catch_up=True, dtype=dtype)
+
+    pipeline = combine_smr_erd_pipelines(common_pipeline, eeg_pipeline, eog_pipeline)
+    if compiled:
+        pipeline = pipeline.compile()
+
+    data, timestamps = synthetic_eeg(fs, n_channels, duration_seconds + warmup_seconds)
+    data = data.astype(dtype)[np.newaxis]
+    warmup_samples = int(fs * warmup_seconds)
+
+    durations = []
+    n_outputs = 0
+    try:
+        for start in range(0, data.shape[-1] - chunk_size + 1, chunk_size):
+            chunk = data[..., start:start + chunk_size]
+            chunk_timestamps = timestamps[start:start + chunk_size]
+
+            t_start = time.perf_counter()
+            output, _ = pipeline.process(chunk, chunk_timestamps)
+            duration = time.perf_counter() - t_start
+
+            if start >= warmup_samples:
+                durations.append(duration)
+                if output is not None:
+                    n_outputs += output.shape[-1]
+    finally:
+        pipeline.close()
+
+    durations = np.array(durations)
+    total_time = durations.sum()
+    n_samples = len(durations) * chunk_size
+    p50, p95, p99 = np.percentile(durations, (50, 95, 99)) * 1000
+
+    return dict(fs=fs, n_channels=n_channels, chunk_size=chunk_size, window_seconds=window_seconds,
+                compiled=compiled, dtype=dtype, fs_out=fs_out,
+                n_chunks=len(durations), n_samples=n_samples, n_outputs=n_outputs,
+                samples_per_second=n_samples / total_time,
+                mean_ms=durations.mean() * 1000, p50_ms=p50, p95_ms=p95, p99_ms=p99, max_ms=durations.max() * 1000,
+                realtime_factor=(n_samples / fs) / total_time)
+
+
+def config_key(result: dict) -> str:
+    return (f"fs={result['fs']:g} channels={result['n_channels']} chunk={result['chunk_size']} "
+            f"window={result['window_seconds']:g}s compiled={result['compiled']} {result['dtype']}")
+
+
+def metadata() -> dict:
+    return dict(created=datetime.datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                numpy=np.__version__, scipy=scipy.__version__, platform=platform.platform(),
+                processor=platform.processor(), machine=platform.machine())
+
+
+def run(sample_rates=SAMPLE_RATES, channel_counts=CHANNEL_COUNTS, chunk_sizes=CHUNK_SIZES,
+        window_seconds=WINDOW_SECONDS, duration_seconds: float = 10.0, compiled: bool = True,
+        dtype: str = 'float64') -> dict:
+    results = []
+
+    print(f"{'configuration':<62} {'samples/s':>11} {'p50 [ms]':>9} {'p95 [ms]':>9} {'p99 [ms]':>9} "
+          f"{'max [ms]':>9} {'RT factor':>10}")
+
+    for fs, n_channels, chunk_size, window in itertools.product(sample_rates, channel_counts, chunk_sizes, window_seconds):
+        result = run_config(fs, n_channels, chunk_size, window, duration_seconds, compiled=compiled, dtype=dtype)
+        results.append(result)
+        print(f"{config_key(result):<62} {result['samples_per_second']:>11.0f} {result['p50_ms']:>9.3f} "
+              f"{result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['max_ms']:>9.3f} "
+              f"{result['realtime_factor']:>10.1f}")
+
+    return dict(metadata=metadata(), duration_seconds=duration_seconds, results=results)
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.1) -> List[str]:
+    """
+    Compares the results with a baseline, configurations are matched by config_key()
+    :param threshold: relative change of a metric in the worse direction which is flagged as regression
+    :return: list of regressions
+    """
+    baseline_results = {config_key(result): result for result in baseline['results']}
+    regressions = []
+
+    print(f"\nComparison with the baseline of {baseline.get('metadata', {}).get('created', 'unknown date')}, "
+          f"threshold {threshold:.0%}:")
+    print(f"{'configuration':<62} " + " ".join(f"{metric:>31}" for metric in COMPARED_METRICS))
+
+    for result in results['results']:
+        key = config_key(result)
+        reference = baseline_results.get(key)
+        if reference is None:
+            print(f"{key:<62} {'not in baseline':>31}")
+            continue
+
+        columns = []
+        for metric, larger_is_better in COMPARED_METRICS.items():
+            change = result[metric] / reference[metric] - 1
+            regression = -change > threshold if larger_is_better else change > threshold
+            if regression:
+                regressions.append(f"{key}: {metric} {reference[metric]:.4g} -> {result[metric]:.4g} ({change:+.1%})")
+            columns.append(f"{reference[metric]:>10.4g} -> {result[metric]:<10.4g}{change:+6.0%}{'!' if regression else ' '}")
+
+        print(f"{key:<62} " + " ".join(columns))
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print("\nNo regressions.")
+
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the SMR ERD pipeline")
+    parser.add_argument('--fs', type=float, nargs='+', help=f"sampling rates in Hz (default {SAMPLE_RATES})")
+    parser.add_argument('--channels', type=int, nargs='+', help=f"channel counts (default {CHANNEL_COUNTS})")
+    parser.add_argument('--chunk', type=int, nargs='+', help=f"chunk sizes in samples (default {CHUNK_SIZES})")
+    parser.add_argument('--window', type=float, nargs='+', help=f"sliding window lengths in s (default {WINDOW_SECONDS})")
+    parser.add_argument('--quick', action='store_true', help="small matrix for a quick check")
+    parser.add_argument('--duration', type=float, default=10.0, help="duration of the synthetic signal in s")
+    parser.add_argument('--dtype', default='float64', help="dtype of the pipeline")
+    parser.add_argument('--no-compile', action='store_true', help="run the pipeline without compiling it")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--results', help="load the results from this JSON file instead of running the benchmark")
+    parser.add_argument('--compare', help="baseline JSON file to compare the results with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative slowdown which is flagged as regression (default 0.1)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.results:
+        with open(args.results, 'r') as fp:
+            results = json.load(fp)
+    else:
+        results = run(sample_rates=args.fs or (QUICK_SAMPLE_RATES if args.quick else SAMPLE_RATES),
+                      channel_counts=args.channels or (QUICK_CHANNEL_COUNTS if args.quick else CHANNEL_COUNTS),
+                      chunk_sizes=args.chunk or (QUICK_CHUNK_SIZES if args.quick else CHUNK_SIZES),
+                      window_seconds=args.window or (QUICK_WINDOW_SECONDS if args.quick else WINDOW_SECONDS),
+                      duration_seconds=args.duration, compiled=not args.no_compile, dtype=args.dtype)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, threshold=args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
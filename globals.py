@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 import pathlib
 import sys
 import os
@@ -20,6 +20,10 @@ STREAM_NAME_PREPROCESSED_SIGNAL: str = 'PreprocessedData'
 STREAM_NAME_CLASSIFIED_SIGNAL: str = 'ClassifierOutput'
 STREAM_NAME_TASK_EVENTS: str = 'TaskOutput'
 STREAM_NAME_FEEDBACK_STATES: str = 'FeedbackStates'
+# per-node timing statistics of the preprocessing pipeline (only if enabled in the preprocessing module)
+STREAM_NAME_PIPELINE_TELEMETRY: str = 'PipelineTelemetry'
+# origin and processing timestamps of the samples output by every stage (only if LATENCY_TRACING is enabled)
+STREAM_NAME_LATENCY_TRACE: str = 'LatencyTrace'
 
 
 # Path where to store experiment data
@@ -40,6 +44,22 @@ FEEDBACK_FRAMERATE: int = 60
 # if true, modules will sent true timestamps instead of those of the processed sample, which gives information about delays but hardens later analysis
 OUTPUT_TRUE_TIMESTAMPS: bool = False
 
+# if true, every stage from preprocessing to feedback publishes the origin timestamp and the time it is done with each
+# sample as latency trace (see misc.LatencyTracer). The data timestamps are not affected
+LATENCY_TRACING: bool = False
+
+# the latency traces of all stages are recorded with the data
+if LATENCY_TRACING:
+    RECORD_STREAMS.append(STREAM_NAME_LATENCY_TRACE)
+
+# backend of the DSP kernels in misc.kernels: 'numpy', 'numba' or None to use numba if it is installed
+KERNEL_BACKEND: Optional[str] = None
+
+# streams which are additionally published in shared memory (see misc.SharedMemoryTransport) and received from it by
+# consumers on the same host, e.g. [STREAM_NAME_PREPROCESSED_SIGNAL, STREAM_NAME_CLASSIFIED_SIGNAL]. They are still
+# published via LSL for LabRecorder and consumers on other hosts. Only used on x86 hosts, LSL only on others
+SHARED_MEMORY_STREAMS: List[str] = []
+
 
 # =========================================================================== #
 # Global variables                                                            #
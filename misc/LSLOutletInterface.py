@@ -0,0 +1,105 @@
+import ctypes
+from typing import Optional
+
+import numpy as np
+import pylsl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# NumPy dtypes of the LSL channel formats. Contiguous arrays of these dtypes are handed to liblsl without conversion.
+CHANNEL_FORMAT_DTYPES = {
+    pylsl.cf_float32: np.float32,
+    pylsl.cf_double64: np.float64,
+    pylsl.cf_int8: np.int8,
+    pylsl.cf_int16: np.int16,
+    pylsl.cf_int32: np.int32,
+    pylsl.cf_int64: np.int64,
+}
+
+# set to False after the first failed attempt to push a chunk with one timestamp per sample (older pylsl versions)
+_timestamp_arrays_supported: Optional[bool] = None
+
+
+def push_chunk(outlet: pylsl.StreamOutlet, data, timestamps=None, pushthrough: bool = True):
+    """
+    Pushes a chunk of samples from a NumPy array to an LSL outlet with a single push_chunk call.
+
+    The data is converted to a contiguous array of the outlet's channel format (e.g. float32 for cf_float32) only if
+    necessary and then passed to liblsl as a buffer, without converting it to a list first.
+
+    :param outlet: pylsl.StreamOutlet
+    :param data: shape (n_samples, n_channels). A 1-D array is pushed as a single sample
+    :param timestamps: None to use the time of pushing, a single timestamp of the most recent sample or one timestamp
+                       per sample. Missing timestamps (None or NaN) are replaced by the current local clock
+    :param pushthrough: push the chunk through to the receivers instead of buffering it with subsequent samples
+    """
+    dtype = CHANNEL_FORMAT_DTYPES.get(outlet.channel_format)
+    if dtype is None:
+        # string streams can only be pushed as lists
+        outlet.push_chunk(np.atleast_2d(data).tolist(), _scalar_timestamp(timestamps), pushthrough)
+        return
+
+    data = np.ascontiguousarray(data, dtype=dtype)
+    if not data.flags.writeable:
+        # pylsl needs a writable buffer, e.g. the windows of BufferNode are read-only views
+        data = data.copy()
+    if data.ndim == 1:
+        data = data.reshape((1, -1))
+
+    n_samples = data.shape[0]
+    if n_samples == 0:
+        return
+
+    if timestamps is None or np.isscalar(timestamps):
+        outlet.push_chunk(data, _scalar_timestamp(timestamps), pushthrough)
+        return
+
+    timestamps = np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
+    if len(timestamps) != n_samples:
+        if len(timestamps) > 1:
+            logger.warning(f"Got {len(timestamps)} timestamps for {n_samples} samples. Using the last one for the most recent sample.")
+        outlet.push_chunk(data, _scalar_timestamp(timestamps[-1]), pushthrough)
+        return
+
+    missing = np.isnan(timestamps)
+    if missing.any():
+        timestamps[missing] = pylsl.local_clock()
+
+    if n_samples == 1:
+        outlet.push_chunk(data, float(timestamps[0]), pushthrough)
+        return
+
+    _push_chunk_with_timestamps(outlet, data, timestamps, pushthrough)
+
+
+def _scalar_timestamp(timestamp) -> float:
+    """LSL uses 0.0 for 'now'"""
+    if timestamp is None or np.isnan(timestamp):
+        return 0.0
+    return float(timestamp)
+
+
+def _push_chunk_with_timestamps(outlet: pylsl.StreamOutlet, data: np.ndarray, timestamps: np.ndarray, pushthrough: bool):
+    global _timestamp_arrays_supported
+
+    if _timestamp_arrays_supported is not False:
+        try:
+            outlet.push_chunk(data, timestamps, pushthrough)
+            _timestamp_arrays_supported = True
+            return
+        except (TypeError, ctypes.ArgumentError):
+            logger.info("pylsl does not support one timestamp per sample in push_chunk(). Falling back.")
+            _timestamp_arrays_supported = False
+
+    # LSL back-dates the samples of a chunk by the nominal sampling interval. If the timestamps are spaced like that,
+    # the timestamp of the most recent sample is sufficient
+    srate = outlet.get_info().nominal_srate()
+    if srate != pylsl.IRREGULAR_RATE and np.allclose(np.diff(timestamps), 1.0 / srate, rtol=1e-3, atol=0):
+        outlet.push_chunk(data, float(timestamps[-1]), pushthrough)
+        return
+
+    for sample, timestamp in zip(data, timestamps):
+        outlet.push_sample(sample, float(timestamp), pushthrough)
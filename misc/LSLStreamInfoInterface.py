@@ -2,8 +2,6 @@ import pylsl
 from typing import List, Dict, Union
 import warnings
 
-from misc import XDF_utils
-
 
 # ===========================================#
 #       Writing to stream info               #
@@ -65,6 +63,8 @@ def find_stream(xdf_data, stream_names) -> Dict[str, dict]:
     "This function is deprecated and will be removed in a future release. Use XDF_utils.find_stream() instead.",
     DeprecationWarning, stacklevel=2)
 
+    # imported on use, XDF_utils pulls in typeguard and every module imports this file
+    from misc import XDF_utils
     return XDF_utils.find_stream(xdf_data, stream_names)
 
 
@@ -76,6 +76,7 @@ def find_channel_index(stream, channel_names):
         "This function is deprecated and will be removed in a future release. Use XDF_utils.find_channel_index() instead.",
         DeprecationWarning, stacklevel=2)
 
+    from misc import XDF_utils
     return XDF_utils.find_channel_index(stream, channel_names)
 
 
@@ -105,4 +106,5 @@ def get_parameters_from_xdf_stream(xdf_stream) -> Dict[str, Union[str, int, floa
     """
     warnings.warn("This function is deprecated and will be removed in a future release. Use XDF_utils.get_parameters_from_xdf_stream() instead.", DeprecationWarning, stacklevel=2)
 
+    from misc import XDF_utils
     return XDF_utils.get_parameters_from_xdf_stream(xdf_stream)
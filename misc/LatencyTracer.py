@@ -0,0 +1,71 @@
+import random
+from typing import List
+
+import numpy as np
+import pylsl
+
+import globals
+from misc import LSLStreamInfoInterface
+from misc.LSLOutletInterface import push_chunk
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracer(object):
+    """
+    Side-channel LSL stream for measuring the closed-loop latency from the raw EEG sample to the feedback frame.
+
+    Every stage of the processing chain (preprocessing, classification, task, feedback) creates one tracer and traces
+    the samples it outputs. For every sample one trace sample with the origin timestamp (the timestamp of the raw EEG
+    sample the output originates from) and the LSL clock at the time the stage is done with it is pushed. The timestamps
+    of the data streams are not touched. Since the modules propagate the data timestamps, the origin timestamp of an
+    output is its data timestamp, which requires OUTPUT_TRUE_TIMESTAMPS to be disabled.
+
+    All stages publish to streams with the same name, the stage is stored in the stream description. The recorded
+    traces are evaluated with tools/latency_analyzer.py. The stage timestamps of different computers are only
+    comparable if their clocks are synchronized, run all stages on one computer for meaningful results.
+    """
+
+    CHANNEL_NAMES: List[str] = ['origin timestamp', 'stage timestamp']
+
+    def __init__(self, stage: str, stream_name: str = globals.STREAM_NAME_LATENCY_TRACE):
+        """
+        :param stage: name of the stage, e.g. the name of the module
+        :param stream_name: name of the LSL stream
+        """
+        self.stage: str = stage
+
+        if globals.OUTPUT_TRUE_TIMESTAMPS:
+            logger.warning(f"Latency tracing of {stage}: OUTPUT_TRUE_TIMESTAMPS is enabled, the data timestamps are "
+                           f"not the origin timestamps and the traces of the stages can not be matched.")
+
+        self.lsl_stream_info = pylsl.StreamInfo(
+            name=stream_name, type='Latency', channel_count=len(self.CHANNEL_NAMES),
+            nominal_srate=pylsl.IRREGULAR_RATE, channel_format=pylsl.cf_double64,
+            source_id=f"{stream_name} {stage} {random.randint(100000, 999999)}")
+        LSLStreamInfoInterface.add_channel_names(self.lsl_stream_info, self.CHANNEL_NAMES)
+        self.lsl_stream_info.desc().append_child_value('stage', stage)
+
+        self.lsl_outlet = pylsl.StreamOutlet(self.lsl_stream_info)
+
+    def trace(self, origin_timestamps):
+        """
+        Pushes one trace sample per origin timestamp, all with the current LSL clock as stage timestamp
+        :param origin_timestamps: a single timestamp or the data timestamps of the samples output by the stage
+        """
+        origin_timestamps = np.asarray(origin_timestamps, dtype=np.float64).reshape(-1)
+        if len(origin_timestamps) == 0:
+            return
+
+        stage_timestamp = pylsl.local_clock()
+
+        trace = np.empty((len(origin_timestamps), len(self.CHANNEL_NAMES)))
+        trace[:, 0] = origin_timestamps
+        trace[:, 1] = stage_timestamp
+
+        push_chunk(self.lsl_outlet, trace, stage_timestamp)
+
+    def close(self):
+        self.lsl_outlet = None
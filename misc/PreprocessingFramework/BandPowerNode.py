@@ -0,0 +1,398 @@
+from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data, sub_state
+from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
+from misc.PreprocessingFramework.BufferNode import BufferNode
+from misc import kernels
+
+from typing import List, Optional, Dict, Type
+
+import collections.abc
+
+import numpy as np
+from scipy import signal
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BandPowerEngine(object):
+    """
+    Estimator of the power in frequency bins around foi, used by BandPowerNode.
+
+    All engines share the settings of BurgSpectrumNode: nbins bins of bin_width Hz centered around foi, evaluated at
+    evals_per_bin frequencies per bin where applicable. The power is the variance of the signal in the bin, e.g. A^2/2
+    for a sinusoid of amplitude A (less for windows whose spectral leakage exceeds the bin), so the absolute values
+    differ from the empirically scaled Burg spectrum.
+
+    Window engines (streaming = False) estimate the power of windows of buffer_length samples in power(). Streaming
+    engines (streaming = True) update an estimate with every sample in stream() and keep their state across calls.
+    """
+
+    streaming: bool = False
+
+    def __init__(self, sfreq: float, buffer_length: int, foi: float = 11, nbins: int = 1, bin_width: float = 3.0,
+                 evals_per_bin: int = 15, dtype=np.float64):
+        self.sfreq: float = sfreq
+        self.buffer_length: int = buffer_length
+        self.foi: float = foi
+        self.nbins: int = nbins
+        self.bin_width: float = bin_width
+        self.evals_per_bin: int = evals_per_bin
+        self.dtype: np.dtype = np.dtype(dtype)
+
+        # same bins as BurgSpectrumPlan
+        start_freq = foi - nbins // 2 * bin_width - bin_width / 2
+        self.bin_edges: np.ndarray = start_freq + bin_width * np.arange(nbins + 1)
+        self.frequencies: np.ndarray = self.bin_edges[:-1] + bin_width / 2
+
+    def sub_band_frequencies(self) -> np.ndarray:
+        """
+        evals_per_bin frequencies in the center of equally wide sub-bands of every bin
+        :return: shape (nbins * evals_per_bin,), ordered by bin
+        """
+        offsets = (np.arange(self.evals_per_bin) + 0.5) / self.evals_per_bin * self.bin_width
+        return (self.bin_edges[:-1, np.newaxis] + offsets).reshape(-1)
+
+    def sub_band_scale(self, taper: np.ndarray) -> float:
+        """
+        Factor which turns the squared magnitudes of the DFTs of the tapered window at sub_band_frequencies() into the
+        power per frequency (see FFTBandPowerEngine) integrated over the sub-bands
+        """
+        return 2 * (self.bin_width / self.evals_per_bin) / (self.sfreq * np.sum(taper ** 2))
+
+    def power(self, windows: np.ndarray) -> np.ndarray:
+        """
+        :param windows: shape (n_windows, n_channels, buffer_length)
+        :return: power per bin, shape (n_windows, n_channels, nbins)
+        """
+        raise NotImplementedError
+
+    def stream(self, data: np.ndarray) -> np.ndarray:
+        """
+        :param data: shape (n_trials, n_channels, n_times)
+        :return: power per bin after every sample, shape (n_trials, n_channels, nbins, n_times)
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        pass
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return dict()
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        pass
+
+
+class FFTBandPowerEngine(BandPowerEngine):
+    """
+    Periodogram of the Hann-windowed window (Welch with a single segment), zero-padded to the frequency resolution of
+    the Burg spectrum. The taper, the scaling and the bin masks are computed once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.nfft: int = max(self.buffer_length, int(self.sfreq / (self.bin_width / self.evals_per_bin)))
+        self.fres: float = self.sfreq / self.nfft
+        freqs = np.fft.rfftfreq(self.nfft, 1 / self.sfreq)
+
+        self._taper: np.ndarray = signal.windows.hann(self.buffer_length, sym=False).astype(self.dtype)
+        # one-sided power spectral density times the frequency resolution, i.e. power per frequency
+        self._scale: float = 2 * self.fres / (self.sfreq * np.sum(self._taper.astype(np.float64) ** 2))
+
+        masks = [(freqs >= low) & (freqs < high) for low, high in zip(self.bin_edges[:-1], self.bin_edges[1:])]
+        # the evaluated frequencies and a matrix summing them per bin
+        self._eval_indices: np.ndarray = np.flatnonzero(np.any(masks, axis=0))
+        self._bin_sums: np.ndarray = np.stack([mask[self._eval_indices] for mask in masks], axis=-1).astype(np.float64)
+
+    def power(self, windows: np.ndarray) -> np.ndarray:
+        spectrum = np.fft.rfft(windows * self._taper, self.nfft, axis=-1)[..., self._eval_indices]
+        return (spectrum.real ** 2 + spectrum.imag ** 2) @ self._bin_sums * self._scale
+
+
+class DFTBandPowerEngine(BandPowerEngine):
+    """
+    DFT of the Hann-windowed window evaluated only at evals_per_bin frequencies per bin, the frequencies need not lie
+    on the FFT grid. Computed for every window as one product with precomputed cosine and sine tables, which is cheaper
+    than GoertzelBandPowerEngine for short windows and few frequencies. With nbins=1 and evals_per_bin=1 this is a
+    single-frequency readout at foi.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        frequencies = self.sub_band_frequencies()
+        taper = signal.windows.hann(self.buffer_length, sym=False)
+        phases = 2 * np.pi * np.outer(np.arange(self.buffer_length), frequencies) / self.sfreq
+        self._cos: np.ndarray = (taper[:, np.newaxis] * np.cos(phases)).astype(self.dtype)
+        self._sin: np.ndarray = (taper[:, np.newaxis] * np.sin(phases)).astype(self.dtype)
+        self._scale: float = self.sub_band_scale(taper)
+
+    def power(self, windows: np.ndarray) -> np.ndarray:
+        re = windows @ self._cos
+        im = windows @ self._sin
+        power = (re * re + im * im).reshape(windows.shape[:-1] + (self.nbins, self.evals_per_bin))
+        return power.sum(axis=-1) * self._scale
+
+
+class GoertzelBandPowerEngine(BandPowerEngine):
+    """
+    Sliding Goertzel: the DFT of the Hann-windowed last buffer_length samples at evals_per_bin frequencies per bin,
+    updated recursively with every sample, so the cost per sample does not depend on the window length. The
+    frequencies need not lie on the DFT grid of the window. With nbins=1 and evals_per_bin=1 this is a single-frequency
+    readout at foi.
+
+    Every frequency is tracked by a comb filter and Goertzel resonators (misc.kernels.sliding_goertzel), the Hann
+    window is applied in the frequency domain as 0.5 X(f) - 0.25 X(f - sfreq/N) - 0.25 X(f + sfreq/N) for a window of
+    N samples. The last N samples and the resonator states carry across calls and are kept in float64.
+
+    Per sample this costs 3 * nbins * evals_per_bin resonator updates independent of the window length, whereas
+    DFTBandPowerEngine costs 2 * nbins * evals_per_bin * buffer_length / shift multiply-adds per sample. At the window
+    lengths of the SMR pipeline the DFT is still faster, tools/band_power_comparison.py measures both.
+    """
+
+    streaming: bool = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        frequencies = self.sub_band_frequencies()
+
+        # the three DFTs of the Hann window per frequency in rad/sample, shape (n_frequencies, 3)
+        self._omega: np.ndarray = 2 * np.pi * (frequencies[:, np.newaxis] + np.array([-1, 0, 1]) * self.sfreq /
+                                               self.buffer_length) / self.sfreq
+        self._hann: np.ndarray = np.array([-0.25, 0.5, -0.25])
+        self._scale: float = self.sub_band_scale(signal.windows.hann(self.buffer_length, sym=False))
+
+        # last buffer_length input samples and the resonator states, per signal
+        self._history: Optional[np.ndarray] = None
+        self._state: Optional[np.ndarray] = None
+
+    def stream(self, data: np.ndarray) -> np.ndarray:
+        n_trials, n_channels, n_times = data.shape
+        n_signals = n_trials * n_channels
+
+        if self._history is None or len(self._history) != n_signals:
+            self._history = np.zeros((n_signals, self.buffer_length))
+            self._state = np.zeros((n_signals,) + self._omega.shape + (4,))
+
+        extended = np.concatenate([self._history, data.reshape((n_signals, n_times))], axis=-1, dtype=np.float64)
+        self._history = extended[:, -self.buffer_length:].copy()
+
+        power, self._state = kernels.sliding_goertzel(extended, self.buffer_length, self._omega, self._hann,
+                                                      self._state)
+
+        power = power.reshape((n_signals, self.nbins, self.evals_per_bin, n_times)).sum(axis=2) * self._scale
+        return power.reshape((n_trials, n_channels, self.nbins, n_times)).astype(self.dtype, copy=False)
+
+    def clear(self):
+        self._history = None
+        self._state = None
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if self._history is None:
+            return dict()
+        return dict(history=self._history, resonators=self._state)
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self.clear()
+        if 'history' in state:
+            self._history = np.array(state['history'], dtype=np.float64)
+            self._state = np.array(state['resonators'], dtype=np.float64)
+
+
+class DemodulationBandPowerEngine(BandPowerEngine):
+    """
+    Complex demodulation: every sample is shifted by the center frequency of each bin to 0Hz and lowpass filtered
+    with a 2nd order Butterworth filter with a cutoff of half the bin width. The power is the squared magnitude of
+    this envelope, the cost per sample is constant and does not depend on the window length. The filter state and the
+    phase of the demodulation carry across calls.
+    """
+
+    streaming: bool = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.sos: np.ndarray = signal.butter(2, self.bin_width / 2, btype='lowpass', fs=self.sfreq, output='sos')
+        self._omega: np.ndarray = 2 * np.pi * self.frequencies / self.sfreq
+
+        self._zf: Optional[np.ndarray] = None
+        # exp(-1j * omega * n) for the next sample n
+        self._phasor: np.ndarray = np.ones(self.nbins, dtype=np.complex128)
+
+    def stream(self, data: np.ndarray) -> np.ndarray:
+        n_trials, n_channels, n_times = data.shape
+
+        rotation = self._phasor[:, np.newaxis] * np.exp(-1j * np.outer(self._omega, np.arange(n_times)))
+        self._phasor = rotation[:, -1] * np.exp(-1j * self._omega)
+        self._phasor /= np.abs(self._phasor)
+
+        # shape (n_trials, n_channels, nbins, n_times)
+        baseband = data[:, :, np.newaxis, :] * rotation
+
+        if self._zf is None:
+            self._zf = np.zeros((len(self.sos), n_trials, n_channels, self.nbins, 2), dtype=np.complex128)
+        envelope, self._zf = signal.sosfilt(self.sos, baseband, axis=-1, zi=self._zf)
+
+        # the baseband of a real sinusoid of amplitude A has the magnitude A/2, its power is A^2/2
+        return (2 * (envelope.real ** 2 + envelope.imag ** 2)).astype(self.dtype, copy=False)
+
+    def clear(self):
+        self._zf = None
+        self._phasor = np.ones(self.nbins, dtype=np.complex128)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if self._zf is None:
+            return dict()
+        return dict(zf=self._zf, phasor=self._phasor)
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self.clear()
+        if 'zf' in state:
+            self._zf = np.array(state['zf'])
+            self._phasor = np.array(state['phasor'])
+
+
+# engines selectable with BandPowerNode(method=...), further engines can be registered here
+BAND_POWER_ENGINES: Dict[str, Type[BandPowerEngine]] = {
+    'fft': FFTBandPowerEngine,
+    'dft': DFTBandPowerEngine,
+    'goertzel': GoertzelBandPowerEngine,
+    'demodulation': DemodulationBandPowerEngine,
+}
+
+
+class BandPowerNode(ProcessingNode):
+    """
+    Sliding-window band power with a selectable engine, replaces the combination of BufferNode and BurgSpectrumNode.
+
+    The node buffers the input like a BufferNode with the same buffer_length, shift and catch_up and outputs the power
+    (or amplitude) in the bins around foi at the same times and in the same shapes as BurgSpectrumNode would. Window
+    engines estimate the power of every window, streaming engines update their estimate with every sample and the
+    estimate at the end of every window is output. See BAND_POWER_ENGINES for the available methods.
+
+    Every window is output as (n_trials, n_channels, nbins). With catch_up=True all windows which are ready are output
+    on the times axis as (1, n_channels, n_windows), which is only supported for nbins=1.
+    """
+
+    def __init__(self,
+                 in_channel_labels: List[str],
+                 sfreq: float,
+                 buffer_length: int,
+                 shift: int,
+                 method: str = 'fft',     # see BAND_POWER_ENGINES
+                 foi: float = 11,
+                 nbins: int = 1,
+                 bin_width: float = 3.0,
+                 evals_per_bin: int = 15,
+                 output_type: str = 'amplitude',    # amplitude, spectrum -> amplitude means square-rooting of power data
+                 catch_up: bool = False,
+                 **settings):
+
+        super().__init__(in_channel_labels, **settings)
+
+        if method not in BAND_POWER_ENGINES:
+            raise ValueError(f"Unknown band power method '{method}', available are {list(BAND_POWER_ENGINES)}")
+        if catch_up and nbins != 1:
+            raise ValueError(f"catch_up=True is only supported for nbins=1, got nbins={nbins}")
+
+        self.sfreq: float = sfreq
+        self.buffer_length: int = buffer_length
+        self.shift: int = shift
+        self.method: str = method
+        self.foi = foi
+        self.nbins = nbins
+        self.bin_width = bin_width
+        self.evals_per_bin = evals_per_bin
+        self.output_type = output_type
+        self.catch_up: bool = catch_up
+
+        self.engine: BandPowerEngine = BAND_POWER_ENGINES[method](
+            sfreq, buffer_length, foi=foi, nbins=nbins, bin_width=bin_width, evals_per_bin=evals_per_bin,
+            dtype=self.dtype)
+
+        # for streaming engines the estimate at the last sample of a window is output
+        self._buffer = BufferNode(in_channel_labels, buffer_length=buffer_length, shift=shift, catch_up=catch_up,
+                                  dtype=self.dtype)
+
+    @check_data_dimensions
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+            T_Data, T_Timestamps):
+
+        if data is None or data.shape[-1] == 0:
+            return None, None
+
+        if len(data.shape) > 3:
+            raise Exception("BandPowerNode is not implemented for ndim > 3 yet. Got data with shape {}.".format(data.shape))
+
+        if self.engine.streaming:
+            data = self.engine.stream(data)
+
+        # streaming engines add the bins as feature dimension, the buffer holds their estimates instead of the signal
+        windows, windows_timestamps = self._buffer.process(data, timestamps)
+        if windows is None:
+            return None, None
+
+        if self.engine.streaming:
+            power = windows[..., -1]
+        else:
+            power = self.engine.power(windows)
+
+        if self.output_type == 'amplitude':
+            power = np.sqrt(power)
+        power = power.astype(self.dtype, copy=False)
+
+        n_trials, n_channels, nbins = power.shape
+
+        if isinstance(windows_timestamps, np.ndarray) and windows_timestamps.ndim == 2:
+            # consecutive windows of a single stream (catch_up=True) are moved to the times axis like BurgSpectrumNode does
+            output = power[..., 0].T[np.newaxis]
+
+            # BufferNode marks missing timestamps with NaN
+            return output, [None if np.isnan(t) else float(t) for t in windows_timestamps[:, -1]]
+
+        output_timestamp = None
+        if isinstance(windows_timestamps, (int, float)):
+            output_timestamp = windows_timestamps
+        elif isinstance(windows_timestamps, collections.abc.Iterable):
+            output_timestamp = windows_timestamps[-1]
+
+        # BufferNode marks missing timestamps with NaN
+        if output_timestamp is not None and np.isnan(output_timestamp):
+            output_timestamp = None
+
+        return power, [output_timestamp]
+
+    def max_chunk_size(self, n_trials: int = 1) -> Optional[int]:
+        return self._buffer.max_chunk_size(n_trials)
+
+    def clear(self, *args, **kwargs):
+        self._buffer.clear()
+        self.engine.clear()
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        state = {f"buffer.{key}": value for key, value in self._buffer.get_state().items()}
+        state.update({f"engine.{key}": value for key, value in self.engine.get_state().items()})
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self._buffer.set_state(sub_state(state, "buffer."))
+        self.engine.set_state(sub_state(state, "engine."))
+
+    def get_settings(self, *args, **kwargs):
+        settings = super().get_settings(*args, **kwargs)
+
+        settings['sfreq'] = self.sfreq
+        settings['buffer_length'] = self.buffer_length
+        settings['shift'] = self.shift
+        settings['method'] = self.method
+        settings['foi'] = self.foi
+        settings['nbins'] = self.nbins
+        settings['bin_width'] = self.bin_width
+        settings['evals_per_bin'] = self.evals_per_bin
+        settings['output_type'] = self.output_type
+        settings['catch_up'] = self.catch_up
+
+        return settings
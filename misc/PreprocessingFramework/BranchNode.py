@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Optional, Dict
+
+import numpy as np
+
+from misc.PreprocessingFramework.DataProcessor import DataProcessor, check_data_dimensions, T_Data, T_Timestamps, \
+    sub_state
+from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
+from misc.PreprocessingFramework.ProcessingPipeline import ProcessingPipeline, ProcessingPipelineException
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BranchNode(ProcessingNode):
+    """
+    Fan-out/fan-in node which turns a ProcessingPipeline into a DAG.
+
+    Every branch is a ProcessingPipeline which receives the same input data (fan-out). The outputs of all branches are
+    concatenated along the channel axis (fan-in), the timestamps are taken from the first branch. Branches must
+    therefore produce outputs at the same time and with the same shape apart from the channel axis.
+
+    The branches are independent and can run concurrently in a small thread pool, as most of the work is done in
+    NumPy/SciPy which release the GIL. Branches must not modify their input data in place.
+
+    Example of a config:
+        dict(type='BranchNode', n_workers=2, branches=[
+            [dict(type='ChannelSelectorNode', selected_channels=['bipolar EOG']), dict(type='IIRFilterNode', ...)],
+            [dict(type='ChannelSelectorNode', selected_channels=['C3', 'C4']), dict(type='IIRFilterNode', ...)]
+        ])
+    """
+
+    def __init__(self,
+                 in_channel_labels: List[str],
+                 branches: List[Union[List[dict], List[DataProcessor], ProcessingPipeline]],
+                 n_workers: Optional[int] = None,
+                 **settings):
+        """
+        :param in_channel_labels:
+        :param branches: list of branches, each is a list of node settings, a list of DataProcessors or a ProcessingPipeline
+        :param n_workers: number of threads running the branches, defaults to the number of branches. 1 runs the branches sequentially
+        :param settings:
+        """
+        in_feature_dims = settings.pop('in_feature_dims', None)
+        dtype = settings.pop('dtype', np.float64)
+        # the out_channel_labels are given by the branches
+        settings.pop('out_channel_labels', None)
+
+        self.branches: List[ProcessingPipeline] = []
+        for branch in branches:
+            if isinstance(branch, ProcessingPipeline):
+                self.branches.append(branch)
+            else:
+                self.branches.append(ProcessingPipeline(in_channel_labels, branch, in_feature_dims=in_feature_dims, dtype=dtype))
+
+        if len(self.branches) < 1:
+            raise ProcessingPipelineException("BranchNode needs at least one branch")
+
+        out_feature_dims = self.branches[0].out_feature_dims
+        if any(branch.out_feature_dims != out_feature_dims for branch in self.branches):
+            raise ProcessingPipelineException(
+                f"All branches of a BranchNode need the same out_feature_dims, got {[b.out_feature_dims for b in self.branches]}")
+
+        out_channel_labels = [label for branch in self.branches for label in branch.out_channel_labels]
+
+        super().__init__(in_channel_labels, out_channel_labels=out_channel_labels, in_feature_dims=in_feature_dims,
+                         dtype=dtype, **settings)
+
+        self.out_feature_dims = out_feature_dims
+
+        self.n_workers: int = n_workers if n_workers is not None else len(self.branches)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @check_data_dimensions
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+            T_Data, T_Timestamps):
+
+        if self.n_workers > 1 and len(self.branches) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix="BranchNode")
+            futures = [self._executor.submit(branch.process, data, timestamps, *args, **kwargs) for branch in self.branches[1:]]
+            # the first branch runs in the calling thread
+            outputs = [self.branches[0].process(data, timestamps, *args, **kwargs)] + [f.result() for f in futures]
+        else:
+            outputs = [branch.process(data, timestamps, *args, **kwargs) for branch in self.branches]
+
+        return self._concatenate(outputs)
+
+    def _concatenate(self, outputs: list) -> (T_Data, T_Timestamps):
+        data = [d for d, _ in outputs]
+
+        if all(d is None for d in data):
+            return None, None
+
+        if any(d is None for d in data):
+            raise ProcessingPipelineException(
+                "Branches of a BranchNode produced output at different times. All branches need the same output rate.")
+
+        return np.concatenate(data, axis=1), outputs[0][1]
+
+    def train(self, data, labels, timestamps=None, *args, **kwargs):
+        results = [branch.train(data, labels, timestamps, *args, **kwargs) for branch in self.branches]
+        data_out, _ = self._concatenate([(d, t) for d, _, t in results])
+        return data_out, results[0][1], results[0][2]
+
+    @property
+    def independent_trials(self) -> bool:
+        return all(branch.independent_trials for branch in self.branches)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the thread pool is created again on the first call of process()
+        state['_executor'] = None
+        return state
+
+    def max_chunk_size(self, n_trials: int = 1) -> Optional[int]:
+        limits = [limit for limit in (branch.max_chunk_size(n_trials) for branch in self.branches) if limit is not None]
+        return min(limits) if limits else None
+
+    def clear(self, *args, **kwargs):
+        for branch in self.branches:
+            branch.clear(*args, **kwargs)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """States of the branches, the keys are prefixed with the index of the branch"""
+        return {f"{i_branch}.{key}": value for i_branch, branch in enumerate(self.branches)
+                for key, value in branch.get_state().items()}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        for i_branch, branch in enumerate(self.branches):
+            branch.set_state(sub_state(state, f"{i_branch}."))
+
+    def close(self, *args, **kwargs):
+        for branch in self.branches:
+            branch.close(*args, **kwargs)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def enable_profiling(self, profiler, prefix: str = ''):
+        """Records the statistics of the nodes of every branch, see ProcessingPipeline.enable_profiling()"""
+        for i_branch, branch in enumerate(self.branches):
+            branch.enable_profiling(profiler, prefix=f"{prefix}{i_branch}.")
+
+    def disable_profiling(self):
+        for branch in self.branches:
+            branch.disable_profiling()
+
+    def get_settings(self, *args, **kwargs):
+        settings = super().get_settings(*args, **kwargs)
+        settings['branches'] = [branch.get_settings(*args, **kwargs)['nodes'] for branch in self.branches]
+        settings['n_workers'] = self.n_workers
+        return settings
@@ -1,5 +1,6 @@
 import numpy as np
-from typing import List
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import List, Optional, Dict
 
 import logging
 
@@ -10,14 +11,30 @@ logger = logging.getLogger(__name__)
 
 
 class BufferNode(ProcessingNode):
-    def __init__(self, in_channel_labels: List[str], buffer_length: int, shift: int, **settings):
+    """
+    Sliding window buffer which outputs windows of buffer_length samples every shift samples.
+
+    The samples are stored in a mirrored ring buffer: every sample is written twice, at its position in the ring and
+    actual_buffer_length samples later. That way every window, and every series of consecutive windows, is a
+    contiguous region of memory and can be returned as a read-only view without copying. The views are only valid
+    until the buffer wraps around (actual_buffer_length - buffer_length more samples), consumers which keep the data
+    for longer need to copy it.
+    Timestamps are stored in a parallel float64 array with NaN for missing values.
+
+    By default process() outputs at most one window per call. With catch_up=True it outputs all windows that are ready,
+    stacked along the trials axis as (n_windows, n_channels, ..., buffer_length) together with timestamps of shape
+    (n_windows, buffer_length). That way a backlog after a stall of the input stream is processed in a single call.
+    """
+
+    def __init__(self, in_channel_labels: List[str], buffer_length: int, shift: int, catch_up: bool = False, **settings):
         super().__init__(in_channel_labels, **settings)
 
         self.buffer = np.array([])
-        self.buffer_timestamps = []
+        self.buffer_timestamps = np.array([])
         self.buffer_length = buffer_length
         self.actual_buffer_length = self.buffer_length * 10
         self.shift = shift
+        self.catch_up = catch_up
         self.buffer_shape: list = []
         self.return_shape: list = []
 
@@ -30,14 +47,21 @@ class BufferNode(ProcessingNode):
     def get_buffer_available(self) -> int:
         return self.actual_buffer_length - (self.total_samples_written - self.total_samples_discarded)
 
+    def get_windows_ready(self) -> int:
+        """Number of complete windows which can be read from the buffer"""
+        samples_buffered = self.total_samples_written - self.total_samples_discarded
+        if samples_buffered < self.buffer_length:
+            return 0
+        return (samples_buffered - self.buffer_length) // self.shift + 1
+
     def init_buffers(self, data):
         self.buffer_shape = list(data.shape)
-        self.buffer_shape[-1] = self.actual_buffer_length
-        self.return_shape = self.buffer_shape.copy()
+        self.buffer_shape[-1] = 2 * self.actual_buffer_length
+        self.return_shape = list(data.shape)
         self.return_shape[-1] = self.buffer_length
 
-        self.buffer = np.zeros(self.buffer_shape)
-        self.buffer_timestamps = [None] * self.actual_buffer_length
+        self.buffer = np.zeros(self.buffer_shape, dtype=self.dtype)
+        self.buffer_timestamps = np.full(2 * self.actual_buffer_length, np.nan)
 
         self.write_index = 0
         self.read_index = 0
@@ -45,78 +69,104 @@ class BufferNode(ProcessingNode):
         self.total_samples_written = 0
         self.total_samples_discarded = 0
 
-    @check_data_dimensions
-    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
-    T_Data, T_Timestamps):
-
-        if data is None or data.shape[-1] == 0:
-            return None, None
-
+    def write(self, data: np.ndarray, timestamps: T_Timestamps = None):
+        """
+        Writes data of shape (n_trials, n_channels, ..., n_times) into the buffer
+        """
         # check if buffer has not been initialized:
         # shape of buffer array is unknown before data is processed first
         if len(self.buffer_shape) < 1:
             self.init_buffers(data)
 
-        # write new data into buffer
         new_samples = data.shape[-1]
 
         if timestamps is None:
-            new_timestamps = [None] * new_samples
+            new_timestamps = np.full(new_samples, np.nan)
         elif isinstance(timestamps, (float, int)):
-            new_timestamps = [None] * (new_samples-1) + [timestamps]
+            new_timestamps = np.full(new_samples, np.nan)
+            new_timestamps[-1] = timestamps
         else:
-            new_timestamps = list(timestamps)
+            new_timestamps = np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
 
         # check if there is enough space in the buffer
         if new_samples > self.get_buffer_available():
             raise Exception("Buffer too short. Data is lost.")
 
-        # calculate how many samples will be inserted into buffer before the write_index is reset to 0
-        new_before_turnaround = min(new_samples, self.actual_buffer_length - self.write_index)
-        new_after_turnaround = new_samples - new_before_turnaround
+        # the samples are written to write_index ... write_index+new_samples, which is always within the mirrored
+        # buffer, and once more to the mirrored position
+        start = self.write_index
+        end = start + new_samples
+        self.buffer[..., start:end] = data
+        self.buffer_timestamps[start:end] = new_timestamps
 
-        if new_before_turnaround > 0:
-            self.buffer[..., self.write_index:self.write_index + new_before_turnaround] = data[...,
-                                                                                          0:new_before_turnaround]
-            self.buffer_timestamps[self.write_index:self.write_index + new_before_turnaround] = new_timestamps[0:new_before_turnaround]
+        if end <= self.actual_buffer_length:
+            self.buffer[..., start + self.actual_buffer_length:end + self.actual_buffer_length] = data
+            self.buffer_timestamps[start + self.actual_buffer_length:end + self.actual_buffer_length] = new_timestamps
+        else:
+            split = self.actual_buffer_length - start
+            self.buffer[..., start + self.actual_buffer_length:] = data[..., :split]
+            self.buffer[..., :end - self.actual_buffer_length] = data[..., split:]
+            self.buffer_timestamps[start + self.actual_buffer_length:] = new_timestamps[:split]
+            self.buffer_timestamps[:end - self.actual_buffer_length] = new_timestamps[split:]
 
-            self.write_index += new_before_turnaround
-            self.write_index = self.write_index % self.actual_buffer_length
+        self.write_index = end % self.actual_buffer_length
+        self.total_samples_written += new_samples
 
-        if new_after_turnaround > 0:
-            self.buffer[..., self.write_index:self.write_index + new_after_turnaround] = data[...,
-                                                                                         new_before_turnaround:]
-            self.buffer_timestamps[self.write_index:self.write_index + new_after_turnaround] = new_timestamps[new_before_turnaround:]
+    def read_windows(self, max_windows: Optional[int] = None) -> (np.ndarray, np.ndarray):
+        """
+        Reads all complete windows (or at most max_windows) from the buffer and advances the read position
+        :return: (data, timestamps), read-only views into the buffer of shape (n_windows, n_trials, n_channels, ..., buffer_length)
+        and (n_windows, buffer_length). n_windows can be 0.
+        """
+        n_windows = self.get_windows_ready()
+        if max_windows is not None:
+            n_windows = min(n_windows, max_windows)
 
-            self.write_index += new_after_turnaround
-            self.write_index = self.write_index % self.actual_buffer_length
+        # all windows lie within the contiguous region read_index ... read_index+span of the mirrored buffer
+        span = (max(n_windows, 1) - 1) * self.shift + self.buffer_length
+        region = self.buffer[..., self.read_index:self.read_index + span]
+        region_timestamps = self.buffer_timestamps[self.read_index:self.read_index + span]
 
-        self.total_samples_written += new_samples
+        windows = sliding_window_view(region, self.buffer_length, axis=-1)[..., ::self.shift, :][..., :n_windows, :]
+        windows = np.moveaxis(windows, -2, 0)
+        windows_timestamps = sliding_window_view(region_timestamps, self.buffer_length)[::self.shift][:n_windows]
 
-        if self.total_samples_written - self.total_samples_discarded < self.buffer_length:
+        self.read_index = (self.read_index + n_windows * self.shift) % self.actual_buffer_length
+        self.total_samples_discarded += n_windows * self.shift
 
-            logger.debug(f"Buffer does not yet have enough data ({self.total_samples_written - self.total_samples_discarded} samples) to create output (buflen={self.buffer_length}).")
+        return windows, windows_timestamps
+
+    def max_chunk_size(self, n_trials: int = 1) -> Optional[int]:
+        if self.catch_up and n_trials == 1:
+            # after reading all windows less than buffer_length samples remain in the buffer
+            return self.actual_buffer_length - self.buffer_length + 1
+        # at most one window per call, larger chunks would skip windows and overflow the buffer
+        return self.shift
+
+    @check_data_dimensions
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+    T_Data, T_Timestamps):
+
+        if data is None or data.shape[-1] == 0:
             return None, None
 
-        return_before_turnaround = min(self.buffer_length, self.actual_buffer_length - self.read_index)
-        return_after_turnaround = self.buffer_length - return_before_turnaround
+        self.write(data, timestamps)
 
-        return_data = np.zeros(self.return_shape)
-        return_timestamps = [None] * self.buffer_length
+        if self.get_windows_ready() < 1:
 
-        if return_before_turnaround > 0:
-            return_data[..., :return_before_turnaround] = self.buffer[...,
-                                                          self.read_index:self.read_index + return_before_turnaround]
-            return_timestamps[:return_before_turnaround] = self.buffer_timestamps[self.read_index:self.read_index + return_before_turnaround]
+            logger.debug(f"Buffer does not yet have enough data ({self.total_samples_written - self.total_samples_discarded} samples) to create output (buflen={self.buffer_length}).")
+            return None, None
 
-        if return_after_turnaround > 0:
-            return_data[..., return_before_turnaround:] = self.buffer[..., 0:return_after_turnaround]
-            return_timestamps[return_before_turnaround:] = self.buffer_timestamps[0:return_after_turnaround]
+        if self.catch_up:
+            if data.shape[0] == 1:
+                windows, windows_timestamps = self.read_windows()
+                # consecutive windows of the single trial are stacked along the trials axis
+                return windows[:, 0], windows_timestamps
+            logger.warning(f"BufferNode can only catch up with a single trial, got {data.shape[0]} trials. Returning one window.")
 
-        self.read_index = (self.read_index + self.shift) % self.actual_buffer_length
-        self.total_samples_discarded += self.shift
+        windows, windows_timestamps = self.read_windows(max_windows=1)
 
-        return return_data, return_timestamps
+        return windows[0], windows_timestamps[0]
 
     def process_trial(self, data: np.ndarray, timestamps=None, surrogate_timestamps=False, *args, **kwargs):
         """
@@ -176,9 +226,37 @@ class BufferNode(ProcessingNode):
     def clear(self, *args, **kwargs):
         self.buffer_shape = []
 
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if len(self.buffer_shape) < 1:
+            return dict()
+        return dict(buffer=self.buffer, buffer_timestamps=self.buffer_timestamps,
+                    write_index=np.array(self.write_index), read_index=np.array(self.read_index),
+                    total_samples_written=np.array(self.total_samples_written),
+                    total_samples_discarded=np.array(self.total_samples_discarded))
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        if 'buffer' not in state:
+            self.clear()
+            return
+
+        if state['buffer'].shape[-1] != 2 * self.actual_buffer_length:
+            raise ValueError(f"The buffer of the state has {state['buffer'].shape[-1]} samples, "
+                             f"{self.__class__.__name__} expects {2 * self.actual_buffer_length}")
+
+        self.buffer = np.array(state['buffer'], dtype=self.dtype)
+        self.buffer_timestamps = np.array(state['buffer_timestamps'], dtype=np.float64)
+        self.buffer_shape = list(self.buffer.shape)
+        self.return_shape = self.buffer_shape[:-1] + [self.buffer_length]
+
+        self.write_index = int(state['write_index'])
+        self.read_index = int(state['read_index'])
+        self.total_samples_written = int(state['total_samples_written'])
+        self.total_samples_discarded = int(state['total_samples_discarded'])
+
     def get_settings(self, *args, **kwargs):
         settings = super().get_settings(*args, **kwargs)
         settings['buffer_length'] = self.buffer_length
         settings['shift'] = self.shift
+        settings['catch_up'] = self.catch_up
 
         return settings
@@ -4,7 +4,7 @@ import collections.abc
 from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data
 from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
 
-from misc.burg.burg_utils import calc_burg_spectrum
+from misc.burg.burg_plan import get_burg_spectrum_plan
 
 from typing import List
 
@@ -16,6 +16,14 @@ logger = logging.getLogger(__name__)
 
 
 class BurgSpectrumNode(ProcessingNode):
+    """
+    Burg spectrum of every window in nbins bins of bin_width Hz around foi.
+
+    Windows of shape (n_trials, n_channels, n_times) are output as (n_trials, n_channels, nbins) with the timestamp of
+    the last sample. The consecutive windows of BufferNode with catch_up=True (timestamps of shape (n_windows, n_times))
+    are output on the times axis as (1, n_channels, n_windows) with the timestamps of the last samples, which is only
+    supported for nbins=1.
+    """
 
     def __init__(self,
                  in_channel_labels: List[str],
@@ -36,6 +44,8 @@ class BurgSpectrumNode(ProcessingNode):
         self.evals_per_bin = evals_per_bin
         self.output_type = output_type
 
+        self._plan = get_burg_spectrum_plan(fs=self.sfreq, foi=self.foi, nbins=self.nbis, bin_width=self.bin_width,
+                                            evals_per_bin=self.evals_per_bin, model_order=int(self.sfreq/10))
 
     @check_data_dimensions
     def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
@@ -49,29 +59,33 @@ class BurgSpectrumNode(ProcessingNode):
 
         n_trials, n_channels, n_times = data.shape
 
-        output = []
-
-        for i_trial in range(n_trials):
-
-            trial_output = []
+        # estimate the spectra of all trials and channels in a single batched call. The AR models are always estimated
+        # in float64, Burg's recursion on band-limited windows is too ill-conditioned for float32
+        amplitudes = self._plan.compute(data.reshape((n_trials * n_channels, n_times)), output_type=self.output_type)
+        amplitudes = amplitudes.astype(self.dtype, copy=False)
 
-            for i_ch in range(n_channels):
+        if isinstance(timestamps, np.ndarray) and timestamps.ndim == 2:
+            # the trials are consecutive windows of a single stream (BufferNode with catch_up=True):
+            # move them to the times axis so downstream nodes receive one sample per window
+            if self.nbis != 1:
+                raise ValueError(f"BurgSpectrumNode only supports the windows of BufferNode with catch_up=True for "
+                                 f"nbins=1, got nbins={self.nbis}")
+            output = amplitudes.reshape((n_trials, n_channels)).T[np.newaxis]
 
-                amplitudes, freqs = calc_burg_spectrum(
-                    signal=data[i_trial, i_ch, :], foi=self.foi, nbins=self.nbis, bin_width=self.bin_width, evals_per_bin=self.evals_per_bin,
-                    output_type=self.output_type, fs=self.sfreq, model_order=int(self.sfreq/10), fast_version=True)
+            # BufferNode marks missing timestamps with NaN
+            return output, [None if np.isnan(t) else float(t) for t in timestamps[:, -1]]
 
-                trial_output.append(amplitudes)
-
-            output.append(trial_output)
-
-        output = np.array(output)
+        output = amplitudes.reshape((n_trials, n_channels, self.nbis))
         output_timestamp = None
         if isinstance(timestamps, (int, float)):
             output_timestamp = timestamps
         elif isinstance(timestamps, collections.abc.Iterable):
             output_timestamp = timestamps[-1]
 
+        # BufferNode marks missing timestamps with NaN
+        if output_timestamp is not None and np.isnan(output_timestamp):
+            output_timestamp = None
+
         return output, [output_timestamp]
 
     def get_settings(self, *args, **kwargs):
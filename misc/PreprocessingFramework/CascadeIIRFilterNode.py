@@ -0,0 +1,127 @@
+from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data, DataProcessor
+from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
+from misc.PreprocessingFramework.IIRFilterNode import IIRFilterNode
+
+from typing import List, Dict
+
+import numpy as np
+from scipy import signal
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CascadeIIRFilterNode(ProcessingNode):
+    """
+    Applies a cascade of IIR filters with a single sosfilt call.
+
+    The second-order sections of all filters are concatenated and filtered with one combined state. On the first call
+    the filters are run one after another to initialize every filter's state from the mean of its own input, exactly
+    like a chain of separate IIRFilterNodes does. The output is therefore identical to that chain.
+    """
+
+    def __init__(self, in_channel_labels: List[str], filters: List[dict], **settings):
+        """
+        :param in_channel_labels:
+        :param filters: list of dicts with the settings of each IIRFilterNode in the cascade, e.g.
+                        [dict(sfreq=500, order=1, ftype='butter', btype='highpass', fpass=0.1, fstop=0.05), ...]
+        :param settings:
+        """
+        super().__init__(in_channel_labels, **settings)
+
+        if len(filters) < 1:
+            raise ValueError("CascadeIIRFilterNode needs at least one filter")
+
+        self.filters: List[IIRFilterNode] = []
+        for filter_settings in filters:
+            filter_settings = {k: v for k, v in filter_settings.items() if k not in ('type', 'in_channel_labels', 'out_channel_labels', 'in_feature_dims', 'out_feature_dims', 'dtype')}
+            self.filters.append(IIRFilterNode(in_channel_labels, dtype=self.dtype, **filter_settings))
+
+        self.sos = np.concatenate([f.sos for f in self.filters], axis=0)
+        self.zf = None
+
+    @classmethod
+    def from_nodes(cls, nodes: List[IIRFilterNode]) -> 'CascadeIIRFilterNode':
+        """Creates a cascade from a list of consecutive IIRFilterNodes"""
+        filters = [node.get_settings(in_channel_labels=False, out_channel_labels=False, in_feature_dims=False, out_feature_dims=False)
+                   for node in nodes]
+        return cls(nodes[0].in_channel_labels, filters=filters, out_channel_labels=nodes[-1].out_channel_labels,
+                   in_feature_dims=nodes[0].in_feature_dims, dtype=nodes[0].dtype)
+
+    @check_data_dimensions
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+            T_Data, T_Timestamps):
+
+        if data is None or data.shape[-1] == 0:
+            return None, None
+
+        if self.zf is None:
+            # initialize the state of every filter with the mean along the time axis of its input,
+            # the same way separate IIRFilterNodes do
+            zf = []
+            for f in self.filters:
+                zi = np.moveaxis(np.multiply.outer(f.init_zi, data.mean(axis=-1)), 1, -1)
+                data, zf_filter = signal.sosfilt(f.sos, data, axis=-1, zi=zi)
+                zf.append(zf_filter)
+            self.zf = np.concatenate(zf, axis=0)
+            return data, timestamps
+
+        # filter data
+        data, self.zf = signal.sosfilt(self.sos, data, axis=-1, zi=self.zf)
+
+        return data, timestamps
+
+    def clear(self, *args, **kwargs):
+        self.zf = None
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return dict(zf=self.zf) if self.zf is not None else dict()
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self.zf = np.array(state['zf']) if 'zf' in state else None
+
+    def get_settings(self, *args, **kwargs):
+        settings = super().get_settings(*args, **kwargs)
+        settings['filters'] = [
+            f.get_settings(in_channel_labels=False, out_channel_labels=False, in_feature_dims=False, out_feature_dims=False)
+            for f in self.filters]
+
+        return settings
+
+
+def fuse_iir_filter_nodes(nodes: List[DataProcessor]) -> List[DataProcessor]:
+    """
+    Replaces every run of two or more consecutive IIRFilterNodes with the same number of channels, feature dimensions,
+    sampling rate and dtype by a CascadeIIRFilterNode
+    :param nodes: list of nodes of a ProcessingPipeline
+    :return: list of nodes with fused filters
+    """
+    fused_nodes: List[DataProcessor] = []
+    run: List[IIRFilterNode] = []
+
+    def close_run():
+        if len(run) > 1:
+            logger.debug(f"Fusing {len(run)} consecutive IIRFilterNodes into a CascadeIIRFilterNode")
+            fused_nodes.append(CascadeIIRFilterNode.from_nodes(run))
+        else:
+            fused_nodes.extend(run)
+        run.clear()
+
+    for node in nodes:
+        if type(node) is IIRFilterNode and (not run or (node.num_in_channels == run[-1].num_out_channels
+                                                         and node.in_feature_dims == run[-1].out_feature_dims
+                                                         and node.sfreq == run[-1].sfreq
+                                                         and node.dtype == run[-1].dtype)):
+            run.append(node)
+            continue
+
+        close_run()
+        if type(node) is IIRFilterNode:
+            run.append(node)
+        else:
+            fused_nodes.append(node)
+
+    close_run()
+
+    return fused_nodes
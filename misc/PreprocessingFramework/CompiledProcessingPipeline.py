@@ -0,0 +1,221 @@
+from typing import List, Union
+
+import numpy as np
+import functools
+
+from misc.PreprocessingFramework.DataProcessor import DataProcessor, T_Data, T_Timestamps
+from misc.PreprocessingFramework.ProcessingPipeline import ProcessingPipeline, ProcessingPipelineException
+from misc.PreprocessingFramework.SpatialFilterNode import SpatialFilterNode
+from misc.PreprocessingFramework.ChannelSelectorNode import ChannelSelectorNode
+from misc.PreprocessingFramework.IIRFilterNode import IIRFilterNode
+from misc.PreprocessingFramework.CascadeIIRFilterNode import CascadeIIRFilterNode
+from misc.PreprocessingFramework.BufferNode import BufferNode
+from misc.PreprocessingFramework.DecimatorNode import DecimatorNode
+from misc.PreprocessingFramework.BranchNode import BranchNode
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# nodes which never keep a reference to their input data. Stages feeding these nodes can reuse their output buffer.
+_COPYING_NODES = (IIRFilterNode, CascadeIIRFilterNode, BufferNode, ChannelSelectorNode, SpatialFilterNode, DecimatorNode)
+
+
+class CompiledProcessingPipeline(ProcessingPipeline):
+    """
+    ProcessingPipeline with a fused execution plan. Usually created with ProcessingPipeline.compile().
+
+    - channel counts of all nodes are validated once when compiling and the input shape once on the first call,
+      the per-call check_data_dimensions decorator of the nodes is bypassed
+    - adjacent linear stages (SpatialFilterNode, ChannelSelectorNode) are merged into a single SpatialFilterNode. A
+      spatial filter followed by a BranchNode whose branches all start with a linear stage is moved into the branches,
+      so every branch only computes the rows it selects
+    - the branches of BranchNodes are compiled as well
+    - spatial filters write into preallocated output buffers if the following node copies its input anyway
+
+    The process() API is the same as the one of ProcessingPipeline. Nodes which are not merged are shared with the
+    pipeline the plan was compiled from.
+    """
+
+    def __init__(self, in_channel_labels: Union[List[str], int], nodes: Union[List[dict], List[DataProcessor]], in_feature_dims: List[int] = None, **settings):
+        super().__init__(in_channel_labels, nodes, in_feature_dims=in_feature_dims, **settings)
+
+        self.nodes = merge_linear_nodes(self.nodes)
+        self._validate_nodes()
+
+        self._stages = self._build_stages()
+        self._input_validated: bool = False
+
+        logger.info(f"Compiled pipeline with {len(self._stages)} stages.")
+
+    def _validate_nodes(self):
+        if self.nodes[0].num_in_channels != self.num_in_channels:
+            raise ProcessingPipelineException(
+                f"First node {self.nodes[0]} expects {self.nodes[0].num_in_channels} channels, "
+                f"the pipeline has {self.num_in_channels} input channels")
+
+        for previous, node in zip(self.nodes[:-1], self.nodes[1:]):
+            if node.num_in_channels != previous.num_out_channels:
+                raise ProcessingPipelineException(
+                    f"{node} expects {node.num_in_channels} channels but {previous} outputs {previous.num_out_channels}")
+
+        for node in self.nodes:
+            if isinstance(node, SpatialFilterNode) and np.shape(node.weights)[1] != node.num_in_channels:
+                raise ProcessingPipelineException(
+                    f"Weights of {node} have shape {np.shape(node.weights)} but the node has {node.num_in_channels} input channels")
+            if isinstance(node, ChannelSelectorNode) and any(i >= node.num_in_channels for i in node.selected_channels_indices):
+                raise ProcessingPipelineException(f"{node} selects channels which are not in its input")
+
+    def _build_stages(self) -> list:
+        stages = []
+        for i_node, node in enumerate(self.nodes):
+            next_node = self.nodes[i_node + 1] if i_node + 1 < len(self.nodes) else None
+
+            if type(node) is SpatialFilterNode:
+                reuse_output = next_node is not None and type(next_node) in _COPYING_NODES
+                stages.append(_SpatialFilterStage(node, reuse_output=reuse_output))
+                continue
+
+            process = getattr(type(node).process, '__wrapped__', None)
+            if process is None:
+                stages.append(node.process)
+            else:
+                # call the undecorated process() to skip the per-call dimension checks
+                stages.append(functools.partial(process, node))
+
+        return stages
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # the stages hold bound and undecorated methods of the nodes, they are built again for the copied nodes
+        del state['_stages']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stages = self._build_stages()
+
+    def _validate_input(self, data: np.ndarray):
+        n_trials, n_channels, *n_features, n_times = data.shape
+        if n_channels != self.num_in_channels:
+            raise ProcessingPipelineException(
+                f"CompiledProcessingPipeline expects {self.num_in_channels} channels, got data with shape {data.shape}")
+        if list(n_features) != list(self.in_feature_dims):
+            raise ProcessingPipelineException(
+                f"CompiledProcessingPipeline expects feature dimensions {self.in_feature_dims}, got data with shape {data.shape}")
+        self._input_validated = True
+
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+            T_Data, T_Timestamps):
+        """Propagate the data through all stages of the compiled plan
+        :param data: shape (n_trials, n_channels, ..., n_times)
+        :param timestamps:
+        :return: data of shape (n_trials, ...) where the last dimensions depend on the nodes
+        """
+        if data is not None:
+            data = np.asarray(data, dtype=self.dtype)
+            if not self._input_validated:
+                self._validate_input(data)
+
+        if self.profiler is not None:
+            # the stages correspond to the (merged) nodes
+            for stage, statistics in zip(self._stages, self._node_statistics):
+                data, timestamps = self.profiler.call(statistics, stage, data, timestamps, *args, **kwargs)
+            return data, timestamps
+
+        for stage in self._stages:
+            data, timestamps = stage(data, timestamps, *args, **kwargs)
+        return data, timestamps
+
+    def compile(self) -> 'CompiledProcessingPipeline':
+        return self
+
+
+class _SpatialFilterStage(object):
+    """Spatial filter of all trials with SpatialFilterNode.apply(), optionally into a preallocated buffer"""
+
+    def __init__(self, node: SpatialFilterNode, reuse_output: bool):
+        self.node: SpatialFilterNode = node
+        self.reuse_output: bool = reuse_output
+        self._buffer = None
+
+    def __call__(self, data: T_Data, timestamps: T_Timestamps = None, *args, **kwargs) -> (T_Data, T_Timestamps):
+        if data is None or data.shape[-1] == 0:
+            return None, None
+
+        if data.ndim > 3:
+            raise Exception("SpatialFilterNode can not process more than 3 dimensions of data.")
+
+        if not self.reuse_output:
+            return self.node.apply(data), timestamps
+
+        n_trials, n_channels, n_times = data.shape
+        n_out = self.node.num_out_channels
+        size = n_trials * n_out * n_times
+        if self._buffer is None or self._buffer.size < size or self._buffer.dtype != data.dtype:
+            self._buffer = np.empty(size, dtype=data.dtype)
+
+        # contiguous view on the start of the buffer
+        output = self._buffer[:size].reshape((n_trials, n_out, n_times))
+
+        return self.node.apply(data, out=output), timestamps
+
+
+def _is_linear(node: DataProcessor) -> bool:
+    return type(node) is SpatialFilterNode or (type(node) is ChannelSelectorNode and not node.in_feature_dims)
+
+
+def _linear_weights(node: DataProcessor) -> np.ndarray:
+    if type(node) is SpatialFilterNode:
+        return np.asarray(node.weights, dtype=np.float64)
+    return np.eye(node.num_in_channels)[node.selected_channels_indices]
+
+
+def _compile_branches(node: BranchNode, head: List[DataProcessor] = ()) -> BranchNode:
+    """BranchNode with compiled branches, the nodes in head are prepended to every branch"""
+    in_channel_labels = head[0].in_channel_labels if head else node.in_channel_labels
+    in_feature_dims = head[0].in_feature_dims if head else node.in_feature_dims
+    branches = []
+    for branch in node.branches:
+        # a branch converts its input to its dtype, the head keeps the dtype of the data it received so far
+        dtype = head[0].dtype if head else branch.dtype
+        branches.append(CompiledProcessingPipeline(in_channel_labels, list(head) + list(branch.nodes),
+                                                   in_feature_dims=in_feature_dims, fuse_filters=branch.fuse_filters,
+                                                   dtype=dtype))
+    return BranchNode(in_channel_labels, branches=branches, n_workers=node.n_workers, in_feature_dims=in_feature_dims,
+                      dtype=node.dtype)
+
+
+def merge_linear_nodes(nodes: List[DataProcessor]) -> List[DataProcessor]:
+    """
+    Merges adjacent SpatialFilterNodes and ChannelSelectorNodes into a single SpatialFilterNode, e.g. a spatial filter
+    followed by a channel selection becomes a spatial filter with the rows of the selected channels only.
+    Runs of ChannelSelectorNodes without a spatial filter are kept.
+
+    A SpatialFilterNode followed by a BranchNode whose branches all start with a linear stage is moved into every
+    branch, where it is merged with the channel selection of the branch. The branches of all BranchNodes are compiled.
+    :param nodes: list of nodes of a ProcessingPipeline
+    :return: list of nodes with merged linear stages
+    """
+    merged: List[DataProcessor] = []
+    for node in nodes:
+        previous = merged[-1] if merged else None
+        if type(node) is BranchNode:
+            if type(previous) is SpatialFilterNode and all(_is_linear(branch.nodes[0]) for branch in node.branches):
+                logger.debug(f"Moving {previous} into the {len(node.branches)} branches of {node}")
+                merged[-1] = _compile_branches(node, head=[previous])
+            else:
+                merged.append(_compile_branches(node))
+        elif previous is not None and _is_linear(previous) and _is_linear(node) \
+                and SpatialFilterNode in (type(previous), type(node)):
+            weights = _linear_weights(node) @ _linear_weights(previous)
+            # a channel selection does not convert the data, the merged node keeps the dtype of the spatial filter
+            dtype = previous.dtype if type(previous) is SpatialFilterNode else node.dtype
+            logger.debug(f"Merging {previous} and {node} into a SpatialFilterNode with weights of shape {weights.shape}")
+            merged[-1] = SpatialFilterNode(previous.in_channel_labels, weights=weights,
+                                           out_channel_labels=node.out_channel_labels,
+                                           in_feature_dims=previous.in_feature_dims, dtype=dtype)
+        else:
+            merged.append(node)
+
+    return merged
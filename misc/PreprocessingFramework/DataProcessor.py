@@ -1,5 +1,5 @@
 import functools
-from typing import List, Union, Tuple, Iterable, Optional
+from typing import List, Union, Tuple, Iterable, Optional, Dict
 import logging
 
 import numpy as np
@@ -9,6 +9,7 @@ logger = logging.getLogger(__name__)
 T_Data = Union[np.ndarray, None]
 T_Timestamps = Union[Iterable[float], float, None]
 T_Settings = Union[dict, List[dict], None]
+T_DType = Union[str, type, np.dtype]
 
 
 def check_data_dimensions(func):
@@ -24,6 +25,11 @@ def check_data_dimensions(func):
         elif len(timestamps) == 1:
             # If there's only a single timestamps in a list that is okay
             pass
+        elif isinstance(timestamps, np.ndarray) and timestamps.ndim == 2 and timestamps.shape[0] == data.shape[0]:
+            # Timestamps per trial: the trials are consecutive windows of a single stream (see BufferNode.catch_up)
+            if not data.shape[-1] == timestamps.shape[-1]:
+                logger.warning(
+                    f"The times-dimension of data ({data.shape[-1]}) does not match the length of timestamps per trial ({timestamps.shape[-1]})")
         elif not data.shape[-1] == len(timestamps):
             logger.warning(
                 f"The times-dimension of data ({data.shape[-1]}) does not match the length of timestamps ({len(timestamps)})")
@@ -46,13 +52,28 @@ def clear_decorator(before=True, after=True):
     return wrapper_clear
 
 
+def sub_state(state: Dict[str, np.ndarray], prefix: str) -> Dict[str, np.ndarray]:
+    """Entries of the state of a composite node (see DataProcessor.get_state()) which start with prefix, without it"""
+    return {key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)}
+
+
 class DataProcessor(object):
     # Nodes which provide .widget_dict for LiveWidget should set this to True
     has_widget = False
 
-    def __init__(self, in_channel_labels: List[str], out_channel_labels: List[str] = None, in_feature_dims: Optional[List[int]] = None, **settings):
+    # process() and train() treat the trials independently of each other and train() does not learn from the data.
+    # The trials can then be split across clones of a pipeline, see ProcessingPipeline.process_trials(n_jobs=...).
+    # Nodes which fit parameters to all trials in train() must set this to False
+    independent_trials: bool = True
+
+    def __init__(self, in_channel_labels: List[str], out_channel_labels: List[str] = None, in_feature_dims: Optional[List[int]] = None, dtype: T_DType = np.float64, **settings):
         self.in_channel_labels = in_channel_labels
 
+        # floating point type of the data, states and buffers of the node, usually set for all nodes by the pipeline
+        self.dtype: np.dtype = np.dtype(dtype)
+        if not np.issubdtype(self.dtype, np.floating):
+            raise ValueError(f"dtype of {self.__class__.__name__} must be a floating point type, got {self.dtype}")
+
         self._settings = settings
 
         self.out_channel_labels: List[str] = out_channel_labels
@@ -85,6 +106,15 @@ class DataProcessor(object):
         data_out, timestamps_out = self.process(data, timestamps)
         return data_out, labels, timestamps_out
 
+    def max_chunk_size(self, n_trials: int = 1) -> Optional[int]:
+        """
+        Largest number of samples per process() call for which the output does not depend on how the input is split
+        into chunks. Nodes which output at most one window per call limit it to their shift, for example.
+        :param n_trials: number of trials of the processed data
+        :return: number of samples or None if the chunk size is not limited
+        """
+        return None
+
     def generate_out_channel_labels(self, prefix=None, num_out_channels=None, **kwargs: any) -> List[str]:
         if prefix is None:
             prefix = self.__class__.__name__
@@ -138,6 +168,8 @@ class DataProcessor(object):
         if out_feature_dims:
             settings.update(out_feature_dims=self.out_feature_dims)
 
+        settings.update(dtype=self.dtype.name)
+
         # For aesthetic reasons we would like to have type, in_ and out_channel_labels always in the front
         settings = {**settings, **self._settings.copy()}
 
@@ -152,6 +184,21 @@ class DataProcessor(object):
         """
         pass
 
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        Runtime state of the node, i.e. the variables filled in process() and reset by clear(), for example filter
+        states and buffer contents. Settings and weights set by train() are not part of the state.
+        :return: dict of arrays, empty if the node has no runtime state or is cleared
+        """
+        return dict()
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        """
+        Restores a state returned by get_state() of a node with the same settings. Variables missing in state are
+        cleared
+        """
+        pass
+
     def close(self, *args, **kwargs):
         """
         Function to close streams/files that are opened during runtime. E.g. used by LSLNode
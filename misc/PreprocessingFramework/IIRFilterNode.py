@@ -1,12 +1,11 @@
 from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data
 from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
 
-from typing import Union, List
+from typing import Union, List, Dict
 
 import numpy as np
 from scipy import signal
 
-import matplotlib.pyplot as plt
 import logging
 
 logger = logging.getLogger(__name__)
@@ -81,9 +80,13 @@ class IIRFilterNode(ProcessingNode):
         else:
             raise Exception("Filter type '{:s}' is not supported.".format(ftype))
 
-        self.sos = signal.iirfilter(N=self.order, Wn=wn, rp=self.gpass, rs=self.gstop, btype=self.btype,
-                                    ftype=self.ftype, output='sos', fs=self.sfreq)
-        self.init_zi = signal.sosfilt_zi(self.sos)
+        sos = signal.iirfilter(N=self.order, Wn=wn, rp=self.gpass, rs=self.gstop, btype=self.btype,
+                               ftype=self.ftype, output='sos', fs=self.sfreq)
+
+        # the filter is designed in float64, coefficients and state are kept in the dtype of the node so that
+        # sosfilt runs in that precision
+        self.sos = sos.astype(self.dtype, copy=False)
+        self.init_zi = signal.sosfilt_zi(sos).astype(self.dtype, copy=False)
 
     @check_data_dimensions
     def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
@@ -108,7 +111,16 @@ class IIRFilterNode(ProcessingNode):
     def clear(self, *args, **kwargs):
         self.zf = None
 
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return dict(zf=self.zf) if self.zf is not None else dict()
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self.zf = np.array(state['zf']) if 'zf' in state else None
+
     def plot_filter_response(self, ax=None):
+        # matplotlib is only imported for plotting, it is slow to import and not needed for processing
+        import matplotlib.pyplot as plt
+
         if ax is None:
             ax = plt.gca()
         w, h = signal.sosfreqz(sos=self.sos, fs=self.sfreq)
@@ -144,6 +156,7 @@ if __name__ == '__main__':
     print(node.process(data))
 
     import matplotlib
+    import matplotlib.pyplot as plt
     matplotlib.use('qtagg')
     plt.figure()
     node.plot_filter_response()
@@ -0,0 +1,234 @@
+from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data
+from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
+
+from misc.burg.burg_lags import lag_products, update_lag_products, arburg_from_lags
+from misc.burg.burg_plan import get_burg_spectrum_plan
+
+from typing import List, Optional, Dict
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalBurgSpectrumNode(ProcessingNode):
+    """
+    Sliding-window Burg spectrum which replaces the combination of BufferNode and BurgSpectrumNode.
+
+    Instead of recomputing the AR model of every window from scratch, the node keeps the lag products of the current
+    window and only updates them with the samples entering and leaving the window on every shift. The AR model is then
+    derived from the lag products with arburg_from_lags(), which costs O(model_order^2) instead of
+    O(buffer_length * model_order). The lag products are recomputed from scratch every refresh_interval shifts to keep
+    rounding errors from accumulating.
+
+    Every call slides the window over all shifts which are complete, so chunks longer than the shift are fully
+    consumed. Like BufferNode + BurgSpectrumNode with catch_up=True, the spectra of all these windows are output with
+    the windows on the times axis, shape (n_trials, n_channels, n_windows), together with the timestamps of the last
+    sample of every window. By default only the spectrum of the newest window is output, shape
+    (n_trials, n_channels, nbins), and the AR models of the skipped windows are not estimated.
+    catch_up=True is only supported for nbins=1.
+    """
+
+    def __init__(self,
+                 in_channel_labels: List[str],
+                 sfreq: float,
+                 buffer_length: int,
+                 shift: int,
+                 foi: float = 11,
+                 nbins: int = 1,
+                 bin_width: float = 3.0,
+                 evals_per_bin: int = 15,
+                 output_type: str = 'amplitude',    # amplitude, spectrum -> amplitude means square-rooting of power data
+                 model_order: Optional[int] = None,
+                 refresh_interval: int = 250,
+                 catch_up: bool = False,
+                 **settings):
+
+        super().__init__(in_channel_labels, **settings)
+
+        self.sfreq: float = sfreq
+        self.buffer_length: int = buffer_length
+        self.shift: int = shift
+        self.foi = foi
+        self.nbins = nbins
+        self.bin_width = bin_width
+        self.evals_per_bin = evals_per_bin
+        self.output_type = output_type
+        self.model_order: int = model_order if model_order is not None else int(self.sfreq/10)
+        self.refresh_interval: int = refresh_interval
+        self.catch_up: bool = catch_up
+
+        if self.model_order >= self.buffer_length:
+            raise ValueError(f"model_order ({self.model_order}) must be smaller than buffer_length ({self.buffer_length})")
+        if self.catch_up and self.nbins != 1:
+            raise ValueError(f"catch_up=True is only supported for nbins=1, got nbins={self.nbins}")
+
+        self._plan = get_burg_spectrum_plan(fs=self.sfreq, foi=self.foi, nbins=self.nbins, bin_width=self.bin_width,
+                                            evals_per_bin=self.evals_per_bin, model_order=self.model_order)
+
+        # samples of all trials and channels as rows, the current window starts at _window_start. The samples before
+        # it are discarded when the buffer is full, it only grows for chunks which do not fit otherwise.
+        self._samples: Optional[np.ndarray] = None
+        self._samples_timestamps: Optional[np.ndarray] = None
+        self._n_samples: int = 0
+        self._window_start: int = 0
+        self._lags: Optional[np.ndarray] = None
+        self._shifts_since_refresh: int = 0
+
+    def write(self, signals: np.ndarray, timestamps: T_Timestamps = None):
+        """
+        Appends signals of shape (n_signals, n_times) to the sample buffer
+        """
+        n_signals, new_samples = signals.shape
+
+        if self._samples is None:
+            capacity = max(10 * self.buffer_length, 2 * new_samples)
+            self._samples = np.empty((n_signals, capacity), dtype=np.float64)
+            self._samples_timestamps = np.full(capacity, np.nan)
+            self._n_samples = 0
+            self._window_start = 0
+
+        if self._n_samples + new_samples > self._samples.shape[-1]:
+            # move the current window (or the samples collected for the first window) to the start of the buffer
+            kept = self._n_samples - self._window_start
+            capacity = max(self._samples.shape[-1], 2 * (kept + new_samples))
+            samples = np.empty((n_signals, capacity), dtype=np.float64)
+            samples_timestamps = np.full(capacity, np.nan)
+            samples[:, :kept] = self._samples[:, self._window_start:self._n_samples]
+            samples_timestamps[:kept] = self._samples_timestamps[self._window_start:self._n_samples]
+            self._samples, self._samples_timestamps = samples, samples_timestamps
+            self._n_samples = kept
+            self._window_start = 0
+
+        end = self._n_samples + new_samples
+        self._samples[:, self._n_samples:end] = signals
+        if timestamps is None:
+            self._samples_timestamps[self._n_samples:end] = np.nan
+        elif isinstance(timestamps, (float, int)):
+            self._samples_timestamps[self._n_samples:end] = np.nan
+            self._samples_timestamps[end - 1] = timestamps
+        else:
+            self._samples_timestamps[self._n_samples:end] = [np.nan if t is None else t for t in timestamps]
+        self._n_samples = end
+
+    @check_data_dimensions
+    def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
+            T_Data, T_Timestamps):
+
+        if data is None or data.shape[-1] == 0:
+            return None, None
+
+        if len(data.shape) > 3:
+            raise Exception("IncrementalBurgSpectrumNode is not implemented for ndim > 3 yet. Got data with shape {}.".format(data.shape))
+
+        n_trials, n_channels, n_times = data.shape
+
+        self.write(data.reshape((n_trials * n_channels, n_times)), timestamps)
+
+        # lag products and positions in the sample buffer of the windows completed in this call (only kept with
+        # catch_up=True, otherwise only the newest window is output)
+        n_windows = 0
+        window_lags = []
+        window_starts = []
+
+        if self._lags is None:
+            # the first window is complete as soon as buffer_length samples are available
+            if self._n_samples < self.buffer_length:
+                return None, None
+
+            self._lags = lag_products(self._samples[:, :self.buffer_length], self.model_order)
+            self._shifts_since_refresh = 0
+            n_windows += 1
+            window_lags.append(self._lags.copy())
+            window_starts.append(self._window_start)
+
+        while self._n_samples - self._window_start >= self.buffer_length + self.shift:
+            # slide the window by shift samples and update the lag products accordingly
+            history = self._samples[:, self._window_start:self._window_start + self.buffer_length + self.shift]
+            self._window_start += self.shift
+
+            self._shifts_since_refresh += 1
+            if self._shifts_since_refresh >= self.refresh_interval:
+                self._lags = lag_products(history[:, self.shift:], self.model_order)
+                self._shifts_since_refresh = 0
+            else:
+                update_lag_products(self._lags, history, self.shift)
+
+            n_windows += 1
+            if self.catch_up:
+                window_lags.append(self._lags.copy())
+                window_starts.append(self._window_start)
+
+        if n_windows == 0:
+            return None, None
+
+        if not self.catch_up:
+            window_lags = [self._lags]
+            window_starts = [self._window_start]
+
+        # the AR models of all windows are estimated in a single batched call
+        order = self.model_order
+        head = np.concatenate([self._samples[:, start:start + order + 1] for start in window_starts])
+        tail = np.concatenate([self._samples[:, start + self.buffer_length - order - 1:start + self.buffer_length]
+                               for start in window_starts])
+        ar, rho, ref = arburg_from_lags(np.concatenate(window_lags), head, tail, self.buffer_length, order)
+        amplitudes = self._plan.spectrum_from_ar(ar, rho, output_type=self.output_type)
+
+        # lag products and AR models are kept in float64 (see BurgSpectrumNode), only the output has the dtype of the node
+        amplitudes = amplitudes.reshape((len(window_starts), n_trials, n_channels, self.nbins)).astype(self.dtype, copy=False)
+        window_timestamps = [self._samples_timestamps[start + self.buffer_length - 1] for start in window_starts]
+        # missing timestamps are stored as NaN
+        window_timestamps = [None if np.isnan(t) else float(t) for t in window_timestamps]
+
+        if self.catch_up:
+            # consecutive windows on the times axis, like BurgSpectrumNode after BufferNode with catch_up=True
+            return np.moveaxis(amplitudes[..., 0], 0, -1), window_timestamps
+
+        return amplitudes[0], window_timestamps
+
+    def clear(self, *args, **kwargs):
+        self._samples = None
+        self._samples_timestamps = None
+        self._n_samples = 0
+        self._window_start = 0
+        self._lags = None
+        self._shifts_since_refresh = 0
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        state = dict()
+        if self._samples is not None:
+            # the current window (or the samples collected for the first window) and the samples after it,
+            # missing timestamps are stored as NaN
+            state.update(samples=self._samples[:, self._window_start:self._n_samples],
+                         samples_timestamps=self._samples_timestamps[self._window_start:self._n_samples])
+        if self._lags is not None:
+            state.update(lags=self._lags, shifts_since_refresh=np.array(self._shifts_since_refresh))
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self.clear()
+
+        if 'samples' in state:
+            self.write(np.array(state['samples'], dtype=np.float64), list(state['samples_timestamps']))
+        if 'lags' in state:
+            self._lags = np.array(state['lags'])
+            self._shifts_since_refresh = int(state['shifts_since_refresh'])
+
+    def get_settings(self, *args, **kwargs):
+        settings = super().get_settings(*args, **kwargs)
+
+        settings['sfreq'] = self.sfreq
+        settings['buffer_length'] = self.buffer_length
+        settings['shift'] = self.shift
+        settings['foi'] = self.foi
+        settings['nbins'] = self.nbins
+        settings['bin_width'] = self.bin_width
+        settings['evals_per_bin'] = self.evals_per_bin
+        settings['output_type'] = self.output_type
+        settings['model_order'] = self.model_order
+        settings['refresh_interval'] = self.refresh_interval
+        settings['catch_up'] = self.catch_up
+
+        return settings
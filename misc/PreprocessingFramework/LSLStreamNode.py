@@ -1,5 +1,5 @@
-import collections
 import string
+from collections.abc import Iterable
 from typing import List
 
 import numpy as np
@@ -8,6 +8,7 @@ import logging
 
 from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Data, T_Timestamps
 from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
+from misc.LSLOutletInterface import push_chunk
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +69,17 @@ class LSLStreamNode(ProcessingNode):
     def __del__(self):
         self.close()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['lsl_info'] = None
+        state['lsl_outlet'] = None
+        return state
+
+    def __setstate__(self, state):
+        # copies publish to an outlet of their own
+        self.__dict__.update(state)
+        self.open()
+
     @check_data_dimensions
     def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
             T_Data, T_Timestamps):
@@ -84,28 +96,27 @@ class LSLStreamNode(ProcessingNode):
                 f"*n_features * n_channels (={np.prod(n_features) * n_channels}) does not match channel_count (={self.channel_count}). Not sending anything")
             return data, timestamps
 
-        data_original = data.copy()
-        data = np.moveaxis(data, -1, 1)  # Move times axis to position after trials
+        # (n_trials, n_samples, channel_count) for the lsl outlet, the input data is not modified
+        samples = np.moveaxis(data, -1, 1).reshape((n_trials, n_times, -1))
 
-        # data.shape should now be (n_samples, channel_count) for lsl outlet
         if self.new_timestamps or timestamps is None:
             for i in range(n_trials):
-                self.lsl_outlet.push_chunk(data[i].reshape((n_times, -1)).tolist(), pylsl.local_clock())
-        elif isinstance(timestamps, collections.Iterable):
-            # When multiple timestamps are given, push as single samples
+                push_chunk(self.lsl_outlet, samples[i], pylsl.local_clock())
+        elif isinstance(timestamps, np.ndarray) and timestamps.ndim == 2:
+            # catch-up mode of BufferNode: one row of timestamps per trial
+            for i in range(n_trials):
+                push_chunk(self.lsl_outlet, samples[i], timestamps[i])
+        elif isinstance(timestamps, Iterable):
+            # When multiple timestamps are given, push them with the samples. If any is missing use the local clock
             has_none_timestamps = any([timestamp is None for timestamp in timestamps])
             for i in range(n_trials):
-                for j in range(n_times):
-                    timestamp = timestamps[j]
-                    if has_none_timestamps:
-                        timestamp = pylsl.local_clock()
-                    self.lsl_outlet.push_sample(data[i, j, :].flatten(), timestamp)
+                push_chunk(self.lsl_outlet, samples[i], pylsl.local_clock() if has_none_timestamps else timestamps)
         elif isinstance(timestamps, (int, float)):
             # If the given timestamp is only a single value, push the chunk in a whole
             for i in range(n_trials):
-                self.lsl_outlet.push_chunk(data[i].reshape((n_times, -1)).tolist(), timestamps)
+                push_chunk(self.lsl_outlet, samples[i], timestamps)
 
-        return data_original, timestamps
+        return data, timestamps
 
     def train(self, data: np.array, labels, timestamps=None, *args: any, **kwargs: any):
         return data, labels, timestamps
@@ -0,0 +1,241 @@
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Callable
+
+import numpy as np
+import pylsl
+
+from misc import LSLStreamInfoInterface
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NodeStatistics(object):
+    """
+    Call count, wall times, data shapes and allocations of a single node.
+
+    The statistics are written by the thread processing the pipeline and read e.g. by the thread of PipelineTelemetry,
+    both hold a lock. The maxima are kept for all calls and for the current interval, which summary(interval=True)
+    ends.
+    """
+
+    def __init__(self, name: str, window: int = 1000):
+        """
+        :param name: name of the node in the pipeline
+        :param window: number of most recent calls the percentiles are computed from
+        """
+        self.name: str = name
+        self._lock = threading.Lock()
+        self._init_statistics(window)
+
+    def _init_statistics(self, window: int):
+        self.call_count: int = 0
+        # calls which returned data, e.g. BufferNode returns None until a window is complete
+        self.output_count: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+
+        # ring of the durations of the most recent calls in seconds
+        self._durations: np.ndarray = np.zeros(window)
+
+        self.in_shape: Optional[tuple] = None
+        self.out_shape: Optional[tuple] = None
+
+        # bytes allocated during a call (peak of the traced memory), only if allocations are tracked
+        self.allocated_bytes: int = 0
+        self.max_allocated_bytes: int = 0
+
+        # maxima since the end of the last interval
+        self.interval_max_time: float = 0.0
+        self.interval_max_allocated_bytes: int = 0
+
+    def add(self, duration: float, in_shape: Optional[tuple], out_shape: Optional[tuple], allocated_bytes: int = 0):
+        with self._lock:
+            self._durations[self.call_count % len(self._durations)] = duration
+            self.call_count += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+            self.interval_max_time = max(self.interval_max_time, duration)
+
+            # calls without data (None) keep the shape of the last data
+            if in_shape is not None:
+                self.in_shape = in_shape
+            if out_shape is not None:
+                self.out_shape = out_shape
+                self.output_count += 1
+
+            self.allocated_bytes = allocated_bytes
+            self.max_allocated_bytes = max(self.max_allocated_bytes, allocated_bytes)
+            self.interval_max_allocated_bytes = max(self.interval_max_allocated_bytes, allocated_bytes)
+
+    def percentiles(self, q=(50, 95, 99)) -> np.ndarray:
+        """Percentiles of the durations of the most recent calls in seconds"""
+        with self._lock:
+            durations = self._durations[:min(self.call_count, len(self._durations))].copy()
+        return self._percentiles(durations, q)
+
+    @staticmethod
+    def _percentiles(durations: np.ndarray, q=(50, 95, 99)) -> np.ndarray:
+        if len(durations) == 0:
+            return np.full(len(q), np.nan)
+        return np.percentile(durations, q)
+
+    def summary(self, interval: bool = False) -> dict:
+        """
+        Statistics of the node, times in milliseconds
+        :param interval: end the current interval, the interval maxima of the next summary start from the next call
+        """
+        with self._lock:
+            durations = self._durations[:min(self.call_count, len(self._durations))].copy()
+            summary = dict(call_count=self.call_count, output_count=self.output_count,
+                           mean_ms=self.total_time / self.call_count * 1000 if self.call_count else np.nan,
+                           max_ms=self.max_time * 1000, interval_max_ms=self.interval_max_time * 1000,
+                           in_shape=self.in_shape, out_shape=self.out_shape,
+                           allocated_bytes=self.allocated_bytes, max_allocated_bytes=self.max_allocated_bytes,
+                           interval_max_allocated_bytes=self.interval_max_allocated_bytes)
+            if interval:
+                self.interval_max_time = 0.0
+                self.interval_max_allocated_bytes = 0
+
+        summary['p50_ms'], summary['p95_ms'], summary['p99_ms'] = self._percentiles(durations) * 1000
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._init_statistics(len(self._durations))
+
+
+class PipelineProfiler(object):
+    """
+    Opt-in instrumentation of the nodes of a ProcessingPipeline, usually created with
+    ProcessingPipeline.enable_profiling(). Every node call is timed with perf_counter and its input and output shapes
+    are recorded. Allocations are measured with tracemalloc, which slows down processing considerably and is therefore
+    disabled by default.
+
+    The statistics of a node are available with summary() or, published periodically, with PipelineTelemetry.
+    Nodes in branches of a BranchNode are registered with the index of the BranchNode and of the branch as prefix,
+    e.g. '05.1.02 BurgSpectrumNode'. Their time is included in the time of the BranchNode.
+    """
+
+    def __init__(self, window: int = 1000, track_allocations: bool = False):
+        """
+        :param window: number of most recent calls per node the percentiles are computed from
+        :param track_allocations: measure the memory allocated by every node call with tracemalloc. Not meaningful for
+                                  branches of a BranchNode that run concurrently
+        """
+        self.window: int = window
+        self.track_allocations: bool = track_allocations
+        self.statistics: Dict[str, NodeStatistics] = dict()
+
+        self._started_tracemalloc: bool = False
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def register(self, name: str) -> NodeStatistics:
+        """Returns the statistics with the given name, a new one if it does not exist yet"""
+        if name not in self.statistics:
+            self.statistics[name] = NodeStatistics(name, window=self.window)
+        return self.statistics[name]
+
+    def call(self, statistics: NodeStatistics, process: Callable, data, timestamps, *args, **kwargs):
+        """Calls process(data, timestamps, *args, **kwargs) and adds its duration to statistics"""
+        in_shape = getattr(data, 'shape', None)
+
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        t_start = time.perf_counter()
+        data_out, timestamps_out = process(data, timestamps, *args, **kwargs)
+        duration = time.perf_counter() - t_start
+
+        allocated_bytes = 0
+        if self.track_allocations:
+            allocated_bytes = max(0, tracemalloc.get_traced_memory()[1] - memory_before)
+
+        statistics.add(duration, in_shape, getattr(data_out, 'shape', None), allocated_bytes)
+
+        return data_out, timestamps_out
+
+    def summary(self, interval: bool = False) -> Dict[str, dict]:
+        """Statistics of all nodes in the order of registration, see NodeStatistics.summary()"""
+        return {name: statistics.summary(interval=interval) for name, statistics in self.statistics.items()}
+
+    def reset(self):
+        for statistics in self.statistics.values():
+            statistics.reset()
+
+    def close(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __str__(self):
+        lines = [f"{'node':<50} {'calls':>8} {'p50 [ms]':>9} {'p95 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9} "
+                 f"{'alloc [kB]':>10}  shapes"]
+        for name, s in self.summary().items():
+            lines.append(f"{name:<50.50} {s['call_count']:>8d} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} "
+                         f"{s['p99_ms']:>9.3f} {s['max_ms']:>9.3f} {s['max_allocated_bytes'] / 1024:>10.1f}  "
+                         f"{s['in_shape']} -> {s['out_shape']}")
+        return "\n".join(lines)
+
+
+class PipelineTelemetry(object):
+    """
+    Publishes the statistics of a PipelineProfiler as an LSL stream from a background thread.
+
+    Every interval seconds one sample is pushed with the values of TELEMETRY_METRICS for every node, the channels are
+    labeled '<node> <metric>'. The maxima are those of the calls since the previous sample. Nodes must be registered
+    (the profiling enabled) before the telemetry is started.
+    """
+
+    TELEMETRY_METRICS: List[str] = ['call_count', 'output_count', 'p50_ms', 'p95_ms', 'p99_ms', 'interval_max_ms',
+                                    'interval_max_allocated_bytes']
+
+    def __init__(self, profiler: PipelineProfiler, stream_name: str = 'PipelineTelemetry', interval: float = 1.0,
+                 source_id: Optional[str] = None):
+        self.profiler: PipelineProfiler = profiler
+        self.stream_name: str = stream_name
+        self.interval: float = interval
+        self.source_id: str = source_id if source_id is not None else stream_name
+
+        self._names: List[str] = list(self.profiler.statistics)
+        self.channel_labels: List[str] = [f"{name} {metric}" for name in self._names for metric in self.TELEMETRY_METRICS]
+
+        self.lsl_outlet: Optional[pylsl.StreamOutlet] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self) -> 'PipelineTelemetry':
+        lsl_info = pylsl.StreamInfo(name=self.stream_name, type='Telemetry', channel_count=len(self.channel_labels),
+                                    nominal_srate=pylsl.IRREGULAR_RATE, channel_format=pylsl.cf_double64,
+                                    source_id=self.source_id)
+        LSLStreamInfoInterface.add_channel_names(lsl_info, self.channel_labels)
+        self.lsl_outlet = pylsl.StreamOutlet(lsl_info)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._thread_func, daemon=True, name="PipelineTelemetry")
+        self._thread.start()
+        return self
+
+    def sample(self) -> List[float]:
+        summary = self.profiler.summary(interval=True)
+        return [float(summary[name][metric]) for name in self._names for metric in self.TELEMETRY_METRICS]
+
+    def _thread_func(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.lsl_outlet.push_sample(self.sample())
+            except Exception as e:
+                logger.warning(f"Could not publish pipeline telemetry: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.lsl_outlet = None
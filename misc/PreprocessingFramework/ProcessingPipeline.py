@@ -1,11 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from itertools import compress
-from typing import List, Union, Optional
+from typing import List, Union, Optional, Iterator, Tuple, Dict
 import numpy as np
+import copy
+import hashlib
+import json
 import math
+import os
 
 from misc import PreprocessingFramework
 from misc.PreprocessingFramework.DataProcessor import DataProcessor, check_data_dimensions, T_Data, \
-    T_Timestamps
+    T_Timestamps, T_DType, sub_state
+from misc.PreprocessingFramework.CascadeIIRFilterNode import fuse_iir_filter_nodes
 
 import logging
 
@@ -17,11 +23,28 @@ class ProcessingPipelineException(Exception):
 
 
 class ProcessingPipeline(DataProcessor):
-    def __init__(self, in_channel_labels: Union[List[str], int], nodes: Union[List[dict], List[DataProcessor]], in_feature_dims: List[int] = None, **settings):
+
+    # size of the input chunks in bytes iter_chunks() aims for if the nodes do not limit the chunk size
+    AUTO_CHUNK_BYTES: int = 2 ** 23
+
+    # entry of a snapshot file with the config_hash() of the pipeline the snapshot was taken from
+    SNAPSHOT_HASH_KEY: str = '__config_hash__'
+
+    def __init__(self, in_channel_labels: Union[List[str], int], nodes: Union[List[dict], List[DataProcessor]], in_feature_dims: List[int] = None, fuse_filters: bool = True, dtype: T_DType = np.float64, **settings):
+        """
+        :param in_channel_labels: list of channel labels or number of channels
+        :param nodes: list of settings dictionaries or list of DataProcessors
+        :param in_feature_dims:
+        :param fuse_filters: replace consecutive IIRFilterNodes by a single CascadeIIRFilterNode (identical output)
+        :param dtype: floating point type of the processed data. Input data is converted once and every node created
+                      from settings dictionaries keeps its states and buffers in this type unless its settings specify
+                      another dtype. float32 halves the memory traffic, float64 is the default
+        :param settings:
+        """
         if isinstance(in_channel_labels, int):
             in_channel_labels = [f"In-{i:02}" for i in range(in_channel_labels)]
 
-        super().__init__(in_channel_labels=in_channel_labels, in_feature_dims=in_feature_dims, **settings)
+        super().__init__(in_channel_labels=in_channel_labels, in_feature_dims=in_feature_dims, dtype=dtype, **settings)
 
         if not isinstance(nodes, list):
             raise NotImplementedError("ProcessingPipeline's nodes argument needs argument 'nodes' to be a list")
@@ -45,6 +68,7 @@ class ProcessingPipeline(DataProcessor):
                     if 'in_feature_dims' in node_settings:
                         assert intermediate_feature_dims == node_settings['in_feature_dims'], "in_feature_dims must be consistent"
                         del node_settings['in_feature_dims']
+                    node_settings.setdefault('dtype', self.dtype.name)
                     node: DataProcessor = getattr(module, node_settings["type"])(in_channel_labels=intermediate_channel_labels, in_feature_dims=intermediate_feature_dims, **node_settings)
                     self.nodes.append(node)
                 except TypeError as e:
@@ -67,15 +91,27 @@ class ProcessingPipeline(DataProcessor):
                     f"({self.in_channel_labels} vs. {self.nodes[0].in_channel_labels}")
             out_channel_labels = self.nodes[-1].out_channel_labels
             self._nodes_init: List[dict] = [node.settings for node in self.nodes]
+
+            other_dtypes = [node for node in self.nodes if node.dtype != self.dtype]
+            if other_dtypes:
+                logger.info(f"Nodes {other_dtypes} do not use the dtype {self.dtype} of the pipeline.")
             logger.info(f"Loaded pipeline with {len(self.nodes)} nodes from list of DataProcessors.")
 
         else:
             raise NotImplementedError(
                 "ProcessingPipeline requires 'nodes' to be a list of only dictionaries or only DataProcessors")
 
+        self.fuse_filters: bool = fuse_filters
+        if self.fuse_filters:
+            self.nodes = fuse_iir_filter_nodes(self.nodes)
+
         self.out_channel_labels = out_channel_labels
         self.out_feature_dims = self.nodes[-1].out_feature_dims
 
+        # opt-in instrumentation of the nodes, see enable_profiling()
+        self.profiler = None
+        self._node_statistics: list = []
+
     @check_data_dimensions
     def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
             T_Data, T_Timestamps):
@@ -84,11 +120,19 @@ class ProcessingPipeline(DataProcessor):
         :param timestamps:
         :return: data of shape (n_trials, ...) where the last dimensions depend on the nodes
         """
+        if data is not None:
+            data = np.asarray(data, dtype=self.dtype)
+
+        if self.profiler is not None:
+            for node, statistics in zip(self.nodes, self._node_statistics):
+                data, timestamps = self.profiler.call(statistics, node.process, data, timestamps, *args, **kwargs)
+            return data, timestamps
+
         for node in self.nodes:
             data, timestamps = node.process(data, timestamps, *args, **kwargs)
         return data, timestamps
 
-    def process_trials(self, data: np.ndarray, timestamps: Optional[np.ndarray] = None, clear_between: bool = True, chunk_size: int = 50, *args, **kwargs):
+    def process_trials(self, data: np.ndarray, timestamps: Optional[np.ndarray] = None, clear_between: bool = True, chunk_size: int = 50, *args, n_jobs: int = 1, backend: str = 'thread', **kwargs):
         """
         Propagates a number of trials through the pipeline by splitting it into multiple long chunks
         Timestamps are only processed if they have the same length the the n_times dimension of the data
@@ -96,12 +140,21 @@ class ProcessingPipeline(DataProcessor):
         :param timestamps: list of timestamps
         :param clear_between: indicates if pipeline.clear() should be called between trials. Can result in return values of unequal length if False
         :param chunk_size: chunk size in n_times dimension for using with process()
+        :param n_jobs: number of clones of the pipeline processing shards of the trials concurrently, -1 for one per CPU.
+                       Requires clear_between, the output is identical to serial processing
+        :param backend: 'thread' or 'process' (the pipeline is pickled, guard the calling script with
+                        if __name__ == '__main__' on Windows)
         :param args:
         :param kwargs:
         :return: data_out, timestamps_out retrieved from process_chunks
         """
         n_trials, n_channels, *n_features, n_times = data.shape
 
+        if self._parallel_trials(n_jobs, n_trials, clear_between):
+            results = self._map_trial_shards(_process_trial_shard, n_jobs, backend, data, None, timestamps,
+                                             chunk_size, args, kwargs)
+            return np.concatenate([data_out for data_out, _ in results], axis=0), results[-1][1]
+
         data_out = []
         for trial_i in range(n_trials):
             if clear_between:
@@ -121,6 +174,7 @@ class ProcessingPipeline(DataProcessor):
         """Propagates large/unknown amounts of data through the pipeline by splitting it into chunks and collecting the
         resulting data and timestamps in two lists.
         Timestamps are only processed if they have the same length as the n_times dimension of data.
+        For long recordings use iter_chunks() or process_chunks_into(), which choose large chunk sizes automatically.
         :param data: shape (n_trials, n_channels, ..., n_times)
         :param timestamps: list of timestamps
         :param chunk_size: int
@@ -164,8 +218,136 @@ class ProcessingPipeline(DataProcessor):
 
         return processed_data, processed_timestamps
 
-    def train(self, data, labels, timestamps=None, *args, **kwargs):
-        data_processed, labels_processed, timestamps_processed = data, labels, timestamps
+    def max_chunk_size(self, n_trials: int = 1) -> Optional[int]:
+        """
+        Smallest limit of all nodes. Nodes after a decimating node (e.g. a BufferNode) receive fewer samples per call
+        than the pipeline, so the limit is conservative for them.
+        """
+        limits = [limit for limit in (node.max_chunk_size(n_trials) for node in self.nodes) if limit is not None]
+        return min(limits) if limits else None
+
+    def auto_chunk_size(self, data_shape: Tuple[int, ...]) -> int:
+        """
+        Chunk size for offline processing: chunks of about AUTO_CHUNK_BYTES, limited by max_chunk_size()
+        :param data_shape: shape (n_trials, n_channels, ..., n_times) of the data
+        """
+        n_trials, *sample_shape, n_times = data_shape
+        bytes_per_sample = n_trials * int(np.prod(sample_shape)) * self.dtype.itemsize
+        chunk_size = max(1, self.AUTO_CHUNK_BYTES // max(1, bytes_per_sample))
+
+        limit = self.max_chunk_size(n_trials)
+        if limit is not None:
+            chunk_size = min(chunk_size, limit)
+        return chunk_size
+
+    def iter_chunks(self, data: np.ndarray, timestamps=None, chunk_size: Optional[int] = None,
+                    online_chunk_size: int = 10, *args, **kwargs) -> Iterator[Tuple[np.ndarray, T_Timestamps]]:
+        """
+        Generator which propagates data through the pipeline in chunks and lazily yields the outputs.
+
+        The output equals the output of processing the data in chunks of online_chunk_size samples (like
+        process_chunks() or an online module does) up to floating point rounding: the first chunk has
+        online_chunk_size samples because filters initialize their state from it, all other chunks have chunk_size
+        samples, which by default is the largest size for which the output of the nodes does not depend on the
+        chunking (see max_chunk_size()).
+        Timestamps are only processed if they have the same length as the n_times dimension of data.
+        :param data: shape (n_trials, n_channels, ..., n_times)
+        :param timestamps: list of timestamps
+        :param chunk_size: number of samples per chunk, None chooses it with auto_chunk_size()
+        :param online_chunk_size: number of samples of the first chunk
+        :return: iterator of (data, timestamps) of all chunks with output. The data may be a view on buffers of the
+                 nodes, which is only valid until the next chunk is processed
+        """
+        n_times = data.shape[-1]
+        if chunk_size is None:
+            chunk_size = self.auto_chunk_size(data.shape)
+        else:
+            limit = self.max_chunk_size(data.shape[0])
+            if limit is not None and chunk_size > limit:
+                logger.warning(f"Chunks of {chunk_size} samples are larger than {limit} samples, the output depends on the chunking.")
+
+        include_timestamps = (timestamps is not None) and \
+                             (hasattr(timestamps, '__iter__')) and \
+                             (n_times == len(timestamps))
+
+        logger.debug(f"Processing {n_times} samples in chunks of {chunk_size} samples")
+
+        start_sample = 0
+        while start_sample < n_times:
+            size = min(online_chunk_size, chunk_size) if start_sample == 0 else chunk_size
+            end_sample = min(n_times, start_sample + size)
+
+            chunk = data[..., start_sample:end_sample]
+            chunk_timestamps = timestamps[start_sample:end_sample] if include_timestamps else None
+            start_sample = end_sample
+
+            processed_chunk, processed_chunk_timestamps = self.process(chunk, chunk_timestamps, *args, **kwargs)
+            if processed_chunk is not None:
+                yield processed_chunk, processed_chunk_timestamps
+
+    def process_chunks_into(self, data: np.ndarray, timestamps=None, chunk_size: Optional[int] = None,
+                            online_chunk_size: int = 10, *args, out: Optional[np.ndarray] = None,
+                            **kwargs) -> (np.ndarray, np.ndarray):
+        """
+        Propagates data through the pipeline with iter_chunks() and writes the outputs along the n_times dimension
+        into a preallocated array, e.g. a memory-mapped file for recordings which do not fit into memory:
+            out = np.lib.format.open_memmap('out.npy', mode='w+', dtype=np.float64, shape=(1, 4, n_outputs_max))
+            data_out, timestamps_out = pipeline.process_chunks_into(data, timestamps, out=out)
+        :param data: shape (n_trials, n_channels, ..., n_times)
+        :param timestamps: list of timestamps
+        :param chunk_size: see iter_chunks()
+        :param online_chunk_size: see iter_chunks()
+        :param out: keyword-only, array with the shape of the output and at least as many samples as are output, None
+                    to allocate it
+        :return: (the filled part of out, timestamps of shape (n_outputs,) with NaN for missing timestamps).
+                 Consecutive windows are represented by the timestamp of their last sample
+        """
+        blocks = []
+        blocks_timestamps = []
+        n_outputs = 0
+
+        for block, block_timestamps in self.iter_chunks(data, timestamps, chunk_size, online_chunk_size, *args, **kwargs):
+            n_block = block.shape[-1]
+            if out is None:
+                # the block may be a view on a buffer which is overwritten by the next chunk
+                blocks.append(block if block.flags.owndata else block.copy())
+            elif n_outputs + n_block > out.shape[-1]:
+                raise ProcessingPipelineException(
+                    f"Output array with {out.shape[-1]} samples is too short, got {n_outputs + n_block} samples so far")
+            else:
+                out[..., n_outputs:n_outputs + n_block] = block
+
+            blocks_timestamps.append(_output_timestamps(block_timestamps, n_block))
+            n_outputs += n_block
+
+        timestamps_out = np.concatenate(blocks_timestamps) if blocks_timestamps else np.empty(0)
+
+        if out is None:
+            return (np.concatenate(blocks, axis=-1) if blocks else None), timestamps_out
+        return out[..., :n_outputs], timestamps_out
+
+    def train(self, data, labels, timestamps=None, *args, n_jobs: int = 1, backend: str = 'thread', **kwargs):
+        """
+        Trains all nodes one after another with the output of the previous node
+        :param data: shape (n_trials, n_channels, ..., n_times)
+        :param labels: one label per trial
+        :param timestamps:
+        :param n_jobs: number of clones of the pipeline training on shards of the trials concurrently, -1 for one per
+                       CPU. Only used if the nodes treat trials independently and do not learn in train(), see
+                       independent_trials. The nodes of this pipeline are not trained then
+        :param backend: 'thread' or 'process', see process_trials()
+        :return: (data, labels, timestamps) output by the last node
+        """
+        if self._parallel_trials(n_jobs, len(data), clear_between=True):
+            results = self._map_trial_shards(_train_shard, n_jobs, backend, data, labels, timestamps, None, args, kwargs)
+            labels_out = [shard_labels for _, shard_labels, _ in results]
+            if all(isinstance(shard_labels, np.ndarray) for shard_labels in labels_out):
+                labels_out = np.concatenate(labels_out)
+            else:
+                labels_out = [label for shard_labels in labels_out for label in shard_labels]
+            return np.concatenate([data_out for data_out, _, _ in results], axis=0), labels_out, results[0][2]
+
+        data_processed, labels_processed, timestamps_processed = np.asarray(data, dtype=self.dtype), labels, timestamps
         for node in self.nodes:
             logger.debug(f"Training Node {node}")
             (data_processed, labels_processed, timestamps_processed) = node.train(data_processed, labels_processed, timestamps_processed, *args, **kwargs)
@@ -175,6 +357,109 @@ class ProcessingPipeline(DataProcessor):
 
         return data_processed, labels_processed, timestamps_processed
 
+    @property
+    def independent_trials(self) -> bool:
+        return all(node.independent_trials for node in self.nodes)
+
+    def _parallel_trials(self, n_jobs: int, n_trials: int, clear_between: bool) -> bool:
+        if n_jobs == 1 or n_trials < 2:
+            return False
+        if not clear_between:
+            logger.warning("Trials depend on each other without clear_between, processing them serially.")
+            return False
+        if not self.independent_trials:
+            dependent = [node for node in self.nodes if not node.independent_trials]
+            logger.warning(f"Nodes {dependent} do not treat trials independently, processing them serially.")
+            return False
+        return True
+
+    def _map_trial_shards(self, function, n_jobs: int, backend: str, data: np.ndarray, labels, timestamps,
+                          chunk_size: Optional[int], args: tuple, kwargs: dict) -> list:
+        """
+        Splits the trials into n_jobs contiguous shards and calls function(pipeline, shard data, shard labels,
+        timestamps, chunk_size, args, kwargs) with a clone of this pipeline for every shard concurrently
+        :return: results of the shards in the order of the trials
+        """
+        n_trials = len(data)
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = min(n_jobs, n_trials)
+
+        if backend == 'thread':
+            executor_class = ThreadPoolExecutor
+        elif backend == 'process':
+            executor_class = ProcessPoolExecutor
+        else:
+            raise ValueError(f"backend must be 'thread' or 'process', got {backend}")
+
+        self.clear()
+        shards = np.array_split(np.arange(n_trials), n_jobs)
+        logger.debug(f"Processing {n_trials} trials in {n_jobs} shards with a {backend} pool")
+
+        with executor_class(max_workers=n_jobs) as executor:
+            futures = []
+            for shard in shards:
+                shard_labels = None
+                if labels is not None:
+                    shard_labels = labels[shard] if isinstance(labels, np.ndarray) else [labels[i] for i in shard]
+                # processes receive a pickled copy anyway, threads need a clone each
+                pipeline = self.clone() if backend == 'thread' else self
+                futures.append(executor.submit(function, pipeline, data[shard], shard_labels, timestamps, chunk_size,
+                                               args, kwargs))
+            return [future.result() for future in futures]
+
+    def clone(self) -> 'ProcessingPipeline':
+        """Deep copy of the pipeline and the states of its nodes. The clone is not profiled"""
+        return copy.deepcopy(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # copies and pickled pipelines are not profiled
+        state['profiler'] = None
+        state['_node_statistics'] = []
+        return state
+
+    def compile(self) -> 'ProcessingPipeline':
+        """
+        Creates a CompiledProcessingPipeline with the nodes of this pipeline. Shapes are validated once, adjacent linear
+        stages are merged and intermediate buffers are preallocated. The compiled pipeline shares its nodes with this
+        pipeline, so only one of them should be used for processing.
+        :return: CompiledProcessingPipeline with the same process() API
+        """
+        from misc.PreprocessingFramework.CompiledProcessingPipeline import CompiledProcessingPipeline
+        return CompiledProcessingPipeline(self.in_channel_labels, nodes=list(self.nodes),
+                                          in_feature_dims=self.in_feature_dims, fuse_filters=self.fuse_filters,
+                                          dtype=self.dtype)
+
+    def enable_profiling(self, profiler=None, window: int = 1000, track_allocations: bool = False, prefix: str = ''):
+        """
+        Records call counts, wall times, data shapes and optionally allocations of every node in process()
+        :param profiler: PipelineProfiler to record to, a new one if None
+        :param window: number of most recent calls per node the percentiles are computed from (new profiler only)
+        :param track_allocations: measure allocations with tracemalloc (new profiler only), slows down processing
+        :param prefix: prefix of the node names, used for nested pipelines
+        :return: PipelineProfiler with the statistics of the nodes
+        """
+        from misc.PreprocessingFramework.PipelineProfiler import PipelineProfiler
+        if profiler is None:
+            profiler = PipelineProfiler(window=window, track_allocations=track_allocations)
+
+        self._node_statistics = [profiler.register(f"{prefix}{i_node:02d} {node}") for i_node, node in enumerate(self.nodes)]
+        for i_node, node in enumerate(self.nodes):
+            # nested pipelines, e.g. the branches of a BranchNode
+            if hasattr(node, 'enable_profiling'):
+                node.enable_profiling(profiler, prefix=f"{prefix}{i_node:02d}.")
+
+        self.profiler = profiler
+        return profiler
+
+    def disable_profiling(self):
+        for node in self.nodes:
+            if hasattr(node, 'disable_profiling'):
+                node.disable_profiling()
+        self.profiler = None
+        self._node_statistics = []
+
     def get_class_for_value(self, values):
         for node in self.nodes[::-1]:
             if hasattr(node, 'get_class_for_value'):
@@ -191,6 +476,50 @@ class ProcessingPipeline(DataProcessor):
             node.close(*args, **kwargs)
         logger.debug("All nodes in ProcessingPipeline closed")
 
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Runtime states of all nodes, the keys are prefixed with the index of the node, e.g. '05.1.02.zf'"""
+        return {f"{i_node:02d}.{key}": value for i_node, node in enumerate(self.nodes)
+                for key, value in node.get_state().items()}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        for i_node, node in enumerate(self.nodes):
+            node.set_state(sub_state(state, f"{i_node:02d}."))
+
+    def config_hash(self) -> str:
+        """Hash of the settings of the pipeline. A state can only be restored into a pipeline with the same hash"""
+        settings = json.dumps(self.get_settings(), sort_keys=True, default=_json_default)
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    def snapshot(self, path: Union[str, os.PathLike]):
+        """
+        Saves the runtime state of all nodes (filter states, buffer contents, ...) and the config_hash() to an .npz
+        file. A pipeline with the same settings continues from the snapshot after restore_snapshot(), e.g. after a
+        restart, instead of waiting for its filters to settle and its buffers to fill again.
+        """
+        state = self.get_state()
+        with open(path, 'wb') as fp:
+            np.savez_compressed(fp, **{self.SNAPSHOT_HASH_KEY: np.array(self.config_hash())}, **state)
+        logger.debug(f"Saved snapshot of the pipeline state with {len(state)} entries to {path}")
+
+    def restore_snapshot(self, path: Union[str, os.PathLike]) -> bool:
+        """
+        Restores a snapshot saved with snapshot() if its config hash matches the one of this pipeline
+        :return: True if the state was restored, False if the file does not exist or the settings differ
+        """
+        if not os.path.isfile(path):
+            return False
+
+        with np.load(path, allow_pickle=False) as snapshot:
+            state = {key: snapshot[key] for key in snapshot.files}
+
+        if str(state.pop(self.SNAPSHOT_HASH_KEY, '')) != self.config_hash():
+            logger.info(f"Snapshot {path} was taken from a pipeline with different settings, it is not restored.")
+            return False
+
+        self.set_state(state)
+        logger.info(f"Restored the pipeline state from snapshot {path}.")
+        return True
+
     def __str__(self):
         classifiers = "\n".join(
             [f"{node} ({node.num_in_channels}Ch --> {node.num_out_channels}Ch)" for node in self.nodes])
@@ -203,5 +532,50 @@ class ProcessingPipeline(DataProcessor):
     def get_settings(self, *args, **kwargs):
         settings = super().get_settings(*args, **kwargs)
         nodes_dict = [node.get_settings(*args, **kwargs) for node in self.nodes]
-        settings.update(nodes=nodes_dict, _nodes_init=self._nodes_init)
-        return settings
\ No newline at end of file
+        settings.update(nodes=nodes_dict, _nodes_init=self._nodes_init, fuse_filters=self.fuse_filters)
+        return settings
+
+
+def _process_trial_shard(pipeline: ProcessingPipeline, data: np.ndarray, labels, timestamps, chunk_size: int,
+                         args: tuple, kwargs: dict):
+    try:
+        return pipeline.process_trials(data, timestamps, True, chunk_size, *args, **kwargs)
+    finally:
+        # the pipeline is a clone, e.g. thread pools of BranchNodes are shut down
+        pipeline.close()
+
+
+def _train_shard(pipeline: ProcessingPipeline, data: np.ndarray, labels, timestamps, chunk_size, args: tuple,
+                 kwargs: dict):
+    try:
+        return pipeline.train(data, labels, timestamps, *args, **kwargs)
+    finally:
+        pipeline.close()
+
+
+def _json_default(value):
+    """Converts the values of settings which json can not serialize, e.g. weight matrices"""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return repr(value)
+
+
+def _output_timestamps(timestamps: T_Timestamps, n_times: int) -> np.ndarray:
+    """One float64 timestamp per output sample, windows (2-D timestamps) are represented by their last sample"""
+    if timestamps is None:
+        return np.full(n_times, np.nan)
+
+    # None becomes NaN
+    timestamps = np.array(timestamps, dtype=np.float64)
+    if timestamps.ndim == 2:
+        timestamps = timestamps[:, -1]
+    timestamps = timestamps.reshape(-1)
+
+    if len(timestamps) == n_times:
+        return timestamps
+
+    # e.g. a single timestamp of the most recent sample
+    result = np.full(n_times, np.nan)
+    if len(timestamps) > 0 and n_times > 0:
+        result[-1] = timestamps[-1]
+    return result
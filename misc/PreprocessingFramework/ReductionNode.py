@@ -2,6 +2,8 @@ from typing import Union, List, Callable
 from collections.abc import Iterable
 import importlib
 
+import numpy as np
+
 from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Data, T_Timestamps
 from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
 
@@ -46,6 +48,13 @@ class ReductionNode(ProcessingNode):
         for f, f_args in zip(self._functions, self._arguments):
             data = f(data, **f_args)
 
+        if isinstance(timestamps, np.ndarray) and timestamps.ndim == 2:
+            # catch-up mode of BufferNode: the trials are consecutive windows. Each window is reduced to a single
+            # value, so the windows are moved to the times axis -> shape (1, n_channels, ..., n_windows)
+            if data.shape[-1] == 1:
+                data = np.moveaxis(data[..., 0], 0, -1)[np.newaxis]
+            return data, [self.timestamp_reduction(window_timestamps)[0] for window_timestamps in timestamps]
+
         timestamps = self.timestamp_reduction(timestamps)
 
         return data, timestamps
@@ -64,7 +73,11 @@ class ReductionNode(ProcessingNode):
         if isinstance(timestamps, (int, float)):
             return [timestamps]
         elif isinstance(timestamps, Iterable):
-            return [timestamps[-1]]
+            timestamp = timestamps[-1]
+            # BufferNode marks missing timestamps with NaN
+            if timestamp is not None and np.isnan(timestamp):
+                timestamp = None
+            return [timestamp]
         elif timestamps is None:
             return None
         else:
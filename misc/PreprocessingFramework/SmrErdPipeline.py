@@ -1,8 +1,10 @@
 from typing import List, Tuple, Optional
 import numpy as np
 
+from misc.PreprocessingFramework.DataProcessor import T_DType
+
 from misc.PreprocessingFramework import IIRFilterNode, BufferNode, ReductionNode, SpatialFilterNode, BurgSpectrumNode, \
-    ChannelSelectorNode, SinglePoleFilterNode, LSLStreamNode, ProcessingPipeline
+    ChannelSelectorNode, SinglePoleFilterNode, LSLStreamNode, ProcessingPipeline, BranchNode, DecimatorNode, BandPowerNode
 
 
 def create_smr_erd_pipeline(
@@ -20,14 +22,45 @@ def create_smr_erd_pipeline(
         sliding_window_seconds: float = 0.4,
         single_pole_time_const: float = 0.5,
         enable_debugging_streams: bool = False,
-        channels_eeg_processing=['C3', 'C4', 'CZ']
+        channels_eeg_processing=['C3', 'C4', 'CZ'],
+        buffer_catch_up: bool = False,
+        dtype: T_DType = np.float64,
+        fs_decimated: Optional[float] = None,
+        decimation_phase: str = 'linear',
+        spectral_method: str = 'burg'
 ) -> Tuple:
+    """
+    :param fs_decimated: if set, the EEG branch is decimated to this sampling rate (or the closest higher rate
+                         fs / integer) before the bandpass, the sliding window and the Burg spectrum. The mu band
+                         does not need the full rate, window length and model order shrink by the decimation factor.
+                         The linear-phase anti-alias filter delays the EEG branch by 10 input samples per decimation
+                         factor (78 ms at 512 Hz -> 128 Hz), see DecimatorNode
+    :param decimation_phase: 'linear' or 'minimum'. The minimum-phase anti-alias filter has the same magnitude response
+                             and delays the mu band by only a few input samples
+    :param spectral_method: 'burg' for the Burg spectrum of the sliding window, or a band power engine of
+                            BandPowerNode.BAND_POWER_ENGINES ('fft', 'dft', 'goertzel', 'demodulation'). The engines are
+                            cheaper but scaled differently, thresholds need to be calibrated per method
+    :param dtype: floating point type of the EOG buffer, the band power engines and the output. The IIR filters, the
+                  spatial filter, the decimator and the buffer of the Burg spectrum always run in float64. In float32
+                  the filter recursions lose the EOG on top of a DC offset (27% error at an offset of 10000), and Burg's
+                  recursion turns the float32 rounding of its windows into a median error of ~3% of the ERD amplitude
+    """
+    # dtype of the stages which need float64 regardless of dtype, see above
+    precise_dtype: T_DType = np.float64
+
     inlet_channel_labels = input_channel_labels
     channel_count: int = len(input_channel_labels)
 
-    buffer_length_samples: int = int(fs * sliding_window_seconds)
-    buffer_shift_samples: int = round(fs / fs_out)
-    if (fs / fs_out) % 1 > 1e-2:
+    decimation_factor: int = max(1, int(fs // fs_decimated)) if fs_decimated is not None else 1
+    fs_eeg: float = fs / decimation_factor
+    if fs_decimated is not None and abs(fs_eeg - fs_decimated) > 1e-2:
+        print("WARNING: Sampling rate of {:.5f}Hz can not be decimated to {:.5f}Hz. Using {:.5f}Hz instead.".format(
+            fs, fs_decimated, fs_eeg))
+
+    # window and shift are multiples of the decimation factor, so that the EEG and EOG branch output at the same time
+    buffer_length_samples: int = int(fs_eeg * sliding_window_seconds) * decimation_factor
+    buffer_shift_samples: int = round(fs_eeg / fs_out) * decimation_factor
+    if (fs / fs_out) % 1 > 1e-2 or decimation_factor * round(fs_eeg / fs_out) != round(fs / fs_out):
         fs_out_new: float = fs / buffer_shift_samples
         print((
                           "WARNING: Pipeline output sample rate of {:.5f}Hz is not compatible with input sampling rate of {:.5f}Hz. " +
@@ -43,99 +76,137 @@ def create_smr_erd_pipeline(
 
     node_01_highpass = IIRFilterNode.IIRFilterNode(inlet_channel_labels, sfreq=fs, order=1, ftype="butter",
                                                    btype="highpass", fpass=f_highpass, fstop=f_highpass / 2, gpass=3,
-                                                   gstop=50)
+                                                   gstop=50, dtype=precise_dtype)
 
     node_02_lowpass = IIRFilterNode.IIRFilterNode(inlet_channel_labels, sfreq=fs, order=2, ftype="butter",
                                                   btype="lowpass", fpass=f_lowpass, fstop=f_lowpass + 1, gpass=3,
-                                                  gstop=50)
+                                                  gstop=50, dtype=precise_dtype)
 
     node_03_notch = IIRFilterNode.IIRFilterNode(inlet_channel_labels, sfreq=fs, order=3, ftype="cheby1",
                                                 btype="bandstop", fpass=[f_notch - 6, f_notch + 6],
-                                                fstop=[f_notch - 5, f_notch + 5], gpass=0.1, gstop=50)
+                                                fstop=[f_notch - 5, f_notch + 5], gpass=0.1, gstop=50, dtype=precise_dtype)
 
     node_04_notch = IIRFilterNode.IIRFilterNode(inlet_channel_labels, sfreq=fs, order=3, ftype="cheby1",
                                                 btype="bandstop", fpass=[f_notch - 6, f_notch + 6],
-                                                fstop=[f_notch - 5, f_notch + 5], gpass=0.1, gstop=50)
+                                                fstop=[f_notch - 5, f_notch + 5], gpass=0.1, gstop=50, dtype=precise_dtype)
 
     node_05_laplace = SpatialFilterNode.SpatialFilterNode(inlet_channel_labels, weights=spatial_filter_weight_matrix,
-                                                          out_channel_labels=spatial_filter_output_labels)
+                                                          out_channel_labels=spatial_filter_output_labels, dtype=precise_dtype)
 
-    node_06_channel_select_eeg = ChannelSelectorNode.ChannelSelectorNode(spatial_filter_output_labels, channels_eeg_processing)
+    node_06_channel_select_eeg = ChannelSelectorNode.ChannelSelectorNode(spatial_filter_output_labels, channels_eeg_processing, dtype=dtype)
 
-    node_07_bandpass = IIRFilterNode.IIRFilterNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs, order=3,
+    node_06_decimator = DecimatorNode.DecimatorNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs,
+                                                    factor=decimation_factor, phase=decimation_phase,
+                                                    skip=decimation_factor == 1, dtype=precise_dtype)
+
+    node_07_bandpass = IIRFilterNode.IIRFilterNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs_eeg, order=3,
                                                    ftype="butter", btype="bandpass", fpass=f_eeg_bandpass,
                                                    fstop=[f_eeg_bandpass[0] / 2, f_eeg_bandpass[1] + 1],
-                                                   gpass=3.0, gstop=50)
-
-    node_08_buffer = BufferNode.BufferNode(node_06_channel_select_eeg.out_channel_labels,
-                                           buffer_length=buffer_length_samples, shift=buffer_shift_samples)
-
-    node_09_burg = BurgSpectrumNode.BurgSpectrumNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs, foi=foi)
+                                                   gpass=3.0, gstop=50, dtype=precise_dtype)
+
+    if spectral_method == 'burg':
+        node_08_buffer = BufferNode.BufferNode(node_06_channel_select_eeg.out_channel_labels,
+                                               buffer_length=buffer_length_samples // decimation_factor,
+                                               shift=buffer_shift_samples // decimation_factor,
+                                               catch_up=buffer_catch_up, dtype=precise_dtype)
+
+        node_09_burg = BurgSpectrumNode.BurgSpectrumNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs_eeg,
+                                                         foi=foi, dtype=dtype)
+
+        spectrum_nodes = [
+            node_08_buffer,
+            LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug14", nominal_srate=fs_out,
+                                        skip=not enable_debugging_streams, dtype=dtype),
+            node_09_burg
+        ]
+    else:
+        # buffer and spectrum in one node, same windows and output times as node_08_buffer and node_09_burg
+        spectrum_nodes = [
+            BandPowerNode.BandPowerNode(node_06_channel_select_eeg.out_channel_labels, sfreq=fs_eeg,
+                                        buffer_length=buffer_length_samples // decimation_factor,
+                                        shift=buffer_shift_samples // decimation_factor, method=spectral_method,
+                                        foi=foi, catch_up=buffer_catch_up, dtype=dtype)
+        ]
 
     node_10_singlepole = SinglePoleFilterNode.SinglePoleFilterNode(node_06_channel_select_eeg.out_channel_labels,
-                                                                   time_const=single_pole_time_const, sfreq=fs_out)
+                                                                   time_const=single_pole_time_const, sfreq=fs_out, dtype=dtype)
 
-    node_11_channel_select_eog = ChannelSelectorNode.ChannelSelectorNode(spatial_filter_output_labels, ['bipolar EOG'])
+    node_11_channel_select_eog = ChannelSelectorNode.ChannelSelectorNode(spatial_filter_output_labels, ['bipolar EOG'], dtype=dtype)
 
     node_12_lowpass_eog = IIRFilterNode.IIRFilterNode(['bipolar EOG'], sfreq=fs, order=2, ftype="butter",
                                                       btype="lowpass",
-                                                      fpass=f_eog_lowpass, fstop=f_eog_lowpass + 1, gpass=3, gstop=50)
+                                                      fpass=f_eog_lowpass, fstop=f_eog_lowpass + 1, gpass=3, gstop=50, dtype=precise_dtype)
 
     node_13_buffer_eog = BufferNode.BufferNode(['bipolar EOG'], buffer_length=buffer_length_samples,
-                                               shift=buffer_shift_samples)
+                                               shift=buffer_shift_samples, catch_up=buffer_catch_up, dtype=dtype)
 
     node_14_reduction = ReductionNode.ReductionNode(['bipolar EOG'], functions=[
         dict(module='numpy', name='take', args=dict(indices=-1, axis=-1)),
-        dict(module='numpy', name='expand_dims', args=dict(axis=-1))])
+        dict(module='numpy', name='expand_dims', args=dict(axis=-1))], dtype=dtype)
 
     common_pipeline_nodes = [
         node_01_highpass,
         LSLStreamNode.LSLStreamNode(inlet_channel_labels, "debug1", nominal_srate=fs,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_02_lowpass,
         LSLStreamNode.LSLStreamNode(inlet_channel_labels, "debug2", nominal_srate=fs,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_03_notch,
         LSLStreamNode.LSLStreamNode(inlet_channel_labels, "debug3", nominal_srate=fs,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_04_notch,
         LSLStreamNode.LSLStreamNode(inlet_channel_labels, "debug4", nominal_srate=fs,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_05_laplace,
         LSLStreamNode.LSLStreamNode(spatial_filter_output_labels, "debug5", nominal_srate=fs,
-                                    skip=not enable_debugging_streams)
+                                    skip=not enable_debugging_streams, dtype=dtype)
     ]
 
     eeg_pipeline_nodes = [
         node_06_channel_select_eeg,
+        node_06_decimator,
         node_07_bandpass,
-        LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug7", nominal_srate=fs,
-                                    skip=not enable_debugging_streams),
-        node_08_buffer,
-        LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug14", nominal_srate=fs_out,
-                                    skip=not enable_debugging_streams),
-        node_09_burg,
+        LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug7", nominal_srate=fs_eeg,
+                                    skip=not enable_debugging_streams, dtype=dtype),
+        *spectrum_nodes,
         LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug9", nominal_srate=fs_out,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_10_singlepole,
         LSLStreamNode.LSLStreamNode(node_06_channel_select_eeg.out_channel_labels, "debug10", nominal_srate=fs_out,
-                                    skip=not enable_debugging_streams)
+                                    skip=not enable_debugging_streams, dtype=dtype)
     ]
 
     eog_pipeline_nodes = [
         node_11_channel_select_eog,
-        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug11", nominal_srate=fs, skip=not enable_debugging_streams),
+        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug11", nominal_srate=fs, skip=not enable_debugging_streams, dtype=dtype),
         node_12_lowpass_eog,
-        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug12", nominal_srate=fs, skip=not enable_debugging_streams),
+        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug12", nominal_srate=fs, skip=not enable_debugging_streams, dtype=dtype),
         node_13_buffer_eog,
         LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug15", nominal_srate=fs_out,
-                                    skip=not enable_debugging_streams),
+                                    skip=not enable_debugging_streams, dtype=dtype),
         node_14_reduction,
-        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug13", nominal_srate=fs_out, skip=not enable_debugging_streams)
+        LSLStreamNode.LSLStreamNode(['bipolar EOG'], "debug13", nominal_srate=fs_out, skip=not enable_debugging_streams, dtype=dtype)
     ]
 
-    common_pipeline = ProcessingPipeline.ProcessingPipeline(inlet_channel_labels, common_pipeline_nodes)
-    eeg_pipeline = ProcessingPipeline.ProcessingPipeline(spatial_filter_output_labels, eeg_pipeline_nodes)
-    eog_pipeline = ProcessingPipeline.ProcessingPipeline(spatial_filter_output_labels, eog_pipeline_nodes)
+    common_pipeline = ProcessingPipeline.ProcessingPipeline(inlet_channel_labels, common_pipeline_nodes, dtype=dtype)
+    eeg_pipeline = ProcessingPipeline.ProcessingPipeline(spatial_filter_output_labels, eeg_pipeline_nodes, dtype=dtype)
+    eog_pipeline = ProcessingPipeline.ProcessingPipeline(spatial_filter_output_labels, eog_pipeline_nodes, dtype=dtype)
+
+    return common_pipeline, eeg_pipeline, eog_pipeline, fs_out
+
+
+def combine_smr_erd_pipelines(common_pipeline: ProcessingPipeline.ProcessingPipeline,
+                              eeg_pipeline: ProcessingPipeline.ProcessingPipeline,
+                              eog_pipeline: ProcessingPipeline.ProcessingPipeline,
+                              n_workers: int = 2) -> ProcessingPipeline.ProcessingPipeline:
+    """
+    Combines the pipelines returned by create_smr_erd_pipeline() into a single pipeline: the common stage fans out to
+    the EOG and the EEG branch, which run concurrently in a BranchNode. The outputs are concatenated along the
+    channel axis, EOG channels first.
+    """
+    node_branches = BranchNode.BranchNode(common_pipeline.out_channel_labels,
+                                          branches=[eog_pipeline, eeg_pipeline], n_workers=n_workers,
+                                          dtype=common_pipeline.dtype)
 
-    return common_pipeline, eeg_pipeline, eog_pipeline, fs_out
\ No newline at end of file
+    return ProcessingPipeline.ProcessingPipeline(common_pipeline.in_channel_labels,
+                                                 common_pipeline.nodes + [node_branches], dtype=common_pipeline.dtype)
@@ -1,7 +1,7 @@
 from misc.PreprocessingFramework.DataProcessor import check_data_dimensions, T_Timestamps, T_Data
 from misc.PreprocessingFramework.ProcessingNode import ProcessingNode
 
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -11,16 +11,96 @@ logger = logging.getLogger(__name__)
 
 
 class SpatialFilterNode(ProcessingNode):
+    """
+    Linear combination of channels: output[trial] = weights @ data[trial] for all trials at once.
+
+    Sparse weight matrices (e.g. Laplacian filters with a few non-zero weights per output channel) are stored in a
+    compact gather/scale form: per output channel the indices and weights of its non-zero inputs. Large chunks are
+    then filtered by gathering only the used input channels, which needs fewer operations and touches less memory
+    than the dense product. Small chunks are dominated by call overhead and use a single batched matmul instead.
+    """
+
+    # minimal number of samples (n_trials * n_times) from which on the gather/scale form is used for sparse weights
+    SPARSE_MIN_SAMPLES: int = 128
 
     def __init__(self,
                  in_channel_labels: List[str],
                  weights: np.ndarray,
+                 reuse_output: bool = False,
                  **settings):
+        """
+        :param in_channel_labels:
+        :param weights: shape (n_out x n_in)
+        :param reuse_output: write the output into a buffer which is reused by the next call. Only use this if the
+                             following node does not keep a reference to its input
+        :param settings:
+        """
 
         super().__init__(in_channel_labels, **settings)
 
         # shape (n_out x n_in)
         self.weights = weights
+        self.reuse_output: bool = reuse_output
+
+        self._weights: np.ndarray = np.asarray(weights, dtype=self.dtype)
+        self._gather_indices: Optional[np.ndarray] = None
+        self._gather_weights: Optional[np.ndarray] = None
+        self._init_sparse()
+
+        self._output_buffer: Optional[np.ndarray] = None
+        self._gather_buffer: Optional[np.ndarray] = None
+
+    def _init_sparse(self):
+        """Stores the weights in gather/scale form if at most half of the inputs are used per output channel"""
+        if self._weights.ndim != 2:
+            return
+
+        n_out, n_in = self._weights.shape
+        nonzero = [np.flatnonzero(row) for row in self._weights]
+        n_used = max([len(indices) for indices in nonzero] + [1])
+
+        if 2 * n_used > n_in:
+            return
+
+        # pad with weight 0 of input channel 0
+        self._gather_indices = np.zeros((n_out, n_used), dtype=np.intp)
+        self._gather_weights = np.zeros((n_out, 1, n_used), dtype=self._weights.dtype)
+        for i_out, indices in enumerate(nonzero):
+            self._gather_indices[i_out, :len(indices)] = indices
+            self._gather_weights[i_out, 0, :len(indices)] = self._weights[i_out, indices]
+
+    @property
+    def is_sparse(self) -> bool:
+        return self._gather_indices is not None
+
+    def apply(self, data: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Applies the weights to all trials
+        :param data: shape (n_trials, n_in, n_times)
+        :param out: optional output array of shape (n_trials, n_out, n_times) and dtype of data
+        :return: shape (n_trials, n_out, n_times)
+        """
+        n_trials, n_channels, n_times = data.shape
+        n_out = self._weights.shape[0]
+
+        if out is None:
+            out = np.empty((n_trials, n_out, n_times), dtype=data.dtype)
+
+        if self.is_sparse and n_trials * n_times >= self.SPARSE_MIN_SAMPLES:
+            n_used = self._gather_indices.shape[1]
+            gather_size = n_trials * n_out * n_used * n_times
+            if self._gather_buffer is None or self._gather_buffer.size < gather_size or self._gather_buffer.dtype != data.dtype:
+                self._gather_buffer = np.empty(gather_size, dtype=data.dtype)
+            gathered = self._gather_buffer[:gather_size].reshape((n_trials, n_out * n_used, n_times))
+
+            # gather the used input channels of every output channel, then scale and sum them
+            np.take(data, self._gather_indices.ravel(), axis=1, out=gathered)
+            np.matmul(self._gather_weights, gathered.reshape((n_trials, n_out, n_used, n_times)),
+                      out=out.reshape((n_trials, n_out, 1, n_times)))
+        else:
+            np.matmul(self._weights, data, out=out)
+
+        return out
 
     @check_data_dimensions
     def process(self, data: T_Data, timestamps: T_Timestamps = None, *args: any, **kwargs: any) -> (
@@ -32,24 +112,19 @@ class SpatialFilterNode(ProcessingNode):
         if len(data.shape) > 3:
             raise Exception("SpatialFilterNode can not process more than 3 dimensions of data.")
 
-        n_trials, n_channels, n_times = data.shape
+        out = None
+        if self.reuse_output:
+            n_trials, n_channels, n_times = data.shape
+            size = n_trials * self._weights.shape[0] * n_times
+            if self._output_buffer is None or self._output_buffer.size < size or self._output_buffer.dtype != data.dtype:
+                self._output_buffer = np.empty(size, dtype=data.dtype)
+            out = self._output_buffer[:size].reshape((n_trials, self._weights.shape[0], n_times))
 
-        n_out_channels = self.weights.shape[0]
-
-        # create zero-filled array for output data with adjusted number of channels
-        output_data = np.zeros([n_trials, n_out_channels, n_times], dtype=data.dtype)
-
-        # process data per trial
-        for i in range(n_trials):
-
-            output_data[i] = self.weights @ data[i]
-
-        return output_data, timestamps
+        return self.apply(data, out=out), timestamps
 
     def get_settings(self, *args, **kwargs):
         settings = super().get_settings(*args, **kwargs)
         settings['weights'] = self.weights
-        
-        return settings
-
+        settings['reuse_output'] = self.reuse_output
 
+        return settings
@@ -0,0 +1,443 @@
+import platform
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pylsl
+
+import globals
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# segments are named after the stream, macOS limits the names of shared memory segments to 31 characters
+SEGMENT_PREFIX: str = 'bci_'
+SEGMENT_NAME_LENGTH: int = 30
+
+# samples the ring buffer of a stream holds, consumers which fall behind by more lose the oldest samples
+DEFAULT_CAPACITY_SECONDS: float = 10.0
+# capacity of streams with an irregular or very low sampling rate
+MIN_CAPACITY: int = 4096
+
+# the ring relies on the store ordering of x86 CPUs (see SharedMemoryRing), other hosts (e.g. ARM, Apple Silicon) use LSL
+SUPPORTED_MACHINES = ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+# interval in seconds in which consumers poll for new samples while waiting
+POLL_INTERVAL: float = 1e-4
+# interval in seconds in which consumers of a closed ring look for the segment of a new outlet of the stream
+REATTACH_INTERVAL: float = 0.1
+
+
+def segment_name(stream_name: str) -> str:
+    return (SEGMENT_PREFIX + ''.join(c if c.isalnum() else '_' for c in stream_name))[:SEGMENT_NAME_LENGTH]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attaches to an existing segment without registering it for cleanup, only the producer unlinks it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Python < 3.13: the resource tracker of a consumer would unlink the segment when the consumer exits. Unregistering
+    # it afterwards would also remove the registration of the producer if both share the tracker of a parent process.
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedMemoryRing(object):
+    """
+    Single-producer/multi-consumer ring buffer of float32 frames (one sample of all channels) with float64 timestamps in
+    a shared memory segment, for handing samples between the module processes on one host without LSL.
+
+    Layout of the segment: a header of int64 values (magic, channel count, capacity, claimed and published frame count,
+    closed flag), the nominal sampling rate, the LSL source id of the producer, the timestamps and the frames.
+
+    The ring is lock-free. The producer first claims the frames it is going to write (claimed count), writes them and
+    then publishes them (published count). Every consumer keeps its own read position and copies the frames between its
+    position and the published count. Frames which the producer may have overwritten while they were copied (older than
+    the claimed count minus the capacity) are discarded afterwards, like the frames of consumers that fell behind by
+    more than the capacity. Both are counted as dropped. The counts are aligned int64 values which are written with a
+    single store. There are no memory barriers, the ordering of the stores and loads relies on the strong memory
+    ordering of x86 CPUs. On other CPUs, e.g. ARM, frames could be read before they are written, so create_outlet() and
+    create_inlet() only use the ring on x86 hosts (see shared_memory_supported()).
+    """
+
+    MAGIC: int = 0x31474E4952424342
+
+    _HEADER_LENGTH: int = 8
+    _MAGIC, _N_CHANNELS, _CAPACITY, _CLAIMED, _PUBLISHED, _CLOSED = range(6)
+    _SRATE_OFFSET: int = 64
+    _SOURCE_ID_OFFSET: int = 72
+    _SOURCE_ID_LENGTH: int = 128
+    _TIMESTAMPS_OFFSET: int = 256
+
+    def __init__(self, segment: shared_memory.SharedMemory, owner: bool):
+        self.segment: shared_memory.SharedMemory = segment
+        # the producer unlinks the segment when it is closed
+        self.owner: bool = owner
+
+        buffer = segment.buf
+        self._header: np.ndarray = np.ndarray((self._HEADER_LENGTH,), dtype=np.int64, buffer=buffer)
+        if self._header[self._MAGIC] != self.MAGIC:
+            self._header = None
+            raise ValueError(f"Shared memory segment {segment.name} is not a sample ring buffer")
+
+        self.n_channels: int = int(self._header[self._N_CHANNELS])
+        self.capacity: int = int(self._header[self._CAPACITY])
+        self.nominal_srate: float = float(np.ndarray((1,), dtype=np.float64, buffer=buffer, offset=self._SRATE_OFFSET)[0])
+        self.source_id: str = bytes(buffer[self._SOURCE_ID_OFFSET:self._SOURCE_ID_OFFSET + self._SOURCE_ID_LENGTH]) \
+            .rstrip(b'\0').decode('utf-8')
+
+        self._timestamps: np.ndarray = np.ndarray((self.capacity,), dtype=np.float64, buffer=buffer,
+                                                  offset=self._TIMESTAMPS_OFFSET)
+        self._frames: np.ndarray = np.ndarray((self.capacity, self.n_channels), dtype=np.float32, buffer=buffer,
+                                              offset=self._TIMESTAMPS_OFFSET + 8 * self.capacity)
+
+    @classmethod
+    def create(cls, name: str, n_channels: int, capacity: int, nominal_srate: float = 0.0,
+               source_id: str = '') -> 'SharedMemoryRing':
+        size = cls._TIMESTAMPS_OFFSET + 8 * capacity + 4 * capacity * n_channels
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a producer which did not shut down cleanly
+            logger.info(f"Replacing the stale shared memory segment {name}")
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        buffer = segment.buf
+        np.ndarray((1,), dtype=np.float64, buffer=buffer, offset=cls._SRATE_OFFSET)[0] = nominal_srate
+        encoded = source_id.encode('utf-8')[:cls._SOURCE_ID_LENGTH]
+        buffer[cls._SOURCE_ID_OFFSET:cls._SOURCE_ID_OFFSET + len(encoded)] = encoded
+
+        header = np.ndarray((cls._HEADER_LENGTH,), dtype=np.int64, buffer=buffer)
+        header[:] = 0
+        header[cls._N_CHANNELS] = n_channels
+        header[cls._CAPACITY] = capacity
+        # written last, consumers only attach to initialized segments
+        header[cls._MAGIC] = cls.MAGIC
+
+        return cls(segment, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedMemoryRing':
+        """:raises FileNotFoundError: if there is no segment with this name"""
+        segment = _attach(name)
+        try:
+            return cls(segment, owner=False)
+        except ValueError:
+            segment.close()
+            raise
+
+    @property
+    def published(self) -> int:
+        """Number of frames written since the ring was created"""
+        return int(self._header[self._PUBLISHED])
+
+    @property
+    def closed(self) -> bool:
+        return self._header is None or bool(self._header[self._CLOSED])
+
+    def write(self, frames: np.ndarray, timestamps: np.ndarray):
+        """
+        Appends frames, only to be called by the producer
+        :param frames: shape (n_frames, n_channels)
+        :param timestamps: shape (n_frames,)
+        """
+        n_frames = len(frames)
+        if n_frames == 0:
+            return
+
+        start = int(self._header[self._PUBLISHED])
+        end = start + n_frames
+        if n_frames > self.capacity:
+            # the older frames would be overwritten by the newer ones of the same chunk
+            frames, timestamps = frames[-self.capacity:], timestamps[-self.capacity:]
+            start = end - self.capacity
+
+        self._header[self._CLAIMED] = end
+
+        index = start % self.capacity
+        first = min(end - start, self.capacity - index)
+        self._frames[index:index + first] = frames[:first]
+        self._timestamps[index:index + first] = timestamps[:first]
+        self._frames[:end - start - first] = frames[first:]
+        self._timestamps[:end - start - first] = timestamps[first:]
+
+        self._header[self._PUBLISHED] = end
+
+    def read(self, position: int, max_frames: int, frames: Optional[np.ndarray] = None) \
+            -> Tuple[np.ndarray, np.ndarray, int, int]:
+        """
+        Copies the frames from position on, at most max_frames
+        :param frames: destination of shape (>= max_frames, n_channels), allocated if None
+        :return: (frames, timestamps, new position, number of dropped frames)
+        """
+        published = int(self._header[self._PUBLISHED])
+        dropped = max(0, published - position - self.capacity)
+        position += dropped
+        n_frames = max(0, min(published - position, max_frames))
+
+        if frames is None:
+            frames = np.empty((n_frames, self.n_channels), dtype=np.float32)
+        timestamps = np.empty(n_frames, dtype=np.float64)
+        if n_frames == 0:
+            return frames[:0], timestamps, position, dropped
+
+        index = position % self.capacity
+        first = min(n_frames, self.capacity - index)
+        frames[:first] = self._frames[index:index + first]
+        timestamps[:first] = self._timestamps[index:index + first]
+        frames[first:n_frames] = self._frames[:n_frames - first]
+        timestamps[first:] = self._timestamps[:n_frames - first]
+
+        # frames the producer may have overwritten while they were copied
+        overwritten = min(n_frames, max(0, int(self._header[self._CLAIMED]) - self.capacity - position))
+        if overwritten > 0:
+            frames[:n_frames - overwritten] = frames[overwritten:n_frames].copy()
+            timestamps = timestamps[overwritten:]
+            dropped += overwritten
+
+        return frames[:n_frames - overwritten], timestamps, position + n_frames, dropped
+
+    def wait(self, position: int, timeout: float) -> bool:
+        """
+        Polls until frames after position are published or the timeout (in seconds) expires. No more frames are
+        published once the ring is closed, then it sleeps until the timeout expires.
+        """
+        deadline = time.perf_counter() + timeout
+        while int(self._header[self._PUBLISHED]) <= position:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            if self.closed:
+                time.sleep(remaining)
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def close(self):
+        if self._header is None:
+            return
+        if self.owner:
+            self._header[self._CLOSED] = 1
+        # the views have to be released before the segment can be closed
+        self._header = self._timestamps = self._frames = None
+        self.segment.close()
+        if self.owner:
+            self.segment.unlink()
+
+
+class SharedMemoryOutlet(pylsl.StreamOutlet):
+    """
+    LSL outlet which additionally writes every pushed sample to a SharedMemoryRing of the same name.
+
+    The samples are still pushed to LSL, so LabRecorder and consumers on other hosts receive them as before, while
+    consumers on the same host read them from shared memory with SharedMemoryInlet. The samples are written to the ring
+    first, local consumers do not wait for the LSL push. Only float32 streams are supported.
+    """
+
+    def __init__(self, info: pylsl.StreamInfo, chunk_size: int = 0, max_buffered: int = 360,
+                 capacity: Optional[int] = None):
+        self.ring: Optional[SharedMemoryRing] = None
+        super().__init__(info, chunk_size, max_buffered)
+
+        self.nominal_srate: float = info.nominal_srate()
+        self.n_channels: int = info.channel_count()
+        if capacity is None:
+            capacity = max(MIN_CAPACITY, int(self.nominal_srate * DEFAULT_CAPACITY_SECONDS))
+
+        self.ring = SharedMemoryRing.create(
+            segment_name(info.name()), self.n_channels, capacity, nominal_srate=self.nominal_srate,
+            source_id=info.source_id())
+
+    def push_sample(self, x, timestamp=0.0, pushthrough=True):
+        timestamp = self._write(x, timestamp)
+        super().push_sample(x, timestamp, pushthrough)
+
+    def push_chunk(self, x, timestamp=0.0, pushthrough=True):
+        timestamp = self._write(x, timestamp)
+        super().push_chunk(x, timestamp, pushthrough)
+
+    def _write(self, x, timestamp):
+        """
+        Writes the samples to the ring
+        :return: timestamp to push to LSL, 0.0 (now) is replaced by the time the samples were written to the ring so
+                 that both transports carry the same timestamps
+        """
+        if self.ring is None:
+            return timestamp
+        frames = np.asarray(x, dtype=np.float32).reshape((-1, self.n_channels))
+        timestamps = self._sample_timestamps(len(frames), timestamp)
+        self.ring.write(frames, timestamps)
+        return timestamp if not np.isscalar(timestamp) or timestamp else float(timestamps[-1])
+
+    def _sample_timestamps(self, n_samples: int, timestamp) -> np.ndarray:
+        """Timestamps per sample like LSL assigns them: 0.0 is now, earlier samples are back-dated by the sampling interval"""
+        if not np.isscalar(timestamp):
+            return np.asarray(timestamp, dtype=np.float64)
+
+        timestamp = float(timestamp) if timestamp else pylsl.local_clock()
+        if n_samples == 1 or self.nominal_srate == pylsl.IRREGULAR_RATE:
+            return np.full(n_samples, timestamp)
+        return timestamp - np.arange(n_samples - 1, -1, -1) / self.nominal_srate
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+
+class SharedMemoryInlet(object):
+    """
+    Reads the samples of a SharedMemoryOutlet on the same host, with the interface of pylsl.StreamInlet used by the
+    modules (pull_sample, pull_chunk, info, close_stream). Like an LSL inlet it receives the samples pushed after it
+    was opened.
+
+    When the outlet is closed, e.g. because the producing module restarts, the inlet attaches to the segment of the
+    next outlet of the same stream name as soon as it is created and receives its samples from the start.
+    """
+
+    def __init__(self, info: pylsl.StreamInfo):
+        """
+        :param info: stream info of the LSL stream, e.g. from resolve_byprop()
+        :raises FileNotFoundError: if the stream is not published in shared memory
+        :raises ValueError: if the segment belongs to another outlet than the LSL stream
+        """
+        self._info: pylsl.StreamInfo = info
+        self._full_info: Optional[pylsl.StreamInfo] = None
+        self.ring: Optional[SharedMemoryRing] = None
+        self.ring = SharedMemoryRing.attach(segment_name(info.name()))
+
+        if self.ring.source_id != info.source_id():
+            self.ring.close()
+            raise ValueError(f"The shared memory segment of stream {info.name()} belongs to another source "
+                             f"({self.ring.source_id}, expected {info.source_id()})")
+
+        self.position: int = self.ring.published
+        self.dropped: int = 0
+
+    def info(self, timeout: float = pylsl.FOREVER) -> pylsl.StreamInfo:
+        """Full stream info including the description (channel labels etc.), queried once from the LSL outlet"""
+        if self._full_info is None:
+            inlet = pylsl.StreamInlet(self._info)
+            try:
+                self._full_info = inlet.info(timeout)
+            finally:
+                inlet.close_stream()
+        return self._full_info
+
+    def samples_available(self) -> int:
+        return max(0, self.ring.published - self.position)
+
+    def _reattach(self) -> bool:
+        """
+        Attaches to the segment of a new outlet after the ring was closed by its producer
+        :return: True if the inlet reads from a new ring
+        """
+        try:
+            ring = SharedMemoryRing.attach(segment_name(self._info.name()))
+        except (FileNotFoundError, ValueError):
+            return False
+
+        # the closed segment can still be found under its name until the producer has unlinked it
+        if ring.closed or ring.n_channels != self.ring.n_channels:
+            ring.close()
+            return False
+
+        logger.info(f"{self._info.name()}: attached to the shared memory segment of the new outlet {ring.source_id}")
+        self.ring.close()
+        self.ring = ring
+        self.position = 0
+        return True
+
+    def pull_chunk(self, timeout: float = 0.0, max_samples: int = 1024, dest_obj: Optional[np.ndarray] = None) \
+            -> Tuple[Optional[np.ndarray], List[float]]:
+        """
+        Returns as soon as samples are available, or after the timeout
+        :param dest_obj: array of shape (>= max_samples, n_channels) the samples are copied to
+        :return: (samples of shape (n_samples, n_channels), or None if dest_obj is given, timestamps)
+        """
+        deadline = time.perf_counter() + timeout
+        while not self.samples_available():
+            if self.ring.closed and self._reattach():
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            # the ring may be closed while waiting, it is checked for a new outlet every REATTACH_INTERVAL
+            if self.ring.wait(self.position, min(remaining, REATTACH_INTERVAL)):
+                break
+
+        frames, timestamps, self.position, dropped = self.ring.read(self.position, max_samples, dest_obj)
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"{self._info.name()}: {dropped} samples were overwritten before they were read")
+
+        return (None if dest_obj is not None else frames), timestamps.tolist()
+
+    def pull_sample(self, timeout: float = pylsl.FOREVER, sample=None) -> Tuple[Optional[list], Optional[float]]:
+        frames, timestamps = self.pull_chunk(timeout=timeout, max_samples=1)
+        if len(timestamps) == 0:
+            return None, None
+        return frames[0].tolist(), timestamps[0]
+
+    def close_stream(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def __del__(self):
+        self.close_stream()
+
+
+def shared_memory_supported() -> bool:
+    """True if the CPU of this host orders memory accesses as the lock-free ring requires"""
+    return platform.machine().lower() in SUPPORTED_MACHINES
+
+
+def create_outlet(info: pylsl.StreamInfo, chunk_size: int = 0, max_buffered: int = 360) -> pylsl.StreamOutlet:
+    """
+    StreamOutlet which also publishes the samples in shared memory if the stream is listed in
+    globals.SHARED_MEMORY_STREAMS and the host is supported, a plain StreamOutlet otherwise
+    """
+    if info.name() in globals.SHARED_MEMORY_STREAMS:
+        if not shared_memory_supported():
+            logger.warning(f"Shared memory transport is not supported on {platform.machine()} hosts, "
+                           f"using LSL only for {info.name()}")
+        elif info.channel_format() == pylsl.cf_float32:
+            try:
+                return SharedMemoryOutlet(info, chunk_size, max_buffered)
+            except OSError as e:
+                logger.warning(f"Could not publish {info.name()} in shared memory, using LSL only: {e}")
+        else:
+            logger.warning(f"Only float32 streams can be published in shared memory, using LSL only for {info.name()}")
+    return pylsl.StreamOutlet(info, chunk_size, max_buffered)
+
+
+def create_inlet(info: pylsl.StreamInfo, max_buflen: int = 360, max_chunklen: int = 0, recover: bool = True):
+    """
+    SharedMemoryInlet if the stream is listed in globals.SHARED_MEMORY_STREAMS and published in shared memory on this
+    host, a StreamInlet otherwise
+    """
+    if info.name() in globals.SHARED_MEMORY_STREAMS and shared_memory_supported():
+        try:
+            return SharedMemoryInlet(info)
+        except (FileNotFoundError, ValueError) as e:
+            logger.info(f"Receiving {info.name()} via LSL: {e}")
+    return pylsl.StreamInlet(info, max_buflen=max_buflen, max_chunklen=max_chunklen, recover=recover)
@@ -0,0 +1,113 @@
+import numpy as np
+
+from typing import Tuple
+
+
+def arburg_batch(X: np.ndarray, order: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Estimates the autoregressive parameters of many signals at once using Burg's method.
+
+    This is the Burg kernel of the package, arburg() and arburg2() are wrappers around it. The order recursion runs on
+    all signals simultaneously using float64 (complex128 for complex signals) arithmetic and preallocated work buffers.
+    The driving noise variance rho is scaled like in [Marple]: the mean square of the signal times the product of
+    (1 - |k|^2) over all reflection coefficients k.
+
+        Parameters:
+            X:      real- or complex-valued signals, shape (n_signals, n_times)
+            order:  order of the AR model (0 < order < n_times)
+
+        Returns:
+            (a, rho, ref):  AR coefficients including the leading 1, shape (n_signals, order+1),
+                            driving noise variance, shape (n_signals,),
+                            reflection coefficients, shape (n_signals, order)
+    """
+    is_complex = np.iscomplexobj(X)
+    dtype = np.complex128 if is_complex else np.float64
+
+    x = np.asarray(X, dtype=dtype)
+    if x.ndim == 1:
+        x = x[np.newaxis, :]
+    if x.ndim != 2:
+        raise ValueError("arburg_batch expects data of shape (n_signals, n_times), got {}.".format(x.shape))
+
+    n_signals, n_times = x.shape
+
+    if order <= 0:
+        raise ValueError("order must be > 0")
+    if order >= n_times:
+        raise ValueError("order must be less than the number of samples")
+
+    # forward and backward prediction errors, both time-aligned with x. At recursion step m only the samples
+    # m+1 ... n_times-1 are valid. Two scratch buffers receive the updated errors and are swapped afterwards.
+    ef = x.copy()
+    eb = x.copy()
+    ef_next = np.empty_like(ef)
+    eb_next = np.empty_like(eb)
+
+    a = np.zeros((n_signals, order + 1), dtype=dtype)
+    a[:, 0] = 1.0
+    a_flipped = np.empty((n_signals, order + 1), dtype=dtype)
+    ref = np.zeros((n_signals, order), dtype=dtype)
+
+    rho = (_energy(x) if is_complex else np.einsum('ij,ij->i', x, x)) / n_times
+
+    for m in range(order):
+        efp = ef[:, m + 1:]
+        ebp = eb[:, m:-1]
+
+        # reflection coefficient, eq. 8.14 [Marple]
+        if is_complex:
+            num = -2.0 * np.einsum('ij,ij->i', ebp.conj(), efp)
+            den = _energy(efp) + _energy(ebp)
+        else:
+            num = -2.0 * np.einsum('ij,ij->i', ebp, efp)
+            den = np.einsum('ij,ij->i', efp, efp) + np.einsum('ij,ij->i', ebp, ebp)
+        k = num / den
+        ref[:, m] = k
+        k_col = k[:, np.newaxis]
+
+        # update forward and backward prediction errors, eq. 8.7 [Marple]
+        ef_new = ef_next[:, m + 1:]
+        np.multiply(k_col, ebp, out=ef_new)
+        ef_new += efp
+
+        eb_new = eb_next[:, m + 1:]
+        np.multiply(k_col.conj() if is_complex else k_col, efp, out=eb_new)
+        eb_new += ebp
+
+        ef, ef_next = ef_next, ef
+        eb, eb_next = eb_next, eb
+
+        # Levinson update of the AR coefficients, eq. 8.2 [Marple]
+        np.multiply(k_col, a[:, m::-1].conj() if is_complex else a[:, m::-1], out=a_flipped[:, :m + 1])
+        a[:, 1:m + 2] += a_flipped[:, :m + 1]
+
+        rho = rho * (1.0 - (k.real * k.real + k.imag * k.imag if is_complex else k * k))
+
+    return a, rho, ref
+
+
+def _energy(x: np.ndarray) -> np.ndarray:
+    """Sum of the squared magnitudes of every row of the complex array x"""
+    return np.einsum('ij,ij->i', x.real, x.real) + np.einsum('ij,ij->i', x.imag, x.imag)
+
+
+if __name__ == '__main__':
+    from misc.burg.burg_from_spectrum import arburg2
+    import timeit
+
+    np.random.seed(1)
+    signals = np.random.normal(size=(3, 205))
+    model_order = 51
+
+    # the complex code path is computed independently of the real recursion
+    a, rho, ref = arburg_batch(signals, model_order)
+    a3, rho3, ref3 = arburg_batch(signals + 0j, model_order)
+    print(np.abs(a - a3).max(), np.abs(rho - rho3).max(), np.abs(ref - ref3).max())
+
+    print(
+        round(timeit.timeit(lambda: [arburg2(s, model_order) for s in signals], number=100) / 100 * 1000, 5), "ms (arburg2)"
+    )
+    print(
+        round(timeit.timeit(lambda: arburg_batch(signals, model_order), number=100) / 100 * 1000, 5), "ms (arburg_batch)"
+    )
@@ -40,6 +40,8 @@ from numpy.fft import fft
 
 from collections import deque
 
+from misc.burg.burg_batch import arburg_batch
+
 
 def arburg(X, order):
     r"""Estimate the complex autoregressive parameters by the Burg algorithm.
@@ -87,125 +89,31 @@ def arburg(X, order):
     if order <= 0.:
         raise ValueError("order must be > 0")
 
-    if order > len(X):
-        raise ValueError("order must be less than length input - 2")
-
-    x = np.array(X)
-    N = len(x)
-
-    # Initialisation
-    # ------ rho, den
-    rho = sum(abs(x)**2.) / float(N)  # Eq 8.21 [Marple]_
-    den = rho * 2. * N
-
-    #p =0
-    a = np.zeros(0, dtype=complex)
-    ref = np.zeros(0, dtype=complex)
-    ef = x.astype(complex)
-    eb = x.astype(complex)
-    temp = 1.
-    #   Main recursion
-
-    for k in range(0, order):
-
-        # calculate the next order reflection coefficient Eq 8.14 Marple
-        num = sum([ef[j]*eb[j-1].conjugate() for j in range(k+1, N)])
-        den = temp * den - abs(ef[k])**2 - abs(eb[N-1])**2
-        kp = -2. * num / den #eq 8.14
-
-        temp = 1. - abs(kp)**2.
-        new_rho = temp * rho
-
-        # this should be after the criteria
-        rho = new_rho
-        if rho <= 0:
-            raise ValueError("Found a negative value (expected positive strictly) %s. Decrease the order" % rho)
-
-        a.resize(a.size+1,refcheck=False)
-        a[k] = kp
-        if k == 0:
-            for j in range(N-1, k, -1):
-                save2 = ef[j]
-                ef[j] = save2 + kp * eb[j-1]          # Eq. (8.7)
-                eb[j] = eb[j-1] + kp.conjugate() *  save2
-
-        else:
-            # update the AR coeff
-            khalf = (k+1)//2  # FIXME here khalf must be an integer
-            for j in range(0, khalf):
-                ap = a[j] # previous value
-                a[j] = ap + kp * a[k-j-1].conjugate()      # Eq. (8.2)
-                if j != k-j-1:
-                    a[k-j-1] = a[k-j-1] + kp * ap.conjugate()    # Eq. (8.2)
-
-            # update the prediction error
-            for j in range(N-1, k, -1):
-                save2 = ef[j]
-                ef[j] = save2 + kp * eb[j-1]          # Eq. (8.7)
-                eb[j] = eb[j-1] + kp.conjugate() *  save2
-
-        # save the reflection coefficient
-        ref.resize(ref.size+1, refcheck=False)
-        ref[k] = kp
-
-    return a, rho, ref
+    if order >= len(X):
+        raise ValueError("order must be less than the number of samples")
+
+    # the order recursion of [Marple] runs vectorized over the samples in arburg_batch()
+    a, rho, ref = arburg_batch(np.asarray(X)[np.newaxis], order)
+    rho = float(rho[0])
+    if rho <= 0:
+        raise ValueError("Found a negative value (expected positive strictly) %s. Decrease the order" % rho)
+
+    return a[0, 1:].astype(complex), rho, ref[0].astype(complex)
 
 def arburg2(X, order):
-    """This version is 10 times faster than arburg, but the output rho is not correct.
+    """Same as arburg(), but the returned AR parameters include the leading 1.
+
+    Both return the driving noise variance rho scaled like [Marple]_. Earlier
+    versions documented the rho of this function as incorrect, it always
+    equalled the one of arburg().
 
     returns [1 a0,a1, an-1]
     """
-    x = np.array(X)
-    N = len(x)
-
     if order <= 0.:
         raise ValueError("order must be > 0")
 
-    # Initialisation
-    # ------ rho, den
-    rho = sum(abs(x)**2.) / N  # Eq 8.21 [Marple]_
-    den = rho * 2. * N
-
-    # ------ backward and forward errors
-    ef = np.zeros(N, dtype=complex)
-    eb = np.zeros(N, dtype=complex)
-    for j in range(0, N):  #eq 8.11
-        ef[j] = x[j]
-        eb[j] = x[j]
-
-    # AR order to be stored
-    a = np.zeros(1, dtype=complex)
-    a[0] = 1
-    # ---- rflection coeff to be stored
-    ref = np.zeros(order, dtype=complex)
-
-    temp = 1.
-    E = np.zeros(order+1)
-    E[0] = rho
-
-    for m in range(0, order):
-        #print m
-        # Calculate the next order reflection (parcor) coefficient
-        efp = ef[1:]
-        ebp = eb[0:-1]
-        #print efp, ebp
-        num = -2.* np.dot(ebp.conj().transpose(),  efp)
-        den = np.dot(efp.conj().transpose(),  efp)
-        den += np.dot(ebp,  ebp.conj().transpose())
-        ref[m] = num / den
-
-        # Update the forward and backward prediction errors
-        ef = efp + ref[m] * ebp
-        eb = ebp + ref[m].conj().transpose() * efp
-
-        # Update the AR coeff.
-        a.resize(len(a)+1, refcheck=False)
-        a = a + ref[m] * np.flipud(a).conjugate()
-
-        # Update the prediction error
-        E[m+1] = np.real((1 - ref[m].conj().transpose()*ref[m]) * E[m])
-        #print 'REF', ref, num, den
-    return a, E[-1], ref
+    a, rho, ref = arburg_batch(np.asarray(X)[np.newaxis], order)
+    return a[0].astype(complex), float(rho[0]), ref[0].astype(complex)
 
 
 def arma2psd(A=None, B=None, rho=1., T=1., NFFT=4096, sides='default',
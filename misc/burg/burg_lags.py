@@ -0,0 +1,174 @@
+"""
+Burg's method computed from the lag products of the signals, used by IncrementalBurgSpectrumNode
+
+The lag products of a sliding window can be updated with the samples entering and leaving the window, and the AR model
+is derived from them in O(order^2) per window (K. Vos, "A Fast Implementation of Burg's Method", 2013).
+"""
+
+import numpy as np
+
+from typing import Tuple
+
+
+def lag_products(X: np.ndarray, max_lag: int) -> np.ndarray:
+    """
+    Computes the lag products c_j = sum_n x[n] * x[n+j] for j = 0 ... max_lag of every row of X
+
+        Parameters:
+            X:          real-valued signals, shape (n_signals, n_times)
+            max_lag:    largest lag to compute
+
+        Returns:
+            lags:       shape (n_signals, max_lag+1)
+    """
+    n_signals, n_times = X.shape
+    lags = np.empty((n_signals, max_lag + 1), dtype=np.float64)
+    for j in range(max_lag + 1):
+        lags[:, j] = np.einsum('ij,ij->i', X[:, :n_times - j], X[:, j:])
+    return lags
+
+
+def update_lag_products(lags: np.ndarray, history: np.ndarray, shift: int) -> np.ndarray:
+    """
+    Updates lag products in place when a window of n_times samples slides forward by shift samples
+
+        Parameters:
+            lags:       lag products of the old window, shape (n_signals, max_lag+1), modified in place
+            history:    old window followed by the shift new samples, shape (n_signals, n_times+shift)
+            shift:      number of samples entering and leaving the window
+
+        Returns:
+            lags:       lag products of the new window history[:, shift:]
+    """
+    n_signals, n_history = history.shape
+    n_times = n_history - shift
+    max_lag = lags.shape[1] - 1
+
+    if n_times >= shift + max_lag:
+        # no sample pair spans both the leaving and the entering samples: use strided views for all lags at once
+        leaving = np.lib.stride_tricks.sliding_window_view(history[:, :shift + max_lag], max_lag + 1, axis=-1)
+        entering = np.lib.stride_tricks.sliding_window_view(history[:, n_times - max_lag:], max_lag + 1, axis=-1)
+        lags -= np.einsum('in,inj->ij', history[:, :shift], leaving)
+        lags += np.einsum('in,inj->ij', history[:, n_times:], entering)[:, ::-1]
+    else:
+        for j in range(max_lag + 1):
+            m = min(shift, n_times - j)
+            if m > 0:
+                lags[:, j] -= np.einsum('ij,ij->i', history[:, :m], history[:, j:j + m])
+            low = max(n_times, shift + j)
+            if low < n_history:
+                lags[:, j] += np.einsum('ij,ij->i', history[:, low:], history[:, low - j:n_history - j])
+
+    return lags
+
+
+def arburg_from_lags(lags: np.ndarray, head: np.ndarray, tail: np.ndarray, n_times: int, order: int) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Burg's method computed from the lag products of the signals instead of the signals themselves.
+
+    Burg's forward and backward error energies are expressed as quadratic forms of the (Toeplitz) lag product matrix
+    minus the contributions of the first and last order+1 samples, which are tracked with a short lattice filter on
+    both ends of the window (K. Vos, "A Fast Implementation of Burg's Method", 2013). The cost per window is
+    O(order^2) instead of O(n_times * order), and the lag products can be updated incrementally for sliding windows.
+
+    The result equals arburg_batch() of the underlying signals up to rounding errors.
+
+        Parameters:
+            lags:       lag products c_0 ... c_order of the signals, shape (n_signals, order+1), see lag_products()
+            head:       first order+1 samples of the signals, shape (n_signals, order+1)
+            tail:       last order+1 samples of the signals, shape (n_signals, order+1)
+            n_times:    number of samples the lag products were computed from
+            order:      order of the AR model (0 < order < n_times)
+
+        Returns:
+            (a, rho, ref):  see arburg_batch()
+    """
+    if order <= 0:
+        raise ValueError("order must be > 0")
+    if order >= n_times:
+        raise ValueError("order must be less than the number of samples")
+
+    c = np.asarray(lags, dtype=np.float64)
+    n_signals = c.shape[0]
+
+    # av[0] holds the AR coefficients a (padded with a zero) and av[1] holds v = T [a, 0] with the symmetric Toeplitz
+    # matrix T of the lag products. Both are updated with the same Levinson step x[:k+2] += kappa * x[k+1::-1].
+    av = np.zeros((2, n_signals, order + 2), dtype=np.float64)
+    av[0, :, 0] = 1.0
+    av[1, :, 0] = c[:, 0]
+    av[1, :, 1] = c[:, 1]
+    a, v = av[0], av[1]
+    av_flipped = np.empty_like(av)
+    ref = np.zeros((n_signals, order), dtype=np.float64)
+
+    # forward/backward errors of the zero-padded signal at its start (samples 0 ... order, stored at 0 ... order) and
+    # at its end (samples n_times-1-order ... n_times-1+order, stored at order+1 ... 3*order+1). Two scratch buffers
+    # receive the lattice updates and are swapped afterwards.
+    tail_offset = 2 * order + 1
+    f = np.zeros((n_signals, 3 * order + 2), dtype=np.float64)
+    f[:, :order + 1] = head
+    f[:, order + 1:tail_offset + 1] = tail
+    b = f.copy()
+    f_next = f.copy()
+    b_next = np.empty_like(b)
+
+    rho = c[:, 0] / n_times
+
+    # Burg's error energy, updated recursively (eq. 8.14 [Marple])
+    den = 2.0 * c[:, 0] - f[:, 0] ** 2 - f[:, tail_offset] ** 2
+
+    for k in range(order):
+        # cross-correlation of forward and backward errors of the complete zero-padded signal minus the samples at both
+        # ends which are not part of Burg's sums
+        num = np.einsum('ij,ij->i', a[:, k::-1], v[:, 1:k + 2]) \
+            - np.einsum('ij,ij->i', f[:, 1:k + 1], b[:, :k]) \
+            - np.einsum('ij,ij->i', f[:, tail_offset + 1:tail_offset + 2 + k], b[:, tail_offset:tail_offset + 1 + k])
+
+        kappa = -2.0 * num / den
+        ref[:, k] = kappa
+        k_col = kappa[:, np.newaxis]
+
+        # Levinson update of the AR coefficients and of v
+        np.multiply(k_col, av[..., k + 1::-1], out=av_flipped[..., :k + 2])
+        av[..., :k + 2] += av_flipped[..., :k + 2]
+
+        damping = 1.0 - kappa * kappa
+        rho = rho * damping
+
+        if k == order - 1:
+            break
+
+        # v grows by one entry
+        v[:, k + 2] = np.einsum('ij,ij->i', a[:, :k + 2], c[:, k + 2:0:-1])
+
+        # lattice update of the errors at both ends
+        np.multiply(k_col, b[:, :-1], out=f_next[:, 1:])
+        f_next[:, 1:] += f[:, 1:]
+        np.multiply(k_col, f[:, 1:], out=b_next[:, 1:])
+        b_next[:, 1:] += b[:, :-1]
+        b_next[:, 0] = kappa * f[:, 0]
+        f, f_next = f_next, f
+        b, b_next = b_next, b
+
+        den = den * damping - f[:, k + 1] ** 2 - b[:, tail_offset] ** 2
+
+    return a[:, :order + 1], rho, ref
+
+
+if __name__ == '__main__':
+    from misc.burg.burg_batch import arburg_batch
+
+    np.random.seed(1)
+    signals = np.random.normal(size=(3, 225))
+    model_order, n_times, shift = 51, 205, 20
+
+    # the lag product formulation is computed independently of the recursion on the signals
+    lags = lag_products(signals[:, :n_times], model_order)
+    update_lag_products(lags, signals, shift)
+    window = signals[:, shift:]
+    a, rho, ref = arburg_batch(window, model_order)
+    a2, rho2, ref2 = arburg_from_lags(lags, window[:, :model_order + 1], window[:, -(model_order + 1):], n_times,
+                                      model_order)
+    print(np.abs(lags - lag_products(window, model_order)).max())
+    print(np.abs(a - a2).max(), np.abs(rho - rho2).max(), np.abs(ref - ref2).max())
@@ -1,4 +1,6 @@
-from misc.burg.burg_from_spectrum import arburg2, arma2psd, arburg
+from misc.burg.burg_from_spectrum import arma2psd
+from misc.burg.burg_batch import arburg_batch
+from misc.burg.burg_plan import get_burg_spectrum_plan
 
 import numpy as np
 from scipy.integrate import simps
@@ -9,12 +11,10 @@ from typing import Tuple
 @typechecked()
 def _get_psd(data: np.ndarray, fs: float, nfft: int, fres: float, psd_len: int, model_order: int, fast_version: bool):
     """Estimate power spectrum using Burg's maximum entropy method.
-       Scale to get results close to those of BCI2000."""
-    if fast_version:
-        ar, rho, ref = arburg2(data, model_order)
-    else:
-        ar, rho, ref = arburg(data, model_order)
-    psd = arma2psd(A=ar[1:], rho=rho, T=fs, NFFT=nfft)
+       Scale to get results close to those of BCI2000.
+       fast_version is ignored, both versions use the same exactly scaled kernel"""
+    ar, rho, ref = arburg_batch(data[np.newaxis], model_order)
+    psd = arma2psd(A=ar[0, 1:], rho=rho[0], T=fs, NFFT=nfft)
     psd = psd[0:psd_len] * 2
 
     # no mathematical explanation, not quite the same,
@@ -37,7 +37,8 @@ def calc_burg_spectrum(
             output_type: 'power' or 'amplitude'
             fs:     sampling frequency of the signal
             model_order: order of the AR model
-            fast_version: whether to use a ~10x faster but wrongly scaled version of the algorithm
+            fast_version: deprecated and ignored. Selected the slow arburg() kernel when False, which dropped the
+                          first AR coefficient, now both use arburg_batch()
 
         Returns:
             (output, frequencies):  Arrays containing the spectrum and the center frequencies of the bins
@@ -82,6 +83,28 @@ def calc_burg_spectrum(
 
     return (output, freqs)
 
+@typechecked()
+def calc_burg_spectra(
+        signals: np.ndarray, foi: float = 11, nbins: int = 1, bin_width: float = 3.0, evals_per_bin: int = 15,
+        output_type: str = 'amplitude', fs: float = 500, model_order: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched version of calc_burg_spectrum() for many real-valued signals at once
+
+        Parameters:
+            signals: the signals to generate the spectra of, shape (n_signals, n_times)
+            see calc_burg_spectrum() for all other parameters
+
+        Returns:
+            (output, frequencies):  Array of shape (n_signals, nbins) containing the spectra and array containing the
+                                    center frequencies of the bins
+    """
+
+    plan = get_burg_spectrum_plan(fs=fs, foi=foi, nbins=nbins, bin_width=bin_width, evals_per_bin=evals_per_bin,
+                                  model_order=model_order)
+    output = plan.compute(signals, output_type=output_type)
+
+    return (output, plan.frequencies.copy())
+
 
 # example using burg spectrum
 if __name__ == '__main__':
@@ -0,0 +1,418 @@
+"""
+Registry of the DSP kernels with sequential loops which NumPy can only vectorize partially
+
+Every kernel has a NumPy reference implementation and optionally a loop implementation which is compiled with Numba.
+The backend is selected at import time: 'numba' if Numba is installed, 'numpy' otherwise. globals.KERNEL_BACKEND
+overrides the selection. Numba itself is only imported and the kernels are only compiled on first use, modules call
+warm_up() when they start so that the compilation does not delay the first samples. The compiled kernels are cached
+on disk by Numba, later processes only load them.
+
+Numba compiles one specialization per combination of argument types, including the dtype, the memory layout and
+whether an array is read-only. The arguments of the compiled kernels are therefore converted to one canonical form
+(prepare) before the call, e.g. the read-only windows of BufferNode to writable C-contiguous arrays, so that warm_up()
+compiles exactly the specializations the pipeline uses.
+
+Usage:
+    from misc import kernels
+    ar, rho, ref = kernels.get_kernel('burg')(signals, model_order)
+
+Self test of the backends (agreement and timing), run from the root directory of the repository:
+    python -m misc.kernels
+"""
+
+import importlib.util
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+import globals
+
+logger = logging.getLogger(__name__)
+
+
+NUMBA_AVAILABLE: bool = importlib.util.find_spec('numba') is not None
+
+BACKENDS = ('numpy', 'numba')
+
+BACKEND: str = globals.KERNEL_BACKEND or ('numba' if NUMBA_AVAILABLE else 'numpy')
+if BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown kernel backend '{BACKEND}', available are {BACKENDS}")
+if BACKEND == 'numba' and not NUMBA_AVAILABLE:
+    logger.warning("Numba is not installed, using the numpy kernels")
+    BACKEND = 'numpy'
+
+
+class Kernel(object):
+    """
+    A kernel with a NumPy reference implementation and an optional loop implementation which is compiled with Numba
+
+    :param example: function of a dtype returning example arguments, used by self_test() and warm_up()
+    :param prepare: converts the arguments to the canonical types of the compiled implementation, so that it is only
+                    compiled once per dtype
+    :param rtol: relative tolerance of the agreement of the backends in self_test()
+    """
+
+    def __init__(self, name: str, numpy_impl: Callable, numba_source: Optional[Callable] = None,
+                 example: Optional[Callable[[np.dtype], tuple]] = None, prepare: Optional[Callable] = None,
+                 rtol: float = 1e-9):
+        self.name: str = name
+        self.numpy_impl: Callable = numpy_impl
+        self.numba_source: Optional[Callable] = numba_source
+        self.example: Optional[Callable[[np.dtype], tuple]] = example
+        self.prepare: Optional[Callable] = prepare
+        self.rtol: float = rtol
+
+        self._numba_impl: Optional[Callable] = None
+        self._compiled_call: Optional[Callable] = None
+
+    @property
+    def numba_impl(self) -> Optional[Callable]:
+        """The compiled loop implementation, None if the kernel has none or Numba is not installed"""
+        if self._numba_impl is None and self.numba_source is not None and NUMBA_AVAILABLE:
+            import numba
+            self._numba_impl = numba.njit(cache=True)(self.numba_source)
+        return self._numba_impl
+
+    @property
+    def compiled_call(self) -> Optional[Callable]:
+        """The compiled implementation called with prepared arguments"""
+        if self._compiled_call is None and self.numba_impl is not None:
+            numba_impl, prepare = self.numba_impl, self.prepare
+            self._compiled_call = numba_impl if prepare is None else lambda *args: numba_impl(*prepare(*args))
+        return self._compiled_call
+
+    def implementation(self, backend: Optional[str] = None) -> Callable:
+        """Implementation of the backend (default BACKEND), the NumPy implementation if there is no compiled one"""
+        if (backend or BACKEND) == 'numba' and self.compiled_call is not None:
+            return self.compiled_call
+        return self.numpy_impl
+
+    def __call__(self, *args, **kwargs):
+        return self.implementation()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"Kernel({self.name})"
+
+
+KERNELS: Dict[str, Kernel] = dict()
+
+
+def register_kernel(name: str, numpy_impl: Callable, numba_source: Optional[Callable] = None,
+                    example: Optional[Callable[[np.dtype], tuple]] = None, prepare: Optional[Callable] = None,
+                    rtol: float = 1e-9) -> Kernel:
+    kernel = Kernel(name, numpy_impl, numba_source=numba_source, example=example, prepare=prepare, rtol=rtol)
+    KERNELS[name] = kernel
+    return kernel
+
+
+def get_kernel(name: str, backend: Optional[str] = None) -> Callable:
+    """
+    :param backend: 'numpy' or 'numba', default BACKEND
+    :return: the implementation of the kernel
+    """
+    return KERNELS[name].implementation(backend)
+
+
+def _max_relative_deviation(expected, actual) -> float:
+    if isinstance(expected, tuple):
+        return max(_max_relative_deviation(e, a) for e, a in zip(expected, actual))
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if expected.shape != actual.shape:
+        return np.inf
+    scale = max(np.max(np.abs(expected), initial=0.0), np.finfo(np.float64).tiny)
+    return float(np.max(np.abs(actual - expected), initial=0.0) / scale)
+
+
+def self_test(dtypes=(np.float64, np.float32)) -> Dict[str, float]:
+    """
+    Runs every kernel with a compiled implementation on its example arguments with both backends
+    :return: dict of kernel -> largest deviation of the compiled from the NumPy implementation relative to the
+             magnitude of the output. Kernels whose deviation exceeds their tolerance are logged as errors.
+    """
+    deviations = dict()
+    for name, kernel in KERNELS.items():
+        if kernel.numba_impl is None or kernel.example is None:
+            continue
+        for dtype in dtypes:
+            args = kernel.example(np.dtype(dtype))
+            deviation = _max_relative_deviation(kernel.numpy_impl(*args), kernel.compiled_call(*args))
+            # float32 kernels are compared with the tolerance of float32
+            tolerance = max(kernel.rtol, 10 * np.finfo(dtype).eps)
+            if not deviation <= tolerance:
+                logger.error(f"The backends of kernel {name} ({np.dtype(dtype)}) disagree: relative deviation "
+                             f"{deviation:.3g} > {tolerance:.3g}")
+            deviations[f"{name} {np.dtype(dtype)}"] = deviation
+    return deviations
+
+
+def warm_up(dtypes=(np.float64,)) -> float:
+    """
+    Compiles (or loads from Numba's cache) the kernels of the selected backend for the given dtypes, ahead of the
+    first samples. The example arguments are prepared like the arguments of the pipeline, so these are the
+    specializations it calls. Does nothing for the numpy backend.
+    :return: duration in seconds
+    """
+    t_start = time.perf_counter()
+    if BACKEND == 'numba':
+        for kernel in KERNELS.values():
+            if kernel.numba_impl is None or kernel.example is None:
+                continue
+            for dtype in dtypes:
+                kernel.compiled_call(*kernel.example(np.dtype(dtype)))
+    return time.perf_counter() - t_start
+
+
+# =========================================================================== #
+# Burg's method                                                               #
+# =========================================================================== #
+
+def _burg_loops(x: np.ndarray, order: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Loop implementation of arburg_batch() for real-valued signals, compiled with Numba"""
+    n_signals, n_times = x.shape
+
+    a = np.zeros((n_signals, order + 1))
+    ref = np.zeros((n_signals, order))
+    rho = np.zeros(n_signals)
+    ef = np.empty(n_times)
+    eb = np.empty(n_times)
+    a_old = np.empty(order + 1)
+
+    for i in range(n_signals):
+        energy = 0.0
+        for j in range(n_times):
+            ef[j] = x[i, j]
+            eb[j] = x[i, j]
+            energy += x[i, j] * x[i, j]
+        rho_i = energy / n_times
+        a[i, 0] = 1.0
+
+        for m in range(order):
+            # reflection coefficient of the errors at samples m+1 ... n_times-1, eq. 8.14 [Marple]
+            num = 0.0
+            den = 0.0
+            for j in range(m + 1, n_times):
+                num += eb[j - 1] * ef[j]
+                den += ef[j] * ef[j] + eb[j - 1] * eb[j - 1]
+            k = -2.0 * num / den
+            ref[i, m] = k
+
+            # update the errors in place from the end, eb[j - 1] is still the old value, eq. 8.7 [Marple]
+            for j in range(n_times - 1, m, -1):
+                f = ef[j]
+                ef[j] = f + k * eb[j - 1]
+                eb[j] = eb[j - 1] + k * f
+
+            # Levinson update of the AR coefficients, eq. 8.2 [Marple]
+            for j in range(m + 1):
+                a_old[j] = a[i, j]
+            for j in range(1, m + 2):
+                a[i, j] += k * a_old[m + 1 - j]
+
+            rho_i *= 1.0 - k * k
+
+        rho[i] = rho_i
+
+    return a, rho, ref
+
+
+def _burg_numpy(x: np.ndarray, order: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    from misc.burg.burg_batch import arburg_batch
+    return arburg_batch(x, order)
+
+
+def _burg_prepare(x: np.ndarray, order: int) -> tuple:
+    # the AR models are always estimated in float64, the windows of BufferNode are read-only views
+    return np.require(x, dtype=np.float64, requirements=['C', 'W']), int(order)
+
+
+def _burg_example(dtype: np.dtype) -> tuple:
+    # a read-only window of the pipeline dtype, like BufferNode outputs
+    x = np.random.default_rng(0).normal(size=(3, 200)).astype(dtype)
+    x.flags.writeable = False
+    return x, 40
+
+
+burg = register_kernel('burg', _burg_numpy, numba_source=_burg_loops, example=_burg_example, prepare=_burg_prepare,
+                       rtol=1e-8)
+
+
+# =========================================================================== #
+# Single pole (exponential smoothing) filter                                  #
+# =========================================================================== #
+
+def _single_pole_loops(x: np.ndarray, decay: float, y0: np.ndarray) -> np.ndarray:
+    """
+    Loop implementation of _single_pole_numpy(), compiled with Numba. Evaluates y[n-1] + (1 - decay) * (x[n] - y[n-1])
+    in the order of the original SinglePoleFilterNode loop, so its output is bit-identical to it
+    """
+    n_signals, n_times = x.shape
+    y = np.empty_like(x)
+    gain = 1.0 - decay
+    for i in range(n_signals):
+        previous = y0[i]
+        for j in range(n_times):
+            previous = previous + gain * (x[i, j] - previous)
+            y[i, j] = previous
+    return y
+
+
+def _single_pole_numpy(x: np.ndarray, decay: float, y0: np.ndarray) -> np.ndarray:
+    """
+    y[n] = decay * y[n-1] + (1 - decay) * x[n] along the last axis. lfilter evaluates this form, which equals the
+    y[n-1] + (1 - decay) * (x[n] - y[n-1]) of the Numba loop to rounding, not bit by bit
+    :param x: shape (n_signals, n_times)
+    :param y0: output before the first sample, shape (n_signals,)
+    :return: y, shape (n_signals, n_times)
+    """
+    from scipy import signal
+
+    b = np.array([1 - decay], dtype=x.dtype)
+    a = np.array([1, -decay], dtype=x.dtype)
+    # the initial condition of lfilter is decay * y[-1]
+    y, _ = signal.lfilter(b, a, x, axis=-1, zi=(decay * y0)[:, np.newaxis].astype(x.dtype, copy=False))
+    return y
+
+
+def _single_pole_prepare(x: np.ndarray, decay: float, y0: np.ndarray) -> tuple:
+    # y0 is a read-only broadcast of the filter state, decay a Python or NumPy float of any precision
+    return (np.require(x, requirements=['C', 'W']), float(decay),
+            np.require(y0, dtype=x.dtype, requirements=['C', 'W']))
+
+
+def _single_pole_example(dtype: np.dtype) -> tuple:
+    # arguments like SinglePoleFilterNode passes them: float64 decay and a read-only y0
+    rng = np.random.default_rng(0)
+    return (rng.normal(size=(3, 50)).astype(dtype), np.exp(-1 / 12.5),
+            np.broadcast_to(rng.normal(size=(3, 1)).astype(dtype), (3, 1)).reshape(-1))
+
+
+single_pole = register_kernel('single_pole', _single_pole_numpy, numba_source=_single_pole_loops,
+                              example=_single_pole_example, prepare=_single_pole_prepare, rtol=1e-12)
+
+
+# =========================================================================== #
+# Sliding Goertzel                                                            #
+# =========================================================================== #
+
+def _sliding_goertzel_loops(x: np.ndarray, n: int, omega: np.ndarray, weights: np.ndarray, state: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Loop implementation of _sliding_goertzel_numpy(), compiled with Numba"""
+    n_signals = x.shape[0]
+    n_times = x.shape[1] - n
+    n_frequencies, n_terms = omega.shape
+    power = np.empty((n_signals, n_frequencies, n_times), dtype=x.dtype)
+    state_out = np.empty_like(state)
+    windowed = np.empty(n_times, dtype=np.complex128)
+
+    for f in range(n_frequencies):
+        for i in range(n_signals):
+            windowed[:] = 0.0
+            for k in range(n_terms):
+                w = omega[f, k]
+                c = 2.0 * np.cos(w)
+                comb = np.exp(1j * w * n)
+                feedforward = np.exp(-1j * w)
+                term = weights[k] * np.exp(-1j * w * (n - 1))
+                re1, re2, im1, im2 = state[i, f, k, 0], state[i, f, k, 1], state[i, f, k, 2], state[i, f, k, 3]
+                for j in range(n_times):
+                    re0 = x[i, n + j] - comb.real * x[i, j] + c * re1 - re2
+                    im0 = -comb.imag * x[i, j] + c * im1 - im2
+                    windowed[j] += term * (complex(re0, im0) - feedforward * complex(re1, im1))
+                    re2, re1 = re1, re0
+                    im2, im1 = im1, im0
+                state_out[i, f, k, 0], state_out[i, f, k, 1] = re1, re2
+                state_out[i, f, k, 2], state_out[i, f, k, 3] = im1, im2
+            for j in range(n_times):
+                power[i, f, j] = windowed[j].real ** 2 + windowed[j].imag ** 2
+
+    return power, state_out
+
+
+def _sliding_goertzel_numpy(x: np.ndarray, n: int, omega: np.ndarray, weights: np.ndarray, state: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Power of the windowed DFT of the last n samples after every sample, as weighted sum of the DFTs at several
+    frequencies (e.g. [-0.25, 0.5, -0.25] at omega - 2pi/n, omega, omega + 2pi/n for a Hann window).
+
+    The comb filter x[t] - exp(j*omega*n) * x[t-n] feeds a Goertzel resonator s[t] = u[t] + 2cos(omega) s[t-1] - s[t-2],
+    whose output s[t] - exp(-j*omega) * s[t-1] is the DFT of the last n samples (up to the phase of the first
+    sample). The real and the imaginary part of the comb output run through one resonator each.
+    :param x: the last n samples before the chunk followed by the chunk, shape (n_signals, n + n_times)
+    :param n: window length
+    :param omega: frequencies in rad/sample, shape (n_frequencies, n_terms)
+    :param weights: weight of every term, shape (n_terms,)
+    :param state: (s[t-1], s[t-2]) of the real and the imaginary resonator before the chunk,
+                  shape (n_signals, n_frequencies, n_terms, 4)
+    :return: (power, shape (n_signals, n_frequencies, n_times), state after the chunk)
+    """
+    from scipy import signal
+
+    n_times = x.shape[1] - n
+    # shape (n_signals, n_frequencies, n_terms, n_times)
+    current, delayed = x[:, np.newaxis, np.newaxis, n:], x[:, np.newaxis, np.newaxis, :n_times]
+    comb = np.exp(1j * omega * n)[..., np.newaxis]
+    inputs = (current - comb.real * delayed, -comb.imag * delayed)
+
+    resonators = []
+    state_out = np.empty_like(state)
+    coefficients = 2 * np.cos(omega)
+    for i_part, u in enumerate(inputs):
+        s = np.empty(u.shape)
+        for index in np.ndindex(omega.shape):
+            c = coefficients[index]
+            s1, s2 = state[:, index[0], index[1], 2 * i_part], state[:, index[0], index[1], 2 * i_part + 1]
+            # lfilter keeps the state in direct form II transposed: (c * s[t-1] - s[t-2], -s[t-1])
+            zi = np.stack([c * s1 - s2, -s1], axis=-1)
+            s[:, index[0], index[1]], zf = signal.lfilter([1.0], [1.0, -c, 1.0], u[:, index[0], index[1]], zi=zi)
+            state_out[:, index[0], index[1], 2 * i_part] = -zf[:, 1]
+            state_out[:, index[0], index[1], 2 * i_part + 1] = c * -zf[:, 1] - zf[:, 0]
+        resonators.append(s)
+
+    s = resonators[0] + 1j * resonators[1]
+    s_previous = np.concatenate([(state[..., 0] + 1j * state[..., 2])[..., np.newaxis], s[..., :-1]], axis=-1)
+    dft = (s - np.exp(-1j * omega)[..., np.newaxis] * s_previous) * np.exp(-1j * omega * (n - 1))[..., np.newaxis]
+    windowed = np.einsum('sfkt,k->sft', dft, weights)
+
+    return (windowed.real ** 2 + windowed.imag ** 2).astype(x.dtype, copy=False), state_out
+
+
+def _sliding_goertzel_prepare(x: np.ndarray, n: int, omega: np.ndarray, weights: np.ndarray, state: np.ndarray) \
+        -> tuple:
+    # the resonators always run in float64, their poles are on the unit circle
+    return (np.require(x, dtype=np.float64, requirements=['C', 'W']), int(n),
+            *(np.require(a, dtype=np.float64, requirements=['C', 'W']) for a in (omega, weights, state)))
+
+
+def _sliding_goertzel_example(dtype: np.dtype) -> tuple:
+    # arguments like GoertzelBandPowerEngine passes them: float64 for every dtype of the pipeline, Hann weights
+    rng = np.random.default_rng(0)
+    n = 51
+    omega = rng.uniform(0.2, 1.0, size=(5, 1)) + np.array([-1, 0, 1]) * 2 * np.pi / n
+    return (rng.normal(size=(3, n + 40)), n, omega, np.array([-0.25, 0.5, -0.25]),
+            rng.normal(size=(3, 5, 3, 4)))
+
+
+sliding_goertzel = register_kernel('sliding_goertzel', _sliding_goertzel_numpy, numba_source=_sliding_goertzel_loops,
+                                   example=_sliding_goertzel_example, prepare=_sliding_goertzel_prepare)
+
+
+if __name__ == '__main__':
+    import timeit
+
+    print(f"Backend: {BACKEND}, Numba {'installed' if NUMBA_AVAILABLE else 'not installed'}")
+    print(f"Warm-up: {warm_up(dtypes=(np.float64, np.float32)):.3f}s")
+
+    for name, deviation in self_test().items():
+        print(f"{name:<24} relative deviation {deviation:.3g}")
+
+    for name, kernel in KERNELS.items():
+        args = kernel.example(np.dtype(np.float64))
+        for backend in BACKENDS:
+            if backend == 'numba' and kernel.numba_impl is None:
+                continue
+            implementation = kernel.implementation(backend)
+            duration = min(timeit.repeat(lambda: implementation(*args), number=100, repeat=3)) / 100
+            print(f"{name:<24} {backend:<6} {duration * 1000:.4f} ms")
@@ -4,11 +4,15 @@ import time
 from threading import Thread
 import random
 
-from pylsl import StreamInlet, StreamOutlet, StreamInfo, resolve_byprop, IRREGULAR_RATE, cf_float32
+from pylsl import StreamInfo, resolve_byprop, IRREGULAR_RATE, cf_float32
+import numpy as np
 
 import globals
 from modules.module import Module
 from misc import LSLStreamInfoInterface
+from misc.LSLOutletInterface import push_chunk, CHANNEL_FORMAT_DTYPES
+from misc.SharedMemoryTransport import create_inlet, create_outlet
+from misc.LatencyTracer import LatencyTracer
 
 
 class BasicClassificationModule(Module):
@@ -32,6 +36,8 @@ class BasicClassificationModule(Module):
         self.lsl_stream_info = None
         self.lsl_outlet_sampling_rate = IRREGULAR_RATE
         self.lsl_outlet = None # StreamOutlet(streaminfo, chunk_size=1)
+        # origin timestamps of the output samples, if globals.LATENCY_TRACING is enabled
+        self.latency_tracer = None
 
         self.worker_thread = None # Thread(target=self.worker_thread, args=(self, self.inlet, self.outlet), daemon=True)
         self.running: bool = False
@@ -39,28 +45,57 @@ class BasicClassificationModule(Module):
         self.samples_received: int = 0
         self.samples_sent: int = 0
 
-    # function to be run as a thread. Pulls a sample, hands it over to process_data function and pushes the returned sample
+        # chunks are pulled into this preallocated buffer of shape (max_chunk_len, n_channels)
+        self.receive_chunk_len_seconds: float = 5 * 1e-3
+        self.max_chunk_len: int = 1024
+        self.receive_buffer: np.ndarray = None
+
+    # function to be run as a thread. Pulls a chunk, hands it over to process_chunk function and pushes the returned chunk
     def worker_thread_func(self):
 
         while self.running:
 
-            in_sample, in_timestamp = self.lsl_inlet.pull_sample(timeout=1)
+            _, in_timestamps = self.lsl_inlet.pull_chunk(timeout=self.receive_chunk_len_seconds,
+                                                         max_samples=self.max_chunk_len, dest_obj=self.receive_buffer)
 
-            if in_sample is not None:
+            if len(in_timestamps) > 0:
 
-                self.samples_received += 1
+                self.samples_received += len(in_timestamps)
 
-                out_sample, out_timestamp = self.process_data(in_sample, in_timestamp)
+                out_chunk, out_timestamps = self.process_chunk(self.receive_buffer[:len(in_timestamps)], in_timestamps)
 
-                if out_sample is not None:
+                if out_chunk is not None and len(out_chunk) > 0:
 
                     if globals.OUTPUT_TRUE_TIMESTAMPS:
-                        self.lsl_outlet.push_sample(out_sample)
+                        push_chunk(self.lsl_outlet, out_chunk)
                     else:
-                        self.lsl_outlet.push_sample(out_sample, out_timestamp)
-
-                    self.samples_sent += 1
-
+                        push_chunk(self.lsl_outlet, out_chunk, out_timestamps)
+
+                    if self.latency_tracer is not None:
+                        self.latency_tracer.trace(out_timestamps)
+
+                    self.samples_sent += len(out_chunk)
+
+    def process_chunk(self, chunk: np.ndarray, timestamps: list):
+        """
+        Processes a chunk of samples. Overwrite this with a vectorized implementation, by default process_data() is
+        called for every sample.
+        :param chunk: shape (n_samples, n_channels). This is a view on the receive buffer and only valid during the call
+        :param timestamps: list of n_samples timestamps
+        :return: output chunk of shape (n_samples_out, NUM_OUTPUT_CHANNELS) and its timestamps
+        """
+        out_samples = []
+        out_timestamps = []
+        for sample, timestamp in zip(chunk, timestamps):
+            out_sample, out_timestamp = self.process_data(sample.tolist(), timestamp)
+            if out_sample is not None:
+                out_samples.append(out_sample)
+                out_timestamps.append(out_timestamp)
+
+        if len(out_samples) == 0:
+            return np.empty((0, self.NUM_OUTPUT_CHANNELS)), out_timestamps
+
+        return np.array(out_samples).reshape((len(out_samples), -1)), out_timestamps
 
     def process_data(self, sample, timestamp):
 
@@ -93,7 +128,11 @@ class BasicClassificationModule(Module):
             return
 
         # init LSL inlet
-        self.lsl_inlet = StreamInlet(streams[0], max_buflen=360, max_chunklen=1, recover=True)
+        self.lsl_inlet = create_inlet(streams[0], max_buflen=360, max_chunklen=1, recover=True)
+
+        # preallocate the buffer chunks are pulled into
+        self.receive_buffer = np.empty((self.max_chunk_len, streams[0].channel_count()),
+                                       dtype=CHANNEL_FORMAT_DTYPES.get(streams[0].channel_format(), np.float64))
 
         # generate stream info
         self.lsl_stream_info = StreamInfo(
@@ -112,7 +151,10 @@ class BasicClassificationModule(Module):
         LSLStreamInfoInterface.add_parameters(self.lsl_stream_info, self.parameters)
 
         # init LSL outlet
-        self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=1)
+        self.lsl_outlet = create_outlet(self.lsl_stream_info, chunk_size=1)
+
+        if globals.LATENCY_TRACING:
+            self.latency_tracer = LatencyTracer(self.MODULE_NAME)
 
         # start worker thread which receives and processes signals
         self.worker_thread = Thread(target=self.worker_thread_func, daemon=True)
@@ -147,6 +189,11 @@ class BasicClassificationModule(Module):
         self.lsl_inlet.close_stream()
         self.lsl_inlet = None
         self.lsl_outlet = None
+        self.receive_buffer = None
+
+        if self.latency_tracer is not None:
+            self.latency_tracer.close()
+            self.latency_tracer = None
 
         # reset status
         self.set_state(Module.Status.STOPPED)
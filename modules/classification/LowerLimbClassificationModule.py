@@ -7,6 +7,7 @@ import subprocess
 import random
 
 from pylsl import resolve_streams, IRREGULAR_RATE, StreamInfo, cf_float32
+import numpy as np
 
 import globals
 from modules.classification.BasicClassificationModule import BasicClassificationModule
@@ -68,29 +69,32 @@ class LowerLimbClassificationModule(BasicClassificationModule):
     # mu-power normalization function
     def normalize_mu_power(self, mu_power, rv):
 
-        return (float(mu_power) / float(rv)) - 1.0
+        return (mu_power / rv) - 1.0
 
-    # overwrite the process data method to implement the classification
-    def process_data(self, sample, timestamp):
+    # overwrite the process chunk method to implement the classification of all samples at once
+    def process_chunk(self, chunk, timestamps):
 
-        sample_cz = sample[0]
-        # sample_c4 = sample[2]
-        
+        # Cz is the last channel of the preprocessed stream (it is preceded by the EOG channel if present)
+        chunk_cz = chunk[:, -1].astype(np.float64)
+
+        out_chunk = np.empty((chunk.shape[0], self.NUM_OUTPUT_CHANNELS), dtype=np.float64)
 
         # normalize mu-power signals
-        sample_cz_norm = self.normalize_mu_power(sample_cz, self.parameters['ReferenceCz'].getValue()) # self.PARAM_MU_NORM_RV_C3)
-        # sample_c3_norm = self.normalize_mu_power(sample_c3, self.parameters['ReferenceC3'].getValue()) # self.PARAM_MU_NORM_RV_C3)
-        # sample_c4_norm = self.normalize_mu_power(sample_c4, self.parameters['ReferenceC4'].getValue()) # self.PARAM_MU_NORM_RV_C4)
+        out_chunk[:, 0] = self.normalize_mu_power(chunk_cz, float(self.parameters['ReferenceCz'].getValue()))
 
         # classify mu-power signals
-        lowMuCz = 1.0 if sample_cz_norm < -self.parameters['ThresholdCz'].getValue() else 0.0
-        # lowMuC4 = 1.0 if sample_c4_norm < -self.parameters['ThresholdC4'].getValue() else 0.0
+        out_chunk[:, 1] = out_chunk[:, 0] < -self.parameters['ThresholdCz'].getValue()
 
         # classify EOG signal
-        # HOVtrigger = 1.0 if sample_eog > self.parameters['ThresholdEOGtrigger'].getValue() else 0.0
+        # HOVtrigger = chunk[:, 0] > self.parameters['ThresholdEOGtrigger'].getValue()
+
+        # return the output chunk (NormOutCz, lowMuCz) with the input timestamps
+        return (out_chunk, timestamps)
+
+    # overwrite the process data method to implement the classification
+    def process_data(self, sample, timestamp):
+
+        out_chunk, _ = self.process_chunk(np.asarray([sample], dtype=np.float64), [timestamp])
 
-        # build output sample
-        outsample = [sample_cz_norm, lowMuCz]
-        # print("class: ",outsample)
         # return the output sample with the input timestamp
-        return (outsample, timestamp)
+        return (out_chunk[0].tolist(), timestamp)
@@ -7,6 +7,7 @@ import subprocess
 import random
 
 from pylsl import resolve_streams, IRREGULAR_RATE, StreamInfo, cf_float32
+import numpy as np
 
 import globals
 from modules.classification.BasicClassificationModule import BasicClassificationModule
@@ -114,34 +115,42 @@ class ThresholdClassificationModule(BasicClassificationModule):
     # mu-power normalization function
     def normalize_mu_power(self, mu_power, rv):
 
-        return (float(mu_power) / float(rv)) - 1.0
+        return (mu_power / rv) - 1.0
 
-    # overwrite the process data method to implement the classification
-    def process_data(self, sample, timestamp):
+    # overwrite the process chunk method to implement the classification of all samples at once
+    def process_chunk(self, chunk, timestamps):
+
+        # extract channels, shape (n_samples,) and (n_samples, 3)
+        chunk_eog = chunk[:, 0]
+        chunk_mu = chunk[:, 1:4]
 
-        # extract single values
-        print("sample: ", sample)
-        sample_eog = sample[0]
-        sample_c3 = sample[1]
-        sample_c4 = sample[2]
-        sample_cz = sample[3]
+        references = np.array([self.parameters['ReferenceC3'].getValue(),
+                               self.parameters['ReferenceC4'].getValue(),
+                               self.parameters['ReferenceCz'].getValue()], dtype=np.float64)
+        thresholds = np.array([self.parameters['ThresholdC3'].getValue(),
+                               self.parameters['ThresholdC4'].getValue(),
+                               self.parameters['ThresholdCz'].getValue()], dtype=np.float64)
+
+        # build output chunk: NormOutC3, NormOutC4, NormOutCz, HOVleft, HOVright, lowMuC3, lowMuC4, lowMuCz
+        out_chunk = np.empty((chunk.shape[0], self.NUM_OUTPUT_CHANNELS), dtype=np.float64)
 
         # normalize mu-power signals
-        sample_c3_norm = self.normalize_mu_power(sample_c3, self.parameters['ReferenceC3'].getValue()) # self.PARAM_MU_NORM_RV_C3)
-        sample_c4_norm = self.normalize_mu_power(sample_c4, self.parameters['ReferenceC4'].getValue()) # self.PARAM_MU_NORM_RV_C4)
-        sample_cz_norm = self.normalize_mu_power(sample_cz, self.parameters['ReferenceCz'].getValue()) # self.PARAM_MU_NORM_RV_Cz)
+        out_chunk[:, 0:3] = self.normalize_mu_power(chunk_mu, references)
+
+        # classify EOG signal
+        out_chunk[:, 3] = chunk_eog > self.parameters['ThresholdEOGleft'].getValue()
+        out_chunk[:, 4] = chunk_eog < self.parameters['ThresholdEOGright'].getValue()
 
         # classify mu-power signals
-        lowMuC3 = 1.0 if sample_c3_norm < -self.parameters['ThresholdC3'].getValue() else 0.0
-        lowMuC4 = 1.0 if sample_c4_norm < -self.parameters['ThresholdC4'].getValue() else 0.0
-        lowMuCz = 1.0 if sample_cz_norm < -self.parameters['ThresholdCz'].getValue() else 0.0
+        out_chunk[:, 5:8] = out_chunk[:, 0:3] < -thresholds
 
-        # classify EOG signal
-        HOVleft = 1.0 if sample_eog > self.parameters['ThresholdEOGleft'].getValue() else 0.0
-        HOVright = 1.0 if sample_eog < self.parameters['ThresholdEOGright'].getValue() else 0.0
+        # return the output chunk with the input timestamps
+        return (out_chunk, timestamps)
+
+    # overwrite the process data method to implement the classification
+    def process_data(self, sample, timestamp):
 
-        # build output sample
-        outsample = [sample_c3_norm, sample_c4_norm, sample_cz_norm, HOVleft, HOVright, lowMuC3, lowMuC4, lowMuCz]
+        out_chunk, _ = self.process_chunk(np.asarray([sample], dtype=np.float64), [timestamp])
 
         # return the output sample with the input timestamp
-        return (outsample, timestamp)
+        return (out_chunk[0].tolist(), timestamp)
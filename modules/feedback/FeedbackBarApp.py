@@ -20,6 +20,7 @@ from pylsl import StreamInlet, StreamOutlet, StreamInfo, resolve_byprop
 from misc.enums import Side, Cue, DisplayText, WalkExo, RelaxFeedbackState
 from modules.module import Module
 from misc import LSLStreamInfoInterface
+from misc.LatencyTracer import LatencyTracer
 
 
 class TextWidget(QWidget):
@@ -271,6 +272,10 @@ class FeedbackBarApp(QMainWindow):
 
         self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=10)
 
+        # origin timestamp of the most recent task event, traced when the frame displaying it is drawn
+        self.latency_tracer = LatencyTracer(type(self).__name__) if globals.LATENCY_TRACING else None
+        self.trace_timestamp = None
+
         # data handling threads
         self.data_thread = Thread(target=self.data_handler, daemon=True)
         self.data_thread.start()
@@ -348,6 +353,10 @@ class FeedbackBarApp(QMainWindow):
         # after GUI was updated, push the displayed pacman positions to LSL stream
         self.lsl_outlet.push_sample([self.bar.up_down_percent])
 
+        if self.latency_tracer is not None and self.trace_timestamp is not None:
+            self.latency_tracer.trace(self.trace_timestamp)
+            self.trace_timestamp = None
+
     # function to be executed in a separate thread -> fetches LSL data and updates GUI states
     def data_handler(self):
 
@@ -370,6 +379,7 @@ class FeedbackBarApp(QMainWindow):
 
                 self.bar.state = int(sample[1])
                 self.bar_relax.state = int(sample[2])
+                self.trace_timestamp = timestamp
                 # rint("self.bar.state: ",self.bar.state)
 
             else:
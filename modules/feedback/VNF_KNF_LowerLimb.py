@@ -20,6 +20,7 @@ from pylsl import StreamInlet, StreamOutlet, StreamInfo, resolve_byprop
 from misc.enums import Side, Cue, DisplayText, WalkExo, RelaxFeedbackState
 from modules.module import Module
 from misc import LSLStreamInfoInterface
+from misc.LatencyTracer import LatencyTracer
 
 import socket
 import threading
@@ -417,6 +418,13 @@ class VNF_KNF_LowerLimb(QMainWindow):
 
         self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=10)
 
+        # origin timestamp of the most recent task event, traced when the frame displaying it is drawn
+        self.latency_tracer = LatencyTracer(type(self).__name__) if globals.LATENCY_TRACING else None
+        self.trace_timestamp = None
+        # origin timestamp of the task events which sent a command to the exo
+        self.exo_latency_tracer = LatencyTracer(f"{type(self).__name__} exo command") \
+            if globals.LATENCY_TRACING and self.display_activate_robot else None
+
         # data handling threads
         self.data_thread = Thread(target=self.data_handler, daemon=True)
         self.data_thread.start()
@@ -496,6 +504,10 @@ class VNF_KNF_LowerLimb(QMainWindow):
         # after GUI was updated, push the displayed pacman positions to LSL stream
         self.lsl_outlet.push_sample([self.bar.up_down_percent])
 
+        if self.latency_tracer is not None and self.trace_timestamp is not None:
+            self.latency_tracer.trace(self.trace_timestamp)
+            self.trace_timestamp = None
+
     # function to be executed in a separate thread -> fetches LSL data and updates GUI states
     def data_handler(self):
 
@@ -519,6 +531,7 @@ class VNF_KNF_LowerLimb(QMainWindow):
 
                 self.bar.state = int(sample[1])
                 self.bar_relax.state = int(sample[2])
+                self.trace_timestamp = timestamp
                 
                 if self.display_activate_robot:
                     if self.state_exo == "CONTINUE":
@@ -533,6 +546,9 @@ class VNF_KNF_LowerLimb(QMainWindow):
                         self.sendMessage(self.EXO_COMMAND_NONE)
                     else:
                         continue
+
+                    if self.exo_latency_tracer is not None:
+                        self.exo_latency_tracer.trace(timestamp)
                 
             else:
                 print("No samples recevied within 1s.")
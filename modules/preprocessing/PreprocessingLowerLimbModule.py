@@ -11,8 +11,13 @@ import numpy as np
 import globals
 from modules.module import Module
 from misc import LSLStreamInfoInterface
+from misc.LSLOutletInterface import push_chunk
+from misc.SharedMemoryTransport import create_inlet, create_outlet
 from misc.PreprocessingFramework.ProcessingPipeline import ProcessingPipeline
-from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline
+from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline, combine_smr_erd_pipelines
+from misc.PreprocessingFramework.PipelineProfiler import PipelineTelemetry
+from misc.LatencyTracer import LatencyTracer
+from misc import kernels
 from misc.timing import clock
 
 
@@ -29,10 +34,11 @@ class PreprocessingLowerLimbModule(Module):
 
     REQUIRED_LSL_STREAMS = [globals.STREAM_NAME_RAW_SIGNAL]
 
-    NUM_OUTPUT_CHANNELS: int = 4
+    NUM_OUTPUT_CHANNELS: int = 2
     OUTPUT_CHANNEL_FORMAT: int = cf_float32
     # OUTPUT_CHANNEL_NAMES: list = ['µCz']
-    OUTPUT_CHANNEL_NAMES: list = ['bipolar EOG', 'µC3', 'µC4', 'µCz']
+    # OUTPUT_CHANNEL_NAMES: list = ['bipolar EOG', 'µC3', 'µC4', 'µCz']
+    OUTPUT_CHANNEL_NAMES: list = ['bipolar EOG', 'µCz']
 
     # overwrite parameter definition which is empty by superclass
     PARAMETER_DEFINITION = [
@@ -60,6 +66,15 @@ class PreprocessingLowerLimbModule(Module):
             'unit': 's',
             'default': 0.4
         },
+        {
+            'name': 'spectral_method',
+            'displayname': 'Spectral estimator',
+            'description': 'Burg spectrum or a cheaper band power estimate of the sliding window. The output of the '
+                           'estimators is scaled differently, recalibrate thresholds after changing it',
+            'type': list,
+            'unit': ['burg', 'fft', 'dft', 'goertzel', 'demodulation'],
+            'default': 'burg'
+        },
         {
             'name': 'spatial_filter_type',
             'displayname': 'Spatial Filter',
@@ -83,6 +98,14 @@ class PreprocessingLowerLimbModule(Module):
             'type': bool,
             'unit': '',
             'default': False
+        },
+        {
+            'name': 'enable_pipeline_telemetry',
+            'displayname': 'Pipeline telemetry stream',
+            'description': 'Publish per-node timing statistics of the pipeline as LSL stream ' + globals.STREAM_NAME_PIPELINE_TELEMETRY,
+            'type': bool,
+            'unit': '',
+            'default': False
         }
 
     ]
@@ -103,6 +126,19 @@ class PreprocessingLowerLimbModule(Module):
         self.common_pipeline: Optional[ProcessingPipeline] = None
         self.eeg_pipeline: Optional[ProcessingPipeline] = None
         self.eog_pipeline: Optional[ProcessingPipeline] = None
+        # compiled plan of the common pipeline followed by the EOG and EEG branches
+        self.compiled_pipeline: Optional[ProcessingPipeline] = None
+        # set by restart(): the pipeline state is saved when stopping and restored when starting again
+        self.warm_restart: bool = False
+        # runtime state of the pipeline saved by stop() during a restart, and the config hash of that pipeline. It is
+        # only restored if the settings did not change
+        self._pipeline_state: Optional[dict] = None
+        self._pipeline_state_hash: Optional[str] = None
+
+        # per-node timing statistics published as LSL stream, if enabled
+        self.pipeline_telemetry: Optional[PipelineTelemetry] = None
+        # origin timestamps of the output samples, if globals.LATENCY_TRACING is enabled
+        self.latency_tracer: Optional[LatencyTracer] = None
 
         self.worker_thread: Optional[Thread] = None
         self.running: bool = False
@@ -127,15 +163,17 @@ class PreprocessingLowerLimbModule(Module):
 
                 if len(out_samples) > 0:
 
-                    for sample, timestamp in zip(out_samples, out_timestamps):
+                    # push the whole chunk at once
+                    if globals.OUTPUT_TRUE_TIMESTAMPS:
+                        push_chunk(self.lsl_outlet, out_samples)
 
-                        if globals.OUTPUT_TRUE_TIMESTAMPS:
-                            self.lsl_outlet.push_sample(sample)
+                    else:
+                        push_chunk(self.lsl_outlet, out_samples, out_timestamps)
 
-                        else:
-                            self.lsl_outlet.push_sample(sample, timestamp)
+                    if self.latency_tracer is not None:
+                        self.latency_tracer.trace(out_timestamps)
 
-                        self.samples_sent += 1
+                    self.samples_sent += len(out_samples)
 
 
     def process_data(self, samples, timestamps):
@@ -143,8 +181,8 @@ class PreprocessingLowerLimbModule(Module):
         n_times = len(timestamps)
         n_channels = len(samples[0])
 
-        # shape (n_times, n_channels)
-        data = np.array(samples)
+        # shape (n_times, n_channels), converted to the dtype of the pipeline once
+        data = np.asarray(samples, dtype=self.compiled_pipeline.dtype)
 
         # -> shape: n_channels, n_times
         data = np.moveaxis(data, 0, -1)
@@ -152,16 +190,10 @@ class PreprocessingLowerLimbModule(Module):
         # -> shape: n_trials, n_channels, ...features, n_times
         data = data.reshape([1, n_channels, n_times])
 
-        out_samples, out_timestamps = self.common_pipeline.process(data, timestamps)
-        eeg_out, eeg_timestamps = self.eeg_pipeline.process(out_samples, out_timestamps)
-        # eog_out, eog_timestamps = self.eog_pipeline.process(out_samples, out_timestamps)
+        # common pipeline, then EOG and EEG branch concurrently. The outputs are concatenated along the channels (EOG first)
+        combined_out, eeg_timestamps = self.compiled_pipeline.process(data, timestamps)
 
-        # if eeg_out is not None or eog_out is not None:
-        if eeg_out is not None:
-
-            # combine into one array
-            # combined_out = np.concatenate([eog_out, eeg_out], axis=1)
-            combined_out = eeg_out
+        if combined_out is not None:
             
             # remove trials axis -> shape n_channels, n_times
             combined_out = combined_out[0]
@@ -169,9 +201,6 @@ class PreprocessingLowerLimbModule(Module):
             # move n_times to be first axis
             combined_out = np.moveaxis(combined_out, -1, 0)
 
-            # convert to list
-            combined_out = combined_out.tolist()
-
             # make sure timestamps is list of timestamps
             combined_out_timestamps = eeg_timestamps
             if type(combined_out_timestamps) is np.ndarray:
@@ -212,7 +241,7 @@ class PreprocessingLowerLimbModule(Module):
         max_chunk_len = max(1, int(self.fs_in * self.receive_chunk_len_seconds))
 
         # init LSL inlet
-        self.lsl_inlet = StreamInlet(streams[0], max_buflen=360, max_chunklen=max_chunk_len, recover=True)
+        self.lsl_inlet = create_inlet(streams[0], max_buflen=360, max_chunklen=max_chunk_len, recover=True)
 
         # read channel labels
         inlet_channel_labels = LSLStreamInfoInterface.get_channel_labels(self.lsl_inlet.info())
@@ -300,9 +329,32 @@ class PreprocessingLowerLimbModule(Module):
             enable_debugging_streams=self.get_parameter_value('enable_debugging_streams'),
             spatial_filter_weight_matrix=spatial_filter_weight_matrix,
             spatial_filter_output_labels=spatial_filter_out_labels,
-            channels_eeg_processing=["Cz"]
+            channels_eeg_processing=["Cz"],
+            buffer_catch_up=True,
+            spectral_method=self.get_parameter_value('spectral_method')
         )
 
+        # run the common pipeline and the EOG and EEG branches as one compiled plan
+        self.compiled_pipeline = combine_smr_erd_pipelines(self.common_pipeline, self.eeg_pipeline,
+                                                           self.eog_pipeline).compile()
+
+        # compile the DSP kernels now instead of when the first window is processed
+        kernels.warm_up(dtypes=(self.compiled_pipeline.dtype,))
+
+        # continue with the filter states and buffer contents from before the restart
+        if self.warm_restart:
+            self.warm_restart = False
+            pipeline_state, pipeline_state_hash = self._pipeline_state, self._pipeline_state_hash
+            self._pipeline_state = self._pipeline_state_hash = None
+            if pipeline_state is not None and pipeline_state_hash != self.compiled_pipeline.config_hash():
+                print(self.MODULE_NAME + ": The pipeline settings changed, the pipeline state is not restored.")
+            elif pipeline_state is not None:
+                try:
+                    self.compiled_pipeline.set_state(pipeline_state)
+                except Exception as e:
+                    print(self.MODULE_NAME + ": Could not restore the pipeline state:", e)
+                    self.compiled_pipeline.clear()
+
         # generate stream info
         self.lsl_stream_info = StreamInfo(
             globals.STREAM_NAME_PREPROCESSED_SIGNAL,
@@ -320,7 +372,14 @@ class PreprocessingLowerLimbModule(Module):
         LSLStreamInfoInterface.add_parameters(self.lsl_stream_info, self.parameters)
         
         # init LSL outlet
-        self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=1)
+        self.lsl_outlet = create_outlet(self.lsl_stream_info, chunk_size=1)
+
+        if self.get_parameter_value('enable_pipeline_telemetry'):
+            profiler = self.compiled_pipeline.enable_profiling()
+            self.pipeline_telemetry = PipelineTelemetry(profiler, stream_name=globals.STREAM_NAME_PIPELINE_TELEMETRY).start()
+
+        if globals.LATENCY_TRACING:
+            self.latency_tracer = LatencyTracer(self.MODULE_NAME)
         
         # start worker thread which receives and processes signals
         self.worker_thread = Thread(target=self.worker_thread_func, daemon=True)
@@ -352,16 +411,32 @@ class PreprocessingLowerLimbModule(Module):
         self.lsl_inlet = None
         self.lsl_outlet = None
 
+        if self.pipeline_telemetry is not None:
+            self.pipeline_telemetry.stop()
+            self.pipeline_telemetry = None
+
+        if self.latency_tracer is not None:
+            self.latency_tracer.close()
+            self.latency_tracer = None
+
+        if self.warm_restart:
+            # copied, some states are views into buffers of the pipeline
+            self._pipeline_state = {key: np.array(value) for key, value in self.compiled_pipeline.get_state().items()}
+            self._pipeline_state_hash = self.compiled_pipeline.config_hash()
+
         # reset pipelines
+        self.compiled_pipeline.close()
         self.common_pipeline = None
         self.eeg_pipeline = None
         self.eog_pipeline = None
+        self.compiled_pipeline = None
         self.fs_out = 0
 
         # reset status
         self.set_state(Module.Status.STOPPED)
 
     def restart(self):
+        self.warm_restart = self.get_state() is Module.Status.RUNNING
         self.stop()
         time.sleep(0.2)
         self.start()
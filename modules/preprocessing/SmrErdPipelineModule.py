@@ -11,8 +11,13 @@ import numpy as np
 import globals
 from modules.module import Module
 from misc import LSLStreamInfoInterface
+from misc.LSLOutletInterface import push_chunk
+from misc.SharedMemoryTransport import create_inlet, create_outlet
 from misc.PreprocessingFramework.ProcessingPipeline import ProcessingPipeline
-from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline
+from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline, combine_smr_erd_pipelines
+from misc.PreprocessingFramework.PipelineProfiler import PipelineTelemetry
+from misc.LatencyTracer import LatencyTracer
+from misc import kernels
 from misc.timing import clock
 
 class SmrErdPipelineModule(Module):
@@ -79,6 +84,14 @@ class SmrErdPipelineModule(Module):
             'type': bool,
             'unit': '',
             'default': False
+        },
+        {
+            'name': 'enable_pipeline_telemetry',
+            'displayname': 'Pipeline telemetry stream',
+            'description': 'Publish per-node timing statistics of the pipeline as LSL stream ' + globals.STREAM_NAME_PIPELINE_TELEMETRY,
+            'type': bool,
+            'unit': '',
+            'default': False
         }
 
     ]
@@ -99,6 +112,13 @@ class SmrErdPipelineModule(Module):
         self.common_pipeline: Optional[ProcessingPipeline] = None
         self.eeg_pipeline: Optional[ProcessingPipeline] = None
         self.eog_pipeline: Optional[ProcessingPipeline] = None
+        # common pipeline followed by the EOG and EEG branches
+        self.combined_pipeline: Optional[ProcessingPipeline] = None
+
+        # per-node timing statistics published as LSL stream, if enabled
+        self.pipeline_telemetry: Optional[PipelineTelemetry] = None
+        # origin timestamps of the output samples, if globals.LATENCY_TRACING is enabled
+        self.latency_tracer: Optional[LatencyTracer] = None
 
         self.worker_thread: Optional[Thread] = None
         self.running: bool = False
@@ -122,15 +142,17 @@ class SmrErdPipelineModule(Module):
                 print("out_samples: ", out_samples, "out_timestamps: ", out_timestamps)
                 if len(out_samples) > 0:
 
-                    for sample, timestamp in zip(out_samples, out_timestamps):
+                    # push the whole chunk at once
+                    if globals.OUTPUT_TRUE_TIMESTAMPS:
+                        push_chunk(self.lsl_outlet, out_samples)
 
-                        if globals.OUTPUT_TRUE_TIMESTAMPS:
-                            self.lsl_outlet.push_sample(sample)
+                    else:
+                        push_chunk(self.lsl_outlet, out_samples, out_timestamps)
 
-                        else:
-                            self.lsl_outlet.push_sample(sample, timestamp)
+                    if self.latency_tracer is not None:
+                        self.latency_tracer.trace(out_timestamps)
 
-                        self.samples_sent += 1
+                    self.samples_sent += len(out_samples)
 
 
     def process_data(self, samples, timestamps):
@@ -138,8 +160,8 @@ class SmrErdPipelineModule(Module):
         n_times = len(timestamps)
         n_channels = len(samples[0])
 
-        # shape (n_times, n_channels)
-        data = np.array(samples)
+        # shape (n_times, n_channels), converted to the dtype of the pipeline once
+        data = np.asarray(samples, dtype=self.combined_pipeline.dtype)
 
         # -> shape: n_channels, n_times
         data = np.moveaxis(data, 0, -1)
@@ -147,17 +169,11 @@ class SmrErdPipelineModule(Module):
         # -> shape: n_trials, n_channels, ...features, n_times
         data = data.reshape([1, n_channels, n_times])
 
-        out_samples, out_timestamps = self.common_pipeline.process(data, timestamps)
-        eeg_out, eeg_timestamps = self.eeg_pipeline.process(out_samples, out_timestamps)
-        eog_out, eog_timestamps = self.eog_pipeline.process(out_samples, out_timestamps)
+        # common pipeline, then EOG and EEG branch concurrently. The outputs are concatenated along the channels (EOG first)
+        combined_out, eeg_timestamps = self.combined_pipeline.process(data, timestamps)
 
-        if eeg_out is not None or eog_out is not None:
-            # print(out_samples.shape, len(out_timestamps), round((t2 - t1) * 1000, 1), "ms")
-            print("eeg: ", eeg_out.shape, eeg_timestamps)
-            print("eog: ", eog_out.shape, eog_timestamps)
-
-            # combine into one array
-            combined_out = np.concatenate([eog_out, eeg_out], axis=1)
+        if combined_out is not None:
+            print("combined: ", combined_out.shape, eeg_timestamps)
 
             # remove trials axis -> shape n_channels, n_times
             combined_out = combined_out[0]
@@ -165,9 +181,6 @@ class SmrErdPipelineModule(Module):
             # move n_times to be first axis
             combined_out = np.moveaxis(combined_out, -1, 0)
 
-            # convert to list
-            combined_out = combined_out.tolist()
-
             # make sure timestamps is list of timestamps
             combined_out_timestamps = eeg_timestamps
             if type(combined_out_timestamps) is np.ndarray:
@@ -208,7 +221,7 @@ class SmrErdPipelineModule(Module):
         max_chunk_len = max(1, int(self.fs_in * self.receive_chunk_len_seconds))
 
         # init LSL inlet
-        self.lsl_inlet = StreamInlet(streams[0], max_buflen=360, max_chunklen=max_chunk_len, recover=True)
+        self.lsl_inlet = create_inlet(streams[0], max_buflen=360, max_chunklen=max_chunk_len, recover=True)
 
         # read channel labels
         inlet_channel_labels = LSLStreamInfoInterface.get_channel_labels(self.lsl_inlet.info())
@@ -286,7 +299,10 @@ class SmrErdPipelineModule(Module):
             enable_debugging_streams=self.get_parameter_value('enable_debugging_streams'),
             spatial_filter_weight_matrix=spatial_filter_weight_matrix
         )
+        self.combined_pipeline = combine_smr_erd_pipelines(self.common_pipeline, self.eeg_pipeline, self.eog_pipeline)
 
+        # compile the DSP kernels now instead of when the first window is processed
+        kernels.warm_up(dtypes=(self.combined_pipeline.dtype,))
 
         # generate stream info
         self.lsl_stream_info = StreamInfo(
@@ -305,7 +321,14 @@ class SmrErdPipelineModule(Module):
         LSLStreamInfoInterface.add_parameters(self.lsl_stream_info, self.parameters)
 
         # init LSL outlet
-        self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=1)
+        self.lsl_outlet = create_outlet(self.lsl_stream_info, chunk_size=1)
+
+        if self.get_parameter_value('enable_pipeline_telemetry'):
+            profiler = self.combined_pipeline.enable_profiling()
+            self.pipeline_telemetry = PipelineTelemetry(profiler, stream_name=globals.STREAM_NAME_PIPELINE_TELEMETRY).start()
+
+        if globals.LATENCY_TRACING:
+            self.latency_tracer = LatencyTracer(self.MODULE_NAME)
 
         # start worker thread which receives and processes signals
         self.worker_thread = Thread(target=self.worker_thread_func, daemon=True)
@@ -337,7 +360,17 @@ class SmrErdPipelineModule(Module):
         self.lsl_inlet = None
         self.lsl_outlet = None
 
+        if self.pipeline_telemetry is not None:
+            self.pipeline_telemetry.stop()
+            self.pipeline_telemetry = None
+
+        if self.latency_tracer is not None:
+            self.latency_tracer.close()
+            self.latency_tracer = None
+
         # reset pipelines
+        self.combined_pipeline.close()
+        self.combined_pipeline = None
         self.common_pipeline = None
         self.eeg_pipeline = None
         self.eog_pipeline = None
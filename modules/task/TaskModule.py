@@ -5,9 +5,11 @@ import globals
 from misc import enums
 import random
 
-from pylsl import resolve_byprop, StreamInlet, StreamOutlet, StreamInfo, IRREGULAR_RATE, cf_int32
+from pylsl import resolve_byprop, StreamOutlet, StreamInfo, IRREGULAR_RATE, cf_int32
 from misc.LSLStreamInfoInterface import add_channel_names, add_mappings, add_parameters
 from misc.timing import clock
+from misc.LatencyTracer import LatencyTracer
+from misc.SharedMemoryTransport import create_inlet
 
 
 # is meant to provide the general structures of all task modules
@@ -33,6 +35,8 @@ class TaskModule(Module):
         self.lsl_inlet = None
         self.lsl_outlet = None
         self.lsl_streaminfo = None
+        # origin timestamps of the samples output by process_data(), if globals.LATENCY_TRACING is enabled
+        self.latency_tracer = None
 
 
     def start(self):
@@ -57,7 +61,7 @@ class TaskModule(Module):
             return
 
         # init LSL inlet
-        self.lsl_inlet = StreamInlet(streams[0], max_buflen=360, max_chunklen=1, recover=True)
+        self.lsl_inlet = create_inlet(streams[0], max_buflen=360, max_chunklen=1, recover=True)
 
         # create stream info for lsl outlet
         self.lsl_stream_info = StreamInfo(
@@ -77,6 +81,9 @@ class TaskModule(Module):
         # init LSL outlet
         self.lsl_outlet = StreamOutlet(self.lsl_stream_info, chunk_size=1) #TODO check if it is necessary
 
+        if globals.LATENCY_TRACING:
+            self.latency_tracer = LatencyTracer(self.MODULE_NAME)
+
         # set running true to signal threads to continue running
         self.running = True
 
@@ -137,6 +144,10 @@ class TaskModule(Module):
         self.lsl_inlet = None
         self.lsl_outlet = None
 
+        if self.latency_tracer is not None:
+            self.latency_tracer.close()
+            self.latency_tracer = None
+
         # set status
         self.set_state(Module.Status.STOPPED)
 
@@ -159,6 +170,9 @@ class TaskModule(Module):
                     else:
                         self.lsl_outlet.push_sample(out_sample, out_timestamp)
 
+                    if self.latency_tracer is not None:
+                        self.latency_tracer.trace(out_timestamp)
+
 
     # method for event-generating task to execute
     def run(self):
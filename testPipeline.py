@@ -89,6 +89,8 @@ pipeline_nodes[0].out_channel_labels = inlet_channel_labels
 
 pipeline = ProcessingPipeline.ProcessingPipeline(inlet_channel_labels, pipeline_nodes)
 
+# per-node timing statistics
+profiler = pipeline.enable_profiling()
 
 
 t_start = local_clock()
@@ -126,4 +128,6 @@ while local_clock() < (t_start+600):
     # out_samples = out_samples.reshape([n_channels, n_times])
     # out_samples = np.moveaxis(out_samples, 0, -1)
 
+print(profiler)
+
 time.sleep(3)
\ No newline at end of file
@@ -42,7 +42,7 @@ matplotlib.use('Qt5Agg')
 matplotlib.rcParams['toolbar'] = 'None'
 from misc.enums import Side
 from helpers.analysis_file_selector import select_file_dialog
-from misc.burg.burg_utils import calc_burg_spectrum
+from misc.burg.burg_plan import get_burg_spectrum_plan
 
 plot_spectrum_method = 'burg'    # fft or burg
 
@@ -151,27 +151,18 @@ fftfreq_alpha = fftfreq[start:end]
 
 if plot_spectrum_method != 'fft':
     # burg spectra
-    close_spectra = []
-    relax_spectra = []
-
     evals = 15
     bin_width = 0.02
     n_bins = int(1 + 1/bin_width * 12)
     model_order = int(sampling_freq * 0.8)
 
+    # the spectrum plan is shared with BurgSpectrumNode and evaluates all trials in one batch
+    plan = get_burg_spectrum_plan(fs=sampling_freq, foi=10.0, nbins=n_bins, bin_width=bin_width, evals_per_bin=evals,
+                                  model_order=model_order)
 
-    for tr in close_trials:
-        spectrum, freqs = calc_burg_spectrum(tr.flatten()-tr.mean(), foi=10.0, nbins=n_bins, bin_width=bin_width, evals_per_bin=evals,
-                                             output_type='power', fs=sampling_freq, model_order=model_order, fast_version=True)
-        close_spectra.append(spectrum)
-
-    for tr in relax_trials:
-        spectrum, freqs = calc_burg_spectrum(tr.flatten()-tr.mean(), foi=10.0, nbins=n_bins, bin_width=bin_width, evals_per_bin=evals,
-                                             output_type='power', fs=sampling_freq, model_order=model_order, fast_version=True)
-        relax_spectra.append(spectrum)
-
-    close_spectra = np.array(close_spectra)
-    relax_spectra = np.array(relax_spectra)
+    close_spectra = plan.compute(np.array([tr.flatten()-tr.mean() for tr in close_trials]), output_type='power')
+    relax_spectra = plan.compute(np.array([tr.flatten()-tr.mean() for tr in relax_trials]), output_type='power')
+    freqs = plan.frequencies
 
     burg_frequs = freqs.copy()
     close_burg_spectrum = close_spectra.mean(axis=0)
@@ -0,0 +1,210 @@
+"""
+Cost and agreement of the band power estimators of the SMR ERD pipeline
+
+Replays the EEG stream of a recorded XDF file (or a synthetic EEG signal with --synthetic) through the EEG branch of
+create_smr_erd_pipeline() once per spectral_method, in chunks like the online module receives them. The common
+pipeline is run once and its output is fed to the EEG branch of every method. Reported per method:
+    - the CPU time of the spectral stage (BufferNode and BurgSpectrumNode, or BandPowerNode) and of the whole EEG
+      branch, in ms per second of signal, and the speedup of the spectral stage over burg
+    - the Pearson correlation of the EEG branch output with the output of burg, per EEG channel, after --skip seconds
+      so that the filters have settled
+
+The estimators are scaled differently, the correlation shows whether a method follows the same modulation and
+thresholds calibrated with burg need to be recalibrated for it.
+
+Run from the root directory of the repository:
+    python tools/band_power_comparison.py <file.xdf>
+    python tools/band_power_comparison.py <file.xdf> --stream EEG --chunk 10 --fs-decimated 125
+    python tools/band_power_comparison.py --synthetic --fs 500 --duration 60
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List, Optional
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+
+from misc import kernels
+from misc.PreprocessingFramework.BandPowerNode import BAND_POWER_ENGINES, BandPowerNode
+from misc.PreprocessingFramework.BufferNode import BufferNode
+from misc.PreprocessingFramework.BurgSpectrumNode import BurgSpectrumNode
+from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline
+from tools.dtype_accuracy import find_eeg_stream, spatial_filter_for_labels
+
+
+REFERENCE_METHOD = 'burg'
+METHODS = (REFERENCE_METHOD,) + tuple(BAND_POWER_ENGINES)
+
+SPECTRAL_NODES = (BufferNode, BurgSpectrumNode, BandPowerNode)
+
+
+def load_recording(path: str, stream_name: Optional[str] = None) -> (np.ndarray, np.ndarray, float, List[str]):
+    """:return: data of shape (n_channels, n_times), timestamps, sampling rate and channel labels"""
+    import pyxdf
+    from misc.XDF_utils import get_channel_labels_from_xdf_stream
+
+    streams, header = pyxdf.load_xdf(path, dejitter_timestamps=True)
+    stream = find_eeg_stream(streams, stream_name)
+
+    data = np.asarray(stream['time_series'], dtype=np.float64).T
+    return (data, np.asarray(stream['time_stamps']), float(stream['info']['nominal_srate'][0]),
+            get_channel_labels_from_xdf_stream(stream))
+
+
+def replay(data: np.ndarray, timestamps: np.ndarray, fs: float, channel_labels: List[str], methods=METHODS,
+           chunk_length: int = 10, fs_decimated: Optional[float] = None,
+           decimation_phase: str = 'linear') -> (dict, float):
+    """
+    Feeds the recording through the common pipeline and the EEG branch of every method chunk by chunk
+    :param data: shape (n_channels, n_times)
+    :return: (dict of method -> dict with the EEG branch output of shape (n_channels, n_outputs) and the CPU times
+             of the spectral stage and the branch in seconds, output rate)
+    """
+    weights, output_labels, eeg_labels = spatial_filter_for_labels(channel_labels)
+
+    common_pipeline = None
+    eeg_pipelines = dict()
+    fs_out = None
+    for method in methods:
+        common, eeg_pipelines[method], eog, fs_out = create_smr_erd_pipeline(
+            channel_labels, fs=fs, spatial_filter_weight_matrix=weights, spatial_filter_output_labels=output_labels,
+            channels_eeg_processing=eeg_labels, buffer_catch_up=True, fs_decimated=fs_decimated,
+            decimation_phase=decimation_phase, spectral_method=method)
+        if common_pipeline is None:
+            common_pipeline = common
+        else:
+            common.close()
+        eog.close()
+
+    # compile the DSP kernels before the timed replay, like the modules do when they start
+    kernels.warm_up(dtypes=(common_pipeline.dtype,))
+
+    results = {method: dict(outputs=[], spectral_seconds=0.0, branch_seconds=0.0) for method in methods}
+
+    for start in range(0, data.shape[-1], chunk_length):
+        chunk = data[np.newaxis, :, start:start + chunk_length]
+        common_out, common_timestamps = common_pipeline.process(chunk, timestamps[start:start + chunk_length])
+
+        for method, pipeline in eeg_pipelines.items():
+            result = results[method]
+            out, out_timestamps = common_out, common_timestamps
+            for node in pipeline.nodes:
+                if out is None:
+                    break
+                t_start = time.process_time()
+                out, out_timestamps = node.process(out, out_timestamps)
+                duration = time.process_time() - t_start
+
+                result['branch_seconds'] += duration
+                if isinstance(node, SPECTRAL_NODES):
+                    result['spectral_seconds'] += duration
+
+            if out is not None:
+                # copy of shape (n_channels, n_outputs), the output can be a view into a ring buffer
+                result['outputs'].append(np.array(out[0], dtype=np.float64).reshape((out.shape[1], -1)))
+
+    for pipeline in [common_pipeline] + list(eeg_pipelines.values()):
+        pipeline.close()
+
+    for result in results.values():
+        result['outputs'] = np.concatenate(result['outputs'], axis=-1) if result['outputs'] else np.zeros((0, 0))
+
+    return results, fs_out
+
+
+def correlation(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Pearson correlation per row, NaN for constant rows"""
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(x * y, axis=-1) / np.sqrt(np.sum(x * x, axis=-1) * np.sum(y * y, axis=-1))
+
+
+def report(data: np.ndarray, timestamps: np.ndarray, fs: float, channel_labels: List[str], methods=METHODS,
+           chunk_length: int = 10, fs_decimated: Optional[float] = None, decimation_phase: str = 'linear',
+           skip_seconds: float = 5.0) -> dict:
+    results, fs_out = replay(data, timestamps, fs, channel_labels, methods=methods, chunk_length=chunk_length,
+                             fs_decimated=fs_decimated, decimation_phase=decimation_phase)
+    signal_seconds = data.shape[-1] / fs
+    eeg_labels = spatial_filter_for_labels(channel_labels)[2]
+
+    reference = results.get(REFERENCE_METHOD)
+    skip = int(round(skip_seconds * fs_out))
+
+    print(f"{'method':<14} {'outputs':>8} {'spectral [ms/s]':>16} {'branch [ms/s]':>14} {'speedup':>8}  "
+          + " ".join(f"{f'r {label}':>10.10}" for label in eeg_labels))
+
+    for method, result in results.items():
+        result['spectral_ms_per_s'] = result['spectral_seconds'] * 1000 / signal_seconds
+        result['branch_ms_per_s'] = result['branch_seconds'] * 1000 / signal_seconds
+        result['speedup'] = (reference['spectral_seconds'] / result['spectral_seconds']
+                             if reference is not None and result['spectral_seconds'] > 0 else float('nan'))
+
+        outputs = result['outputs']
+        if reference is not None and outputs.size and reference['outputs'].size:
+            n = min(outputs.shape[-1], reference['outputs'].shape[-1])
+            result['correlation'] = correlation(outputs[:, skip:n], reference['outputs'][:, skip:n])
+        else:
+            result['correlation'] = np.full(len(eeg_labels), np.nan)
+
+        print(f"{method:<14} {outputs.shape[-1]:>8d} {result['spectral_ms_per_s']:>16.3f} "
+              f"{result['branch_ms_per_s']:>14.3f} {result['speedup']:>7.2f}x  "
+              + " ".join(f"{r:>10.3f}" for r in result['correlation']))
+
+    print()
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CPU cost of the band power estimators and their correlation with burg")
+    parser.add_argument('path', nargs='?', help="XDF file with an EEG stream")
+    parser.add_argument('--stream', help="name of the EEG stream (default: the first stream of type EEG)")
+    parser.add_argument('--synthetic', action='store_true', help="use a synthetic EEG signal instead of a recording")
+    parser.add_argument('--fs', type=float, default=500.0, help="sampling rate of the synthetic signal in Hz")
+    parser.add_argument('--channels', type=int, default=8, help="channel count of the synthetic signal")
+    parser.add_argument('--duration', type=float, default=60.0, help="duration of the synthetic signal in s")
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS),
+                        help=f"spectral methods to compare (default {METHODS})")
+    parser.add_argument('--chunk', type=int, default=10, help="chunk length in samples")
+    parser.add_argument('--fs-decimated', type=float, help="decimate the EEG branch to this sampling rate")
+    parser.add_argument('--decimation-phase', choices=('linear', 'minimum'), default='linear',
+                        help="phase of the anti-alias filter of the decimator")
+    parser.add_argument('--skip', type=float, default=5.0, help="seconds at the start left out of the correlation")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.synthetic:
+        from benchmarks.smr_erd_throughput import synthetic_eeg
+        data, timestamps = synthetic_eeg(args.fs, args.channels, args.duration)
+        fs = args.fs
+        channel_labels = ['F7', 'F8', 'C3', 'C4', 'CZ'] + [f"Ch{i}" for i in range(5, args.channels)]
+        channel_labels = channel_labels[:args.channels]
+        print(f"\nSynthetic signal:\t {args.channels} channels, {fs}Hz, {args.duration:.1f}s, "
+              f"chunks of {args.chunk} samples\n")
+    elif args.path:
+        data, timestamps, fs, channel_labels = load_recording(args.path, args.stream)
+        print(f"\nFile:\t {args.path}")
+        print(f"Stream:\t {len(channel_labels)} channels, {fs}Hz, {data.shape[-1] / fs:.1f}s, "
+              f"chunks of {args.chunk} samples\n")
+    else:
+        print(__doc__)
+        return 1
+
+    methods = list(args.methods)
+    if REFERENCE_METHOD not in methods:
+        methods.insert(0, REFERENCE_METHOD)
+
+    report(data, timestamps, fs, channel_labels, methods=methods, chunk_length=args.chunk,
+           fs_decimated=args.fs_decimated, decimation_phase=args.decimation_phase, skip_seconds=args.skip)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Accuracy report of the float32 processing mode of the SMR ERD pipeline
+
+Replays the EEG stream of a recorded XDF file through the pipeline of create_smr_erd_pipeline() once with
+dtype=float64 and once with dtype=float32, in chunks like the online modules receive them, and reports the deviation
+of the float32 output after every node as well as the processing time of both modes.
+
+Usage:
+    python tools/dtype_accuracy.py <file.xdf> [stream name] [chunk length in samples]
+"""
+
+import sys
+import os
+import time
+from typing import List, Optional
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+
+from misc.PreprocessingFramework.SmrErdPipeline import create_smr_erd_pipeline
+
+
+DTYPES = ('float64', 'float32')
+
+
+def find_eeg_stream(streams: list, stream_name: Optional[str] = None) -> dict:
+    for stream in streams:
+        info = stream['info']
+        if stream_name is not None and info['name'][0] == stream_name:
+            return stream
+        if stream_name is None and info['type'][0].lower() == 'eeg' and len(stream['time_stamps']) > 0:
+            return stream
+    raise KeyError(f"No EEG stream {stream_name or ''} found in the file")
+
+
+def spatial_filter_for_labels(channel_labels: List[str], eeg_channels=('C3', 'C4', 'CZ'), eog_channels=('F7', 'F8')):
+    """
+    Bipolar EOG and the EEG channels picked from the recording (channels which are not recorded are left out)
+    :return: (weights, output labels, EEG output labels)
+    """
+    upper_labels = [label.upper() for label in channel_labels]
+    eeg_labels = [label for label in eeg_channels if label.upper() in upper_labels]
+    if not eeg_labels:
+        # fall back to the first channels of the recording
+        eeg_labels = channel_labels[:3]
+
+    output_labels = ['bipolar EOG'] + eeg_labels
+    weights = np.zeros((len(output_labels), len(channel_labels)))
+
+    if all(label.upper() in upper_labels for label in eog_channels):
+        weights[0, upper_labels.index(eog_channels[0].upper())] = 1
+        weights[0, upper_labels.index(eog_channels[1].upper())] = -1
+
+    for i_out, label in enumerate(eeg_labels):
+        weights[i_out + 1, upper_labels.index(label.upper())] = 1
+
+    return weights, output_labels, eeg_labels
+
+
+def run_nodes(nodes: list, data, timestamps, outputs: dict, prefix: str) -> (np.ndarray, object, float):
+    """Runs data through a list of nodes and appends the output of every node to outputs[prefix + node index]"""
+    duration = 0.0
+    for i_node, node in enumerate(nodes):
+        if data is None:
+            break
+        t_start = time.perf_counter()
+        data, timestamps = node.process(data, timestamps)
+        duration += time.perf_counter() - t_start
+        if data is not None:
+            # copy of shape (n_channels, n_outputs) in float64, BufferNode returns views into its ring buffer
+            outputs.setdefault(f"{prefix} {i_node:02d} {node}", []).append(
+                np.moveaxis(np.array(data, dtype=np.float64), 1, 0).reshape((data.shape[1], -1)))
+    return data, timestamps, duration
+
+
+def replay(data: np.ndarray, timestamps: np.ndarray, fs: float, channel_labels: List[str], dtype: str,
+           chunk_length: int) -> (dict, float):
+    """
+    Feeds the recording through the nodes of the pipeline chunk by chunk
+    :param data: shape (n_channels, n_times)
+    :return: (dict of node -> output of the node of shape (n_channels, n_outputs), processing time in seconds)
+    """
+    weights, output_labels, eeg_labels = spatial_filter_for_labels(channel_labels)
+    common_pipeline, eeg_pipeline, eog_pipeline, fs_out = create_smr_erd_pipeline(
+        channel_labels, fs=fs, spatial_filter_weight_matrix=weights, spatial_filter_output_labels=output_labels,
+        channels_eeg_processing=eeg_labels, buffer_catch_up=True, dtype=dtype)
+
+    outputs = dict()
+    duration = 0.0
+    for start in range(0, data.shape[-1], chunk_length):
+        chunk = np.asarray(data[np.newaxis, :, start:start + chunk_length], dtype=dtype)
+        chunk_timestamps = timestamps[start:start + chunk_length]
+
+        common_out, common_timestamps, t = run_nodes(common_pipeline.nodes, chunk, chunk_timestamps, outputs, 'common')
+        duration += t
+        for prefix, pipeline in (('EEG', eeg_pipeline), ('EOG', eog_pipeline)):
+            *_, t = run_nodes(pipeline.nodes, common_out, common_timestamps, outputs, prefix)
+            duration += t
+
+    for pipeline in (common_pipeline, eeg_pipeline, eog_pipeline):
+        pipeline.close()
+
+    return {name: np.concatenate(chunks, axis=-1) for name, chunks in outputs.items()}, duration
+
+
+def report(path: str, stream_name: Optional[str] = None, chunk_length: int = 10):
+    # only needed for reading the recording, the helpers of this tool are also used without pyxdf
+    import pyxdf
+    from misc.XDF_utils import get_channel_labels_from_xdf_stream
+
+    streams, header = pyxdf.load_xdf(path, dejitter_timestamps=True)
+    stream = find_eeg_stream(streams, stream_name)
+
+    channel_labels = get_channel_labels_from_xdf_stream(stream)
+    fs = float(stream['info']['nominal_srate'][0])
+    data = np.asarray(stream['time_series'], dtype=np.float64).T
+    timestamps = np.asarray(stream['time_stamps'])
+
+    print(f"\nFile:\t {path}")
+    print(f"Stream:\t {stream['info']['name'][0]}, {len(channel_labels)} channels, {fs}Hz, {data.shape[-1] / fs:.1f}s, "
+          f"chunks of {chunk_length} samples\n")
+
+    results = {dtype: replay(data, timestamps, fs, channel_labels, dtype, chunk_length) for dtype in DTYPES}
+    reference, reference_duration = results['float64']
+    outputs, duration = results['float32']
+
+    print("Deviation of float32 from float64 per node, relative to the RMS of the float64 output:")
+    print(f"{'node':<60} {'outputs':>8} {'max':>10} {'median':>10} {'max abs.':>10}")
+    for name, expected in reference.items():
+        actual = outputs[name]
+        n = min(expected.shape[-1], actual.shape[-1])
+        expected, actual = expected[..., :n], actual[..., :n]
+        error = np.abs(actual - expected)
+        rms = np.sqrt(np.mean(expected ** 2, axis=-1, keepdims=True))
+        relative = error / np.where(rms > 0, rms, 1.0)
+        print(f"{name:<60.60} {n:>8d} {relative.max():>10.2e} {np.median(relative):>10.2e} {error.max():>10.2e}")
+
+    print(f"\nProcessing time: float64 {reference_duration:.3f}s, float32 {duration:.3f}s "
+          f"({reference_duration / duration:.2f}x)\n")
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    report(sys.argv[1],
+           stream_name=sys.argv[2] if len(sys.argv) > 2 else None,
+           chunk_length=int(sys.argv[3]) if len(sys.argv) > 3 else 10)
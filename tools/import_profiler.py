@@ -0,0 +1,222 @@
+"""
+Import time report of the main program and the module processes
+
+Every target is imported in a fresh interpreter with python -X importtime, like MainProgram.py is started and like a
+module process imports ModuleProcess and its module. The self times of all imported modules are aggregated per
+top-level package and the slowest imports (cumulative time) are listed. Each target is imported --repeat times and the
+fastest run is reported, the first run may include compiling the bytecode.
+
+Packages which the framework only loads on first use (LAZY_PACKAGES) are reported when a target imports them.
+
+Results are written to a JSON file with --output. With --compare the results are compared with a stored baseline,
+targets whose import time grew by more than --threshold or which newly import a lazy package are flagged as
+regressions (exit code 1).
+
+Run from the root directory of the repository:
+    python tools/import_profiler.py
+    python tools/import_profiler.py --targets modules.preprocessing.PreprocessingLowerLimbModule --top 30
+    python tools/import_profiler.py --output imports.json
+    python tools/import_profiler.py --compare imports.json --threshold 0.2
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+MAIN_TARGET = 'MainProgram'
+
+# imported by every module process before the module itself
+MODULE_PROCESS_IMPORT = 'modules.ModuleProcess'
+
+# heavy optional dependencies which are imported on first use only
+LAZY_PACKAGES = ('matplotlib', 'typeguard', 'scipy.integrate', 'pyxdf', 'mne', 'sklearn', 'numba')
+
+IMPORTTIME_PREFIX = 'import time:'
+
+
+def module_targets() -> List[str]:
+    """Dotted names of all module files in the packages of modules/"""
+    paths = sorted(glob.glob(os.path.join('modules', '*', '*.py')))
+    return [os.path.splitext(path)[0].replace(os.sep, '.') for path in paths if not path.endswith('__init__.py')]
+
+
+def import_statement(target: str) -> str:
+    """Modules are imported the way a module process imports them, other targets on their own"""
+    if target.startswith('modules.') and target != MODULE_PROCESS_IMPORT:
+        return f"import {MODULE_PROCESS_IMPORT}; import {target}"
+    return f"import {target}"
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """
+    Parses the output of -X importtime
+    :return: one dict per imported module with name, self_us, cumulative_us and depth (0 for imports of the statement)
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len(IMPORTTIME_PREFIX):].split('|')
+            imports.append(dict(name=name.strip(), self_us=int(self_us), cumulative_us=int(cumulative_us),
+                                depth=(len(name) - len(name.lstrip()) - 1) // 2))
+        except ValueError:
+            # the header line
+            continue
+    return imports
+
+
+def profile_target(target: str, repeat: int = 3) -> dict:
+    """
+    Imports the target in fresh interpreters and returns the fastest run
+    :return: dict with total_ms, per-package and per-module times in ms, the imported lazy packages and the error
+             message if the import failed
+    """
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', import_statement(target)],
+                                 capture_output=True, text=True, cwd=os.getcwd())
+        imports = parse_importtime(process.stderr)
+        total_us = sum(i['cumulative_us'] for i in imports if i['depth'] == 0)
+
+        if process.returncode != 0:
+            error = [line for line in process.stderr.splitlines() if not line.startswith(IMPORTTIME_PREFIX)]
+            return dict(target=target, error=error[-1] if error else f"exit code {process.returncode}",
+                        total_ms=total_us / 1000, packages_ms={}, modules_ms={}, lazy_packages=[])
+
+        if best is None or total_us < best[0]:
+            best = (total_us, imports)
+
+    total_us, imports = best
+
+    packages_us = defaultdict(int)
+    for i in imports:
+        packages_us[i['name'].split('.')[0]] += i['self_us']
+
+    names = {i['name'] for i in imports}
+    lazy_packages = [package for package in LAZY_PACKAGES if package in names]
+
+    return dict(target=target, error=None, total_ms=total_us / 1000,
+                packages_ms={package: us / 1000 for package, us in sorted(packages_us.items(), key=lambda p: -p[1])},
+                modules_ms={i['name']: i['cumulative_us'] / 1000
+                             for i in sorted(imports, key=lambda i: -i['cumulative_us'])},
+                lazy_packages=lazy_packages)
+
+
+def print_result(result: dict, top: int = 10):
+    if result['error'] is not None:
+        print(f"{result['target']:<62} failed: {result['error']}")
+        return
+
+    lazy = f"  loads {', '.join(result['lazy_packages'])}" if result['lazy_packages'] else ''
+    print(f"{result['target']:<62} {result['total_ms']:>9.1f} ms{lazy}")
+    packages = list(result['packages_ms'].items())[:top]
+    print("    packages (self time): " + ", ".join(f"{package} {ms:.1f}" for package, ms in packages))
+    modules = list(result['modules_ms'].items())[:top]
+    print("    imports (cumulative): " + ", ".join(f"{module} {ms:.1f}" for module, ms in modules))
+
+
+def metadata() -> dict:
+    return dict(created=datetime.datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                platform=platform.platform(), machine=platform.machine())
+
+
+def run(targets: List[str], repeat: int = 3, top: int = 10) -> dict:
+    results = []
+    for target in targets:
+        result = profile_target(target, repeat=repeat)
+        results.append(result)
+        print_result(result, top=top)
+    return dict(metadata=metadata(), repeat=repeat, results=results)
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> List[str]:
+    """
+    Compares the import times with a baseline, targets are matched by name
+    :param threshold: relative increase of the import time which is flagged as regression
+    :return: list of regressions
+    """
+    baseline_results: Dict[str, dict] = {result['target']: result for result in baseline['results']}
+    regressions = []
+
+    print(f"\nComparison with the baseline of {baseline.get('metadata', {}).get('created', 'unknown date')}, "
+          f"threshold {threshold:.0%}:")
+
+    for result in results['results']:
+        target = result['target']
+        reference = baseline_results.get(target)
+        if reference is None or reference['error'] is not None or result['error'] is not None:
+            print(f"{target:<62} {'not comparable':>31}")
+            continue
+
+        change = result['total_ms'] / reference['total_ms'] - 1
+        regression = change > threshold
+        if regression:
+            regressions.append(f"{target}: {reference['total_ms']:.1f} ms -> {result['total_ms']:.1f} ms ({change:+.1%})")
+
+        new_lazy_packages = [p for p in result['lazy_packages'] if p not in reference['lazy_packages']]
+        if new_lazy_packages:
+            regressions.append(f"{target}: imports {', '.join(new_lazy_packages)} at startup")
+
+        print(f"{target:<62} {reference['total_ms']:>9.1f} -> {result['total_ms']:<9.1f}{change:+6.0%}"
+              f"{'!' if regression or new_lazy_packages else ' '}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print("\nNo regressions.")
+
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import time report of the main program and the module processes")
+    parser.add_argument('--targets', nargs='+',
+                        help=f"dotted module names to profile (default {MAIN_TARGET} and all modules in modules/)")
+    parser.add_argument('--no-main', action='store_true', help=f"do not profile {MAIN_TARGET}")
+    parser.add_argument('--repeat', type=int, default=3, help="imports per target, the fastest is reported")
+    parser.add_argument('--top', type=int, default=10, help="number of packages and imports listed per target")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--results', help="load the results from this JSON file instead of profiling")
+    parser.add_argument('--compare', help="baseline JSON file to compare the results with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative increase of the import time which is flagged as regression (default 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.results:
+        with open(args.results, 'r') as fp:
+            results = json.load(fp)
+    else:
+        targets = args.targets or ([] if args.no_main else [MAIN_TARGET]) + module_targets()
+        results = run(targets, repeat=args.repeat, top=args.top)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, threshold=args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
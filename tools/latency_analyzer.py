@@ -0,0 +1,127 @@
+"""
+Closed-loop latency report of a recording with latency tracing enabled (globals.LATENCY_TRACING)
+
+Every stage publishes the origin timestamp (timestamp of the raw EEG sample) and the time it was done with each of its
+output samples, see misc.LatencyTracer. The traces of the stages are matched by their origin timestamps and the
+latency percentiles are reported per hop (from the previous stage to this stage) and in total (from the raw sample
+to this stage). The stages are ordered by their median total latency.
+
+Usage:
+    python tools/latency_analyzer.py <file.xdf> [matching tolerance in ms]
+"""
+
+import sys
+import os
+from typing import Dict, Tuple
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import pyxdf
+
+import globals
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_traces(streams: list, stream_name: str = globals.STREAM_NAME_LATENCY_TRACE) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Traces of all stages, streams of the same stage (e.g. of a restarted module) are concatenated
+    :return: dict of stage -> (origin timestamps, stage timestamps) sorted by the origin timestamps
+    """
+    traces = dict()
+    for stream in streams:
+        info = stream['info']
+        if info['name'][0] != stream_name or len(stream['time_stamps']) == 0:
+            continue
+
+        try:
+            stage = info['desc'][0]['stage'][0]
+        except (KeyError, IndexError, TypeError):
+            stage = info['source_id'][0]
+
+        trace = np.asarray(stream['time_series'], dtype=np.float64)
+        traces.setdefault(stage, []).append(trace[np.isfinite(trace).all(axis=1)])
+
+    result = dict()
+    for stage, chunks in traces.items():
+        trace = np.concatenate(chunks)
+        # an origin is traced once per stage, keep the first trace if the stage output the sample more than once
+        origin_timestamps, first = np.unique(trace[:, 0], return_index=True)
+        result[stage] = (origin_timestamps, trace[first, 1])
+
+    return result
+
+
+def match(origin_timestamps: np.ndarray, reference_timestamps: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Indices of the nearest reference timestamp for every origin timestamp, -1 if there is none within the tolerance
+    :param reference_timestamps: sorted timestamps
+    """
+    if len(reference_timestamps) == 0:
+        return np.full(len(origin_timestamps), -1)
+
+    right = np.clip(np.searchsorted(reference_timestamps, origin_timestamps), 1, len(reference_timestamps) - 1)
+    left = right - 1
+    if len(reference_timestamps) == 1:
+        right = left = np.zeros_like(right)
+
+    nearest = np.where(np.abs(reference_timestamps[left] - origin_timestamps)
+                       <= np.abs(reference_timestamps[right] - origin_timestamps), left, right)
+    nearest[np.abs(reference_timestamps[nearest] - origin_timestamps) > tolerance] = -1
+    return nearest
+
+
+def format_latencies(name: str, latencies: np.ndarray, n_total: int) -> str:
+    if len(latencies) == 0:
+        return f"{name:<50.50} {0:>8d} {n_total:>8d}"
+    latencies = latencies * 1000
+    percentiles = np.percentile(latencies, PERCENTILES)
+    return (f"{name:<50.50} {len(latencies):>8d} {n_total:>8d} {np.mean(latencies):>9.2f} "
+            + " ".join(f"{p:>9.2f}" for p in percentiles) + f" {np.max(latencies):>9.2f}")
+
+
+def report(path: str, tolerance: float = 1e-4):
+    streams, header = pyxdf.load_xdf(path, dejitter_timestamps=False)
+    traces = load_traces(streams)
+
+    if not traces:
+        print(f"No {globals.STREAM_NAME_LATENCY_TRACE} streams found in {path}. Record with globals.LATENCY_TRACING enabled.")
+        return
+
+    total = {stage: stage_timestamps - origin_timestamps for stage, (origin_timestamps, stage_timestamps) in traces.items()}
+    stages = sorted(traces, key=lambda stage: np.median(total[stage]))
+
+    print(f"\nFile:\t {path}")
+    print(f"Stages:\t {' -> '.join(stages)}\n")
+
+    header_line = (f"{'':<50} {'matched':>8} {'traced':>8} {'mean [ms]':>9} "
+                   + " ".join(f"{f'p{p} [ms]':>9}" for p in PERCENTILES) + f" {'max [ms]':>9}")
+
+    print("Latency per hop, from the previous stage to the stage:")
+    print(header_line)
+    print(format_latencies(f"raw sample -> {stages[0]}", total[stages[0]], len(total[stages[0]])))
+    for previous, stage in zip(stages[:-1], stages[1:]):
+        origin_timestamps, stage_timestamps = traces[stage]
+        previous_origin_timestamps, previous_stage_timestamps = traces[previous]
+
+        indices = match(origin_timestamps, previous_origin_timestamps, tolerance)
+        matched = indices >= 0
+        hop = stage_timestamps[matched] - previous_stage_timestamps[indices[matched]]
+        print(format_latencies(f"{previous} -> {stage}", hop, len(origin_timestamps)))
+
+    print("\nTotal latency, from the raw sample to the stage:")
+    print(header_line)
+    for stage in stages:
+        print(format_latencies(stage, total[stage], len(total[stage])))
+    print()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    report(sys.argv[1], tolerance=float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 1e-4)